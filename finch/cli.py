@@ -154,3 +154,118 @@ def start(config, bind_host, daemon):
     else:
         # no daemon
         _run(app, bind_host=bind_host)
+
+
+@cli.command("build-descriptions")
+@click.option(
+    "--config", "-c", metavar="PATH", help="path to pywps configuration file."
+)
+@click.option(
+    "--output",
+    "-o",
+    metavar="PATH",
+    help="path of the file, defaults to the `process_descriptions` option.",
+)
+def build_descriptions(config, output):
+    """Precompute the descriptions of the indicator processes.
+
+    The processes are described from this file instead of being built, as long as
+    the versions of finch and xclim and the datasets configuration don't change.
+    """
+    from .processes.descriptions import build_process_descriptions
+
+    wsgi.create_app([config] if config else None)  # Loads the configuration
+    path = build_process_descriptions(output)
+    click.echo(f"process descriptions written to {path}")
+
+
+@cli.command("warm-percentiles")
+@click.option(
+    "--config", "-c", metavar="PATH", help="path to pywps configuration file."
+)
+@click.option(
+    "--dataset",
+    "-d",
+    "dataset_name",
+    help="name of the dataset, defaults to the `default_dataset` option.",
+)
+@click.option(
+    "--variable",
+    "-v",
+    "variables",
+    multiple=True,
+    required=True,
+    help="percentile variable, ex: tasmax_per (repeatable).",
+)
+@click.option(
+    "--perc",
+    "-p",
+    "percentiles",
+    type=int,
+    multiple=True,
+    required=True,
+    help="percentile to compute (repeatable).",
+)
+@click.option(
+    "--scenario",
+    "-s",
+    "scenarios",
+    multiple=True,
+    help="scenario (repeatable), defaults to all scenarios of the dataset.",
+)
+@click.option(
+    "--models", "-m", default="all", help="model or name of a list of models."
+)
+@click.option("--lat", help="latitude of the grid points, comma separated.")
+@click.option("--lon", help="longitude of the grid points, comma separated.")
+@click.option(
+    "--bbox",
+    type=(float, float, float, float),
+    default=None,
+    metavar="LON0 LAT0 LON1 LAT1",
+    help="bounding box, instead of grid points.",
+)
+@click.option("--start-date", help="initial date of the period.")
+@click.option("--end-date", help="final date of the period.")
+def warm_percentiles(
+    config,
+    dataset_name,
+    variables,
+    percentiles,
+    scenarios,
+    models,
+    lat,
+    lon,
+    bbox,
+    start_date,
+    end_date,
+):
+    """Precompute the percentile thresholds of a dataset's members.
+
+    The day-of-year percentiles used by indicators like tx90p are written to the
+    percentile cache, so that the ensemble requests for the same grid points or
+    bounding box, and dates, don't compute them.
+    """
+    import tempfile
+
+    from .processes.ensemble_utils import warm_percentile_cache
+
+    wsgi.create_app([config] if config else None)  # Loads the configuration
+    dataset_name = dataset_name or configuration.get_config_value(
+        "finch", "default_dataset"
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        count = warm_percentile_cache(
+            dataset_name,
+            list(variables),
+            list(percentiles),
+            workdir,
+            scenarios=list(scenarios) or None,
+            models=[models],
+            lat=lat,
+            lon=lon,
+            bbox=bbox,
+            start_date=start_date,
+            end_date=end_date,
+        )
+    click.echo(f"percentiles of {count} members are in the cache")
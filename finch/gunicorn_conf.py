@@ -0,0 +1,37 @@
+"""Gunicorn configuration for finch.
+
+Usage: ``gunicorn -c python:finch.gunicorn_conf finch.wsgi:application``
+
+The application is loaded and warmed up once by the master process, before the workers
+are forked, so that the workers share the imported modules and the process registry
+copy-on-write. Workers are restarted after a number of requests, to contain the memory
+growth of long-lived workers. Other settings can be given on the command line.
+
+Environment variables:
+
+FINCH_MAX_REQUESTS
+    Number of requests after which a worker is restarted, 0 to never restart them (default: 500).
+FINCH_MAX_REQUESTS_JITTER
+    Random number of requests added to `FINCH_MAX_REQUESTS` for each worker, so that they
+    are not all restarted at once (default: a tenth of `FINCH_MAX_REQUESTS`).
+"""
+
+import gc
+import os
+
+preload_app = True
+
+max_requests = int(os.environ.get("FINCH_MAX_REQUESTS", 500))
+max_requests_jitter = int(
+    os.environ.get("FINCH_MAX_REQUESTS_JITTER", max_requests // 10)
+)
+
+
+def when_ready(server):
+    """Warm up the application in the master process, before the workers are forked."""
+    from finch.wsgi import application, warm_up
+
+    warm_up(application)
+    # Objects allocated so far are never collected: the garbage collector doesn't write
+    # to their memory pages, which stay shared with the workers.
+    gc.freeze()
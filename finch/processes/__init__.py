@@ -5,9 +5,10 @@ from pathlib import Path
 from pywps.configuration import get_config_value
 from xclim.core.indicator import registry as xclim_registry
 
+from .descriptions import load_process_descriptions
 from .ensemble_utils import uses_accepted_netcdf_variables
 from .utils import get_available_variables, get_datasets_config, get_virtual_modules
-from .wps_base import make_xclim_indicator_process
+from .wps_base import LazyProcess, make_xclim_indicator_process
 from .wps_ensemble_indices_bbox import XclimEnsembleBboxBase
 from .wps_ensemble_indices_point import XclimEnsembleGridPointBase
 from .wps_ensemble_indices_polygon import XclimEnsemblePolygonBase
@@ -60,8 +61,26 @@ not_implemented = [
 ]
 
 
-def get_processes():
-    """Get wps processes using the current global `pywps` configuration."""
+def get_processes(lazy: bool = True):
+    """Get wps processes using the current global `pywps` configuration.
+
+    Parameters
+    ----------
+    lazy : bool
+      If True, the xclim indicator processes are returned as `LazyProcess` descriptors,
+      built on first use. Building all of them takes seconds and a lot of memory.
+      They are described from the precomputed process descriptions, when up to date.
+    """
+    descriptions = load_process_descriptions() if lazy else {}
+
+    def make_process(ind, suffix, base_class):
+        if not lazy:
+            return make_xclim_indicator_process(ind, suffix, base_class=base_class)
+        identifier = base_class.identifier_prefix + ind.identifier
+        return LazyProcess(
+            ind, suffix, base_class, description=descriptions.get(identifier)
+        )
+
     indicators = get_indicators(
         realms=["atmos", "land", "seaIce"], exclude=not_implemented
     )
@@ -92,9 +111,7 @@ def get_processes():
     for ind in indicators:
         suffix = "_Indicator_Process"
         base_class = XclimIndicatorBase
-        processes.append(
-            make_xclim_indicator_process(ind, suffix, base_class=base_class)
-        )
+        processes.append(make_process(ind, suffix, base_class=base_class))
 
     # Statistical downscaling and bias adjustment
     processes += [EmpiricalQuantileMappingProcess()]
@@ -103,24 +120,18 @@ def get_processes():
     for ind in ensemble_indicators:
         suffix = "_Ensemble_GridPoint_Process"
         base_class = XclimEnsembleGridPointBase
-        processes.append(
-            make_xclim_indicator_process(ind, suffix, base_class=base_class)
-        )
+        processes.append(make_process(ind, suffix, base_class=base_class))
 
     # ensemble with bbox subset
     for ind in ensemble_indicators:
         suffix = "_Ensemble_Bbox_Process"
         base_class = XclimEnsembleBboxBase
-        processes.append(
-            make_xclim_indicator_process(ind, suffix, base_class=base_class)
-        )
+        processes.append(make_process(ind, suffix, base_class=base_class))
     # ensemble with polygon subset
     for ind in ensemble_indicators:
         suffix = "_Ensemble_Polygon_Process"
         base_class = XclimEnsemblePolygonBase
-        processes.append(
-            make_xclim_indicator_process(ind, suffix, base_class=base_class)
-        )
+        processes.append(make_process(ind, suffix, base_class=base_class))
 
     if ensemble_indicators:
         processes += [
@@ -0,0 +1,582 @@
+"""Persistent caches of the data read by the processes."""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import numpy as np
+import xarray as xr
+from pywps.configuration import get_config_value, get_size_mb
+from pywps.exceptions import FileSizeExceeded
+from requests.exceptions import RequestException
+
+from .utils import get_config_size, get_http_session
+
+LOGGER = logging.getLogger("PYWPS")
+
+
+def _to_json(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _is_remote(source: str) -> bool:
+    return source.startswith("http")
+
+
+def _modification_time(source: str) -> Optional[float]:
+    """Return the modification time of a local file or an OPeNDAP url, None if it can't be found."""
+    if _is_remote(source):
+        try:
+            response = get_http_session().head(f"{source}.dds", timeout=5)
+        except RequestException:
+            return None
+        modified = response.headers.get("Last-Modified")
+        if not response.ok or not modified:
+            return None
+        return parsedate_to_datetime(modified).timestamp()
+
+    try:
+        return os.stat(source).st_mtime
+    except OSError:
+        return None
+
+
+@dataclass
+class DatasetMetadata:
+    """Coordinates and structure of a dataset file, as stored in the metadata cache.
+
+    The 1D dimension coordinates and their bounds are kept in their encoded form (with
+    the time units and calendar in their attributes), so that they are decoded exactly
+    like :py:func:`xarray.open_dataset` would. Variable shapes and on-disk chunking
+    are listed in `variables`.
+    """
+
+    source: str
+    mtime: Optional[float]
+    checked: float
+    attrs: Dict[str, Any]
+    dims: Dict[str, int]
+    variables: Dict[str, Dict[str, Any]]
+    data_vars: List[str]
+    coords: Dict[str, xr.Variable] = field(default_factory=dict)
+
+    @classmethod
+    def from_dataset(
+        cls, source: str, ds: xr.Dataset, mtime: Optional[float]
+    ) -> "DatasetMetadata":
+        """Extract the metadata of a dataset, decoded or not."""
+        names = [n for n in ds.dims if n in ds.variables and ds[n].ndim == 1]
+        bounds = {
+            ds[n].attrs["bounds"]: n
+            for n in names
+            if ds[n].attrs.get("bounds") in ds.variables
+        }
+
+        coords = {}
+        for name in names + list(bounds):
+            encoded = xr.conventions.encode_cf_variable(ds.variables[name], name=name)
+            if encoded.dtype.kind not in "iuf":
+                continue
+            if name in bounds:
+                # Decoding gives the bounds the units and calendar of their coordinate,
+                # they are usually not in the file.
+                parent = coords.get(bounds[name])
+                for key in ["units", "calendar"]:
+                    if parent is not None and encoded.attrs.get(
+                        key
+                    ) == parent.attrs.get(key):
+                        encoded.attrs.pop(key, None)
+            coords[name] = encoded
+
+        variables = {
+            name: {
+                "dims": list(var.dims),
+                "shape": list(var.shape),
+                "dtype": str(var.encoding.get("dtype", var.dtype)),
+                "chunksizes": var.encoding.get("chunksizes"),
+            }
+            for name, var in ds.variables.items()
+        }
+        return cls(
+            source=source,
+            mtime=mtime,
+            checked=time.time(),
+            attrs=dict(ds.attrs),
+            dims=dict(ds.sizes),
+            variables=variables,
+            data_vars=list(ds.data_vars),
+            coords=coords,
+        )
+
+    @property
+    def time_encoding(self) -> Dict[str, str]:
+        """Units and calendar of the time coordinate, empty if there is none."""
+        if "time" not in self.coords:
+            return {}
+        attrs = self.coords["time"].attrs
+        return {k: attrs[k] for k in ("units", "calendar") if k in attrs}
+
+    def coordinates(self, decode_times: bool = True) -> xr.Dataset:
+        """Return the cached coordinates, decoded."""
+        return xr.decode_cf(xr.Dataset(self.coords), decode_times=decode_times)
+
+    def restore(self, ds: xr.Dataset, decode_times: bool = True) -> xr.Dataset:
+        """Add the cached coordinates to a dataset opened without them (see `drop_variables`)."""
+        cached = self.coordinates(decode_times=decode_times)
+        ds = ds.assign_coords({name: cached[name] for name in cached.coords})
+        ds = ds.assign({name: cached[name] for name in cached.data_vars})
+        # Put the variables back in their original order
+        return ds[[name for name in self.variables if name in ds.variables]]
+
+    def save(self, path: Path) -> None:
+        """Write the metadata to a file, atomically."""
+        meta = {
+            "source": self.source,
+            "mtime": self.mtime,
+            "checked": self.checked,
+            "attrs": self.attrs,
+            "dims": self.dims,
+            "variables": self.variables,
+            "data_vars": self.data_vars,
+            "coords": {
+                name: {"dims": list(var.dims), "attrs": var.attrs}
+                for name, var in self.coords.items()
+            },
+        }
+        arrays = {f"coord_{name}": var.values for name, var in self.coords.items()}
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, suffix=".tmp", delete=False
+        ) as f:
+            try:
+                np.savez(f, __meta__=json.dumps(meta, default=_to_json), **arrays)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["DatasetMetadata"]:
+        """Read metadata written by `save`, None if the file is missing or unreadable."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["__meta__"]))
+                coords = {
+                    name: xr.Variable(
+                        var["dims"],
+                        data[f"coord_{name}"],
+                        {
+                            k: np.array(v) if isinstance(v, list) else v
+                            for k, v in var["attrs"].items()
+                        },
+                    )
+                    for name, var in meta.pop("coords").items()
+                }
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(coords=coords, **meta)
+
+
+class MetadataCache:
+    """Sidecar files holding the coordinates and structure of dataset files.
+
+    Entries are keyed by the url or path of the file, and are valid as long as its modification
+    time doesn't change. For OPeNDAP urls, the modification time is checked with a HEAD request,
+    at most every `ttl` seconds.
+
+    Parameters
+    ----------
+    root : Path
+        Directory where the sidecar files are written.
+    ttl : float
+        Number of seconds during which the entries for remote files are used without being checked.
+    """
+
+    def __init__(self, root: Path, ttl: float):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, source: str) -> Path:
+        return self.root / f"{hashlib.sha1(source.encode()).hexdigest()}.npz"
+
+    def get(self, source: str) -> Optional[DatasetMetadata]:
+        """Return the metadata of a file, None if it isn't cached or the file was modified."""
+        metadata = DatasetMetadata.load(self._path(source))
+        if metadata is None or metadata.source != source:
+            return None
+
+        if _is_remote(source) and time.time() - metadata.checked < self.ttl:
+            return metadata
+
+        mtime = _modification_time(source)
+        if mtime is None or mtime != metadata.mtime:
+            return None
+        if _is_remote(source):
+            metadata.checked = time.time()
+            self._save(metadata)
+        return metadata
+
+    def put(self, source: str, ds: xr.Dataset) -> Optional[DatasetMetadata]:
+        """Cache the metadata of a dataset opened from `source`."""
+        try:
+            metadata = DatasetMetadata.from_dataset(
+                source, ds, mtime=_modification_time(source)
+            )
+        except (TypeError, ValueError):
+            LOGGER.warning(f"Could not extract the metadata of {source}", exc_info=True)
+            return None
+        self._save(metadata)
+        return metadata
+
+    def _save(self, metadata: DatasetMetadata) -> None:
+        try:
+            metadata.save(self._path(metadata.source))
+        except (OSError, TypeError, ValueError):
+            LOGGER.warning(
+                f"Could not write the metadata of {metadata.source}", exc_info=True
+            )
+
+
+def get_metadata_cache() -> Optional[MetadataCache]:
+    """Return the metadata cache, None if it is disabled in the configuration."""
+    ttl = float(get_config_value("finch", "metadata_cache_ttl") or 3600)
+    if ttl <= 0:
+        return None
+    root = get_config_value("finch", "metadata_cache_dir") or Path(
+        tempfile.gettempdir(), "finch_metadata_cache"
+    )
+    return MetadataCache(root, ttl)
+
+
+def _touch(path: Path) -> None:
+    """Mark a cached file as used, by setting its access time.
+
+    The modification time is kept: the metadata cache uses it to validate its entries.
+    """
+    try:
+        os.utime(path, (time.time(), path.stat().st_mtime))
+    except OSError:
+        pass
+
+
+def _evict_lru(directory: Path, max_size: int, keep: Optional[Path] = None) -> None:
+    """Remove the least recently used files of a directory until it's under `max_size` bytes.
+
+    Files are used when they are written, or touched with `_touch` (access time).
+    """
+    objects = []
+    for path in directory.iterdir():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        objects.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+
+    total = sum(size for _, size, _ in objects)
+    for _, size, path in sorted(objects):
+        if total <= max_size:
+            break
+        if path == keep or path.suffix == ".tmp":
+            continue
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+class DownloadCache:
+    """Shared on-disk cache of files downloaded over HTTP.
+
+    Files are stored under the sha256 of their content, and each url points to the file it was
+    last resolved to. Cached urls are revalidated with a conditional request (`ETag` or
+    `Last-Modified`), so an unchanged file isn't downloaded again. Downloads of the same url are
+    serialized with a file lock, so that concurrent jobs, in any worker, download it only once.
+    When the cache grows over `max_size` bytes, the least recently used files are removed.
+
+    Parameters
+    ----------
+    root : Path
+        Directory of the cache, which can be shared by several workers.
+    max_size : int
+        Maximum size of the cached files, in bytes.
+    """
+
+    def __init__(self, root: Path, max_size: int):
+        self.root = Path(root)
+        self.max_size = max_size
+        for sub in ["objects", "urls", "locks"]:
+            (self.root / sub).mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _locked(self, key: str):
+        with open(self.root / "locks" / key, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads((self.root / "urls" / f"{key}.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, key: str, entry: Dict[str, Any]) -> None:
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.root / "urls", suffix=".tmp", delete=False
+        ) as f:
+            json.dump(entry, f)
+        os.replace(f.name, self.root / "urls" / f"{key}.json")
+
+    @staticmethod
+    def _link(
+        path: Path, directory: Optional[Union[str, Path]], name: Optional[str] = None
+    ) -> Optional[Path]:
+        """Hard link a cached file into a directory, so it stays available if it's evicted.
+
+        Returns None if the file doesn't exist anymore. Falls back to the cached file
+        itself if there is no directory or the link can't be created.
+        """
+        if not directory:
+            return path if path.exists() else None
+        target = Path(directory) / (name or path.name)
+        try:
+            os.link(path, target)
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            if not path.exists():
+                return None
+            return path
+        except OSError:
+            return path
+        return target
+
+    def _store(
+        self,
+        response,
+        suffix: str,
+        max_bytes: int,
+        directory: Optional[Union[str, Path]] = None,
+    ) -> Tuple[Path, Path]:
+        """Write the body of a response to the cache, atomically.
+
+        The file is linked into `directory` before it's added to the cache, where it
+        could be evicted. Returns the path of the cached file and of its link.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(
+            dir=self.root / "objects", suffix=".tmp", delete=False
+        ) as f:
+            try:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    size += len(chunk)
+                    if 0 < max_bytes < size:
+                        raise FileSizeExceeded(
+                            f"File size for {response.url} exceeded. Maximum allowed: {max_bytes} bytes."
+                        )
+                    digest.update(chunk)
+                    f.write(chunk)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        path = self.root / "objects" / f"{digest.hexdigest()}{suffix}"
+        local = self._link(Path(f.name), directory, name=path.name)
+        os.replace(f.name, path)
+        return path, path if local == Path(f.name) else local
+
+    def fetch(self, url: str, max_bytes: Optional[int] = None) -> Path:
+        """Return the path of the cached copy of a url, downloading it if it's missing or outdated.
+
+        Downloads larger than `max_bytes` (if > 0) raise :py:class:`pywps.exceptions.FileSizeExceeded`.
+        Defaults to the `maxsingleinputsize` of the server configuration, like pywps' own downloads.
+        The returned file is shared: it must not be modified, and it can be evicted by other
+        jobs, see `fetch_linked`.
+        """
+        return self.fetch_linked(url, None, max_bytes)[0]
+
+    def fetch_linked(
+        self,
+        url: str,
+        directory: Optional[Union[str, Path]],
+        max_bytes: Optional[int] = None,
+    ) -> Tuple[Path, Path]:
+        """Fetch a url like `fetch`, and hard link the cached copy into `directory`.
+
+        The link is made while the url is locked and before the cache is evicted, so that the
+        file can't be removed by another job in between. Returns the path of the cached file
+        and of its link, which is the cached file itself if it can't be linked.
+        """
+        if max_bytes is None:
+            max_size = get_config_value("server", "maxsingleinputsize") or "0mb"
+            max_bytes = int(get_size_mb(max_size) * 1024**2)
+
+        key = hashlib.sha1(url.encode()).hexdigest()
+        with self._locked(key):
+            entry = self._read_entry(key)
+            cached = self.root / "objects" / entry["object"] if entry else None
+
+            headers = {}
+            if cached is not None and cached.exists():
+                if entry.get("etag"):
+                    headers["If-None-Match"] = entry["etag"]
+                if entry.get("last_modified"):
+                    headers["If-Modified-Since"] = entry["last_modified"]
+
+            while True:
+                with get_http_session().get(
+                    url, headers=headers, stream=True, timeout=60
+                ) as response:
+                    if headers and response.status_code == 304:
+                        local = self._link(cached, directory)
+                        if local is None:
+                            # Evicted since it was checked, download it again
+                            headers = {}
+                            continue
+                        LOGGER.debug(f"Download cache hit for {url}")
+                        _touch(cached)
+                        return cached, local
+                    response.raise_for_status()
+                    path, local = self._store(
+                        response, Path(urlparse(url).path).suffix, max_bytes, directory
+                    )
+                break
+
+            self._write_entry(
+                key,
+                {
+                    "url": url,
+                    "object": path.name,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                },
+            )
+
+        self.evict(keep=path)
+        return path, local
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        """Remove the least recently used files until the cache is under its maximum size."""
+        _evict_lru(self.root / "objects", self.max_size, keep)
+
+
+def get_download_cache() -> Optional[DownloadCache]:
+    """Return the download cache, None if it is disabled in the configuration."""
+    size = get_config_size("download_cache_size", "10gb")
+    if size <= 0:
+        return None
+    root = get_config_value("finch", "download_cache_dir") or Path(
+        tempfile.gettempdir(), "finch_download_cache"
+    )
+    return DownloadCache(root, size)
+
+
+def _array_bytes(values: np.ndarray) -> bytes:
+    if values.dtype.kind == "O":
+        values = values.astype(str)
+    return np.ascontiguousarray(values).tobytes()
+
+
+class PercentileCache:
+    """Shared on-disk cache of the day-of-year percentiles of a variable (the ``*_per`` variables).
+
+    Entries are addressed by a fingerprint of the data they are computed from: its units,
+    the bounds of its time coordinate, its other coordinates and its values, along with the
+    percentile and window. The values are hashed rather than trusting the name of the file
+    they come from, which can be rewritten upstream. The cache is filled
+    by the ensemble processes and by ``finch warm-percentiles``. When it grows over
+    `max_size` bytes, the least recently used entries are removed.
+
+    Parameters
+    ----------
+    root : Path
+        Directory of the cache, which can be shared by several workers.
+    max_size : int
+        Maximum size of the cached entries, in bytes.
+    """
+
+    # Changes when the way the percentiles are computed changes
+    VERSION = 3
+
+    def __init__(self, root: Path, max_size: int):
+        self.root = Path(root)
+        self.max_size = max_size
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def key(self, da: xr.DataArray, per: int, window: int) -> str:
+        """Return the key of the percentiles of `da`, which reads its values."""
+        time = da.indexes["time"]
+        digest = hashlib.sha256()
+        header = {
+            "version": self.VERSION,
+            "per": per,
+            "window": window,
+            "units": da.attrs.get("units"),
+            "dims": da.dims,
+            "shape": da.shape,
+            "dtype": str(da.dtype),
+            "calendar": da.time.dt.calendar,
+            "bounds": [str(time[0]), str(time[-1])],
+        }
+        digest.update(json.dumps(header, default=str).encode())
+        for name in sorted(map(str, da.coords)):
+            if "time" not in da[name].dims:
+                digest.update(name.encode())
+                digest.update(_array_bytes(da[name].values))
+        digest.update(_array_bytes(da.time.dt.dayofyear.values))
+        digest.update(_array_bytes(da.values))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.nc"
+
+    def get(self, key: str) -> Optional[xr.DataArray]:
+        """Return the cached percentiles, None if they aren't cached."""
+        path = self._path(key)
+        try:
+            with xr.open_dataarray(path) as da:
+                da = da.load()
+        except (OSError, ValueError):
+            return None
+        _touch(path)
+        return da
+
+    def put(self, key: str, da: xr.DataArray) -> None:
+        """Write computed percentiles to the cache, atomically."""
+        with tempfile.NamedTemporaryFile(
+            dir=self.root, suffix=".tmp", delete=False
+        ) as f:
+            pass
+        try:
+            da.to_netcdf(f.name)
+            os.replace(f.name, self._path(key))
+        except (OSError, TypeError, ValueError):
+            Path(f.name).unlink(missing_ok=True)
+            LOGGER.warning("Could not write percentiles to the cache", exc_info=True)
+            return
+        _evict_lru(self.root, self.max_size, keep=self._path(key))
+
+
+def get_percentile_cache() -> Optional[PercentileCache]:
+    """Return the percentile cache, None if it is disabled in the configuration."""
+    size = get_config_size("percentile_cache_size", "1gb")
+    if size <= 0:
+        return None
+    root = get_config_value("finch", "percentile_cache_dir") or Path(
+        tempfile.gettempdir(), "finch_percentile_cache"
+    )
+    return PercentileCache(root, size)
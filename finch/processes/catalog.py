@@ -0,0 +1,310 @@
+"""Discovery and indexing of the files available in the ensemble datasets."""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from pywps.configuration import get_config_value
+
+from .executor import host_limit
+from .utils import DatasetConfiguration, get_http_session
+
+if TYPE_CHECKING:
+    from siphon.catalog import CatalogRef, TDSCatalog
+
+LOGGER = logging.getLogger("PYWPS")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    variable TEXT,
+    scenario TEXT,
+    model TEXT,
+    realization TEXT
+);
+CREATE INDEX IF NOT EXISTS files_lookup ON files (variable, model, realization, scenario);
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def iter_remote(cat: "TDSCatalog", depth: int = -1):
+    """Create generator listing all datasets recursively in a TDSCatalog.
+
+    The search is limited to a certain depth if `depth` >= 0.
+    """
+    for ds in cat.datasets.values():
+        yield ds.name, ds.access_urls["OPENDAP"]
+
+    if depth != 0:
+        for subcat in cat.catalog_refs.values():
+            yield from iter_remote(subcat.follow(), depth=depth - 1)
+
+
+def _fetch_catalog(ref: Union[str, "CatalogRef"]) -> "TDSCatalog":
+    """Fetch and parse a THREDDS catalog, reusing the pooled connections of the shared HTTP session."""
+    from siphon.catalog import CatalogRef, TDSCatalog
+    from siphon.http_util import session_manager
+
+    # siphon creates a new session for each catalog, but they can share our adapters,
+    # which hold the connection pools and the retry policy.
+    session_manager.set_session_options(adapters=get_http_session().adapters)
+    with host_limit(ref.href if isinstance(ref, CatalogRef) else ref):
+        if isinstance(ref, CatalogRef):
+            return ref.follow()
+        return TDSCatalog(ref)
+
+
+def _iter_crawled(pool: ThreadPoolExecutor, future: Future, depth: int):
+    cat = future.result()
+
+    # Schedule the sub-catalogs before yielding, so they are fetched while the consumer works.
+    subcats = []
+    if depth != 0:
+        subcats = [
+            pool.submit(_fetch_catalog, ref) for ref in cat.catalog_refs.values()
+        ]
+
+    for ds in cat.datasets.values():
+        yield ds.name, ds.access_urls["OPENDAP"]
+
+    for subcat in subcats:
+        yield from _iter_crawled(pool, subcat, depth=depth - 1)
+
+
+def iter_remote_concurrent(url: str, depth: int = -1, workers: Optional[int] = None):
+    """Create generator listing all datasets recursively in a THREDDS catalog, fetching sub-catalogs concurrently.
+
+    The datasets are yielded in the same order as :py:func:`iter_remote`. At most `workers`
+    catalogs are fetched at the same time, defaulting to the `catalog_workers` configuration value.
+    The search is limited to a certain depth if `depth` >= 0.
+    """
+    workers = workers or int(get_config_value("finch", "catalog_workers") or 8)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="finch-crawler")
+    try:
+        yield from _iter_crawled(pool, pool.submit(_fetch_catalog, url), depth)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_local(root: Path, depth: int = -1, pattern: str = "*.nc"):
+    """Create generator listing all datasets recursively in a local directory.
+
+    The search is limited to a certain depth if `depth` >= 0.
+    The path can be given relative to the root finch code repo.
+    """
+    if not root.is_absolute():
+        root = (Path(__file__).parent.parent / root).resolve()
+
+    for file in root.glob(pattern):
+        yield file.name, file
+
+    if depth != 0:
+        for sub in root.iterdir():
+            if sub.is_dir():
+                yield from iter_local(sub, depth=depth - 1, pattern=pattern)
+
+
+def iter_dataset(dsconf: DatasetConfiguration):
+    """Create generator listing all files of a dataset, as (name, url or path) tuples."""
+    if dsconf.local:
+        return iter_local(Path(dsconf.path), dsconf.depth, dsconf.suffix)
+    return iter_remote_concurrent(dsconf.path, depth=dsconf.depth)
+
+
+def resolve_models(
+    models: Optional[List[str]], model_lists: Optional[Dict[str, list]] = None
+) -> Optional[List[Union[str, Tuple[str, str]]]]:
+    """Resolve the requested models into a list of model names or (model, realization) pairs.
+
+    Returns None when all models are requested.
+    """
+    if models is None or models[0].lower() == "all":
+        return None
+
+    if (
+        len(models) == 1
+        and isinstance(models[0], str)
+        and model_lists is not None
+        and models[0].lower() in model_lists
+    ):
+        return model_lists[models[0].lower()]
+    return models
+
+
+class CatalogIndex:
+    """On-disk index of the files of a dataset, stored in a SQLite database.
+
+    The file names are parsed with the dataset's pattern once, when the index is built,
+    so that selecting files for a request is a single indexed query. When the index is
+    older than `ttl` seconds, it is rebuilt in a background thread while lookups keep
+    being served from the previous version.
+
+    Parameters
+    ----------
+    dsconf : DatasetConfiguration
+        The dataset to index.
+    path : Path
+        The SQLite database file.
+    ttl : float
+        Number of seconds after which the index is considered stale.
+    """
+
+    def __init__(self, dsconf: DatasetConfiguration, path: Path, ttl: float):
+        self.dsconf = dsconf
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as con:
+            con.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=60)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    @property
+    def updated(self) -> Optional[float]:
+        """Timestamp of the last refresh of the index, None if it was never built."""
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT value FROM info WHERE key = 'updated'").fetchone()
+        return float(row[0]) if row else None
+
+    def refresh(self) -> int:
+        """Crawl the dataset and replace the content of the index. Return the number of indexed files."""
+        pattern = self.dsconf.compiled_pattern
+        rows = []
+        for name, url in iter_dataset(self.dsconf):
+            match = pattern.parse(name)
+            if not match:
+                continue
+            fields = match.named
+            rows.append(
+                (
+                    name,
+                    str(url),
+                    fields.get("variable"),
+                    fields.get("scenario"),
+                    fields.get("model", "").lower(),
+                    fields.get("realization"),
+                )
+            )
+
+        with closing(self._connect()) as con, con:
+            con.execute("DELETE FROM files")
+            con.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+            con.execute(
+                "INSERT OR REPLACE INTO info VALUES ('updated', ?)", (str(time.time()),)
+            )
+        LOGGER.info(f"Indexed {len(rows)} files from {self.dsconf.path}")
+        return len(rows)
+
+    def refresh_in_background(self) -> None:
+        """Start refreshing the index in a daemon thread, unless a refresh is already running."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._background_refresh, name="finch-catalog-index", daemon=True
+            )
+            self._thread.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:  # noqa
+            LOGGER.exception(
+                f"Refreshing the catalog index of {self.dsconf.path} failed."
+            )
+
+    def ensure_fresh(self) -> None:
+        """Build the index if it doesn't exist, or schedule a refresh if it is stale."""
+        updated = self.updated
+        if updated is None:
+            self.refresh()
+        elif time.time() - updated > self.ttl:
+            self.refresh_in_background()
+
+    def select(
+        self,
+        variables: Optional[List[str]] = None,
+        scenario: Optional[str] = None,
+        models: Optional[List[str]] = None,
+    ) -> List[Tuple[str, str]]:
+        """Return the (name, url) of the indexed files matching the filters.
+
+        The filters behave like those of :py:func:`finch.processes.ensemble_utils.file_is_required`.
+        """
+        self.ensure_fresh()
+
+        clauses = []
+        params = []
+        if variables:
+            clauses.append(f"variable IN ({', '.join('?' * len(variables))})")
+            params.extend(variables)
+        if scenario:
+            clauses.append("instr(scenario, ?) > 0")
+            params.append(scenario)
+
+        modelspecs = resolve_models(models, self.dsconf.model_lists)
+        if modelspecs is not None:
+            model_clauses = []
+            for modelspec in modelspecs:
+                if isinstance(modelspec, str):  # case with a single model name
+                    model_clauses.append(
+                        "(model = ? AND (realization IS NULL OR substr(realization, 1, 3) = 'r1i'))"
+                    )
+                    params.append(modelspec.lower())
+                else:  # case with a couple model name, realization num.
+                    model_clauses.append("(model = ? AND realization = ?)")
+                    params.extend([modelspec[0].lower(), modelspec[1]])
+            clauses.append(f"({' OR '.join(model_clauses) or '0'})")
+
+        query = "SELECT name, url FROM files"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY rowid"
+
+        with closing(self._connect()) as con:
+            return con.execute(query, params).fetchall()
+
+
+_indexes: Dict[str, CatalogIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _dataset_key(dsconf: DatasetConfiguration) -> str:
+    """Hash of the configuration fields that determine the content of the index."""
+    fields = [dsconf.path, dsconf.pattern, dsconf.local, dsconf.depth, dsconf.suffix]
+    return hashlib.sha1(json.dumps(fields).encode()).hexdigest()
+
+
+def get_catalog_index(dsconf: DatasetConfiguration) -> Optional[CatalogIndex]:
+    """Return the catalog index of a dataset, None if indexing is disabled in the configuration."""
+    ttl = float(get_config_value("finch", "catalog_index_ttl") or 3600)
+    if ttl <= 0:
+        return None
+
+    root = get_config_value("finch", "catalog_index_dir") or Path(
+        tempfile.gettempdir(), "finch_catalog_index"
+    )
+    key = _dataset_key(dsconf)
+    path = Path(root) / f"{key}.sqlite"
+
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None or index.path != path:
+            index = _indexes[key] = CatalogIndex(dsconf, path, ttl)
+        index.ttl = ttl
+    return index
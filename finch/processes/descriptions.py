@@ -0,0 +1,124 @@
+"""Precomputed descriptions of the xclim indicator processes.
+
+Describing the indicator processes (pywps inputs and outputs, translations) takes
+seconds, but only changes with the versions of finch and xclim, and with the
+configured datasets and xclim modules. `build_process_descriptions` serializes them
+to a JSON file, built once with ``finch build-descriptions``, that `get_processes`
+loads to describe the processes without building them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Optional
+
+import xclim
+from pywps.configuration import get_config_value
+
+from finch.__version__ import __version__
+
+from .utils import get_datasets_config
+
+LOGGER = logging.getLogger("PYWPS")
+
+# Version of the file's structure
+FORMAT_VERSION = 1
+
+
+def descriptions_path() -> Path:
+    """Return the path of the process descriptions, from `process_descriptions`.
+
+    Defaults to `process_descriptions.json` in the finch package.
+    """
+    path = get_config_value("finch", "process_descriptions")
+    if not path:
+        return Path(__file__).parent.parent / "process_descriptions.json"
+    return Path(path)
+
+
+def config_fingerprint() -> str:
+    """Return a hash of the configuration the process descriptions depend on.
+
+    The inputs of the ensemble processes are built from the datasets configuration,
+    and the xclim modules define additional indicators.
+    """
+    datasets = {name: asdict(conf) for name, conf in get_datasets_config().items()}
+    modules = {}
+    for modfile in filter(None, get_config_value("finch", "xclim_modules").split(",")):
+        path = Path(modfile)
+        if not path.is_absolute():
+            path = Path(__file__).parent.parent / path
+        modules[modfile] = {
+            p.name: hashlib.sha256(p.read_bytes()).hexdigest()
+            for p in sorted(path.parent.glob(f"{path.name}.*"))
+        }
+    content = json.dumps({"datasets": datasets, "xclim_modules": modules}, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _header() -> Dict:
+    return {
+        "format": FORMAT_VERSION,
+        "finch": __version__,
+        "xclim": xclim.__version__,
+        "config": config_fingerprint(),
+    }
+
+
+def build_process_descriptions(path: Optional[os.PathLike] = None) -> Path:
+    """Describe the xclim indicator processes and write them to a JSON file.
+
+    Parameters
+    ----------
+    path : path, optional
+      Path of the file. Defaults to `descriptions_path()`.
+    """
+    from . import get_processes
+
+    path = Path(path or descriptions_path())
+    processes = {}
+    for process in get_processes(lazy=False):
+        # Only the xclim indicator processes are built lazily
+        if getattr(process, "xci", None) is not None:
+            description = process.json
+            # These attributes are specific to each instance
+            del description["uuid"], description["workdir"]
+            processes[process.identifier] = description
+
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        json.dump({**_header(), "processes": processes}, f)
+    os.replace(tmp_path, path)
+    LOGGER.info(f"Wrote the descriptions of {len(processes)} processes to {path}.")
+    return path
+
+
+def load_process_descriptions() -> Dict[str, Dict]:
+    """Return the process descriptions, keyed by process identifier.
+
+    Returns an empty dict if the file doesn't exist, or doesn't match the installed
+    versions of finch and xclim or the configuration. The processes are then described
+    by building them.
+    """
+    path = descriptions_path()
+    try:
+        with open(path) as f:
+            content = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        LOGGER.warning(f"Could not read the process descriptions {path}: {err}")
+        return {}
+
+    header = _header()
+    stale = [key for key, value in header.items() if content.get(key) != value]
+    if stale:
+        LOGGER.info(
+            f"The process descriptions {path} are outdated ({', '.join(stale)}), "
+            "run `finch build-descriptions` to update them."
+        )
+        return {}
+    return content["processes"]
@@ -1,39 +1,72 @@
 # noqa: D100
 import logging
-import sys
+import re
+import threading
 import warnings
 from collections import deque
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlparse
 
+import numpy as np
 import pandas as pd
+import parse
 import xarray as xr
-from pandas.api.types import is_numeric_dtype
-from parse import parse
 from pywps import FORMATS, ComplexInput, Process
 from pywps.app.exceptions import ProcessError
+from pywps.configuration import get_config_value
 from pywps.exceptions import InvalidParameterValue
-from siphon.catalog import TDSCatalog
 from xclim import ensembles
-from xclim.core.calendar import days_since_to_doy, doy_to_days_since, percentile_doy
+from xclim.core.calendar import (
+    days_since_to_doy,
+    doy_to_days_since,
+    get_calendar,
+    percentile_doy,
+)
 from xclim.core.indicator import Indicator
 from xclim.indicators.atmos import tg
 
-from .subset import finch_subset_bbox, finch_subset_gridpoint, finch_subset_shape
+from . import wpsio
+from .cache import get_percentile_cache
+from .catalog import (  # noqa: F401
+    get_catalog_index,
+    iter_dataset,
+    iter_local,
+    iter_remote,
+    resolve_models,
+)
+from .executor import map_concurrently
+from .subset import (
+    finch_subset_bbox,
+    finch_subset_gridpoint,
+    finch_subset_shape,
+    make_subset_file_name,
+    subset_netcdf_inputs,
+)
 from .utils import (
     DatasetConfiguration,
+    IntermediateDatasets,
+    JobLog,
+    ModelSet,
     PywpsInput,
     RequestInputs,
     compute_indices,
-    dataset_to_dataframe,
+    dataframes_to_csv,
+    dataframes_to_parquet,
     dataset_to_netcdf,
     format_metadata,
     get_datasets_config,
+    get_job_log,
+    iter_dataframes,
     iter_xc_variables,
     log_file_path,
+    make_model_set,
+    register_opendap_url,
     single_input_or_none,
+    try_opendap,
     valid_filename,
     write_log,
     zip_files,
@@ -43,8 +76,25 @@ from .wps_base import make_nc_input
 LOGGER = logging.getLogger("PYWPS")
 
 
+# Window of the day-of-year percentiles, in days
+PERCENTILE_WINDOW = 5
+
+
 def _percentile_doy(var: xr.DataArray, perc: int) -> xr.DataArray:
-    return percentile_doy(var, per=perc).sel(percentiles=perc, drop=True)
+    """Return the day-of-year percentile of a variable, from the percentile cache if it's there."""
+    cache = get_percentile_cache()
+    if cache is None:
+        return percentile_doy(var, window=PERCENTILE_WINDOW, per=perc).sel(
+            percentiles=perc, drop=True
+        )
+
+    key = cache.key(var, perc, PERCENTILE_WINDOW)
+    out = cache.get(key)
+    if out is None:
+        out = percentile_doy(var, window=PERCENTILE_WINDOW, per=perc)
+        out = out.sel(percentiles=perc, drop=True).load()
+        cache.put(key, out)
+    return out
 
 
 variable_computations = {
@@ -76,86 +126,112 @@ class Dataset:  # noqa: D101
 
     @classmethod
     def from_filename(cls, filename, pattern):  # noqa: D102
-        match = parse(pattern, filename)
+        match = _compile_pattern(pattern).parse(filename)
         if not match:
             return None
         return cls(**match.named)
 
 
-def file_is_required(
-    filename: str,
-    pattern: str,
-    model_lists: Optional[Dict[str, List[str]]] = None,
-    variables: List[str] = None,
-    scenario: str = None,
-    models: List[Union[str, Tuple[str, int]]] = None,
-):
-    """Parse metadata and filter datasets."""
-    file = Dataset.from_filename(filename, pattern)
-    if not file:
-        return False
+@lru_cache(maxsize=32)
+def _compile_pattern(pattern: Union[str, parse.Parser]) -> parse.Parser:
+    if isinstance(pattern, parse.Parser):
+        return pattern
+    return parse.compile(pattern)
 
-    if variables and file.variable not in variables:
-        return False
 
-    if scenario and scenario not in file.scenario:
-        return False
+class FileMatcher:
+    """Filter of file names on their variable, scenario and model.
 
-    if models is None or models[0].lower() == "all":
-        return True
+    The pattern is compiled and the requested models are resolved once, so that
+    matching a file name is a parse of the compiled pattern and a few set lookups.
 
-    if (
-        len(models) == 1
-        and isinstance(models[0], str)
-        and model_lists is not None
-        and models[0].lower() in model_lists
-    ):
-        models = model_lists[models[0]]
+    Parameters
+    ----------
+    pattern : str or parse.Parser
+        The pattern of the file names.
+    model_lists : dict, optional
+        A mapping from list name to a list of models, see :py:class:`DatasetConfiguration`.
+    variables : list of strings, optional
+        The needed variables.
+    scenario : str, optional
+        The name of the scenario, matched as a substring of the file's scenario.
+    models : list, optional
+        The requested models, or the name of a models sublist.
+    model_sets : dict, optional
+        The model lists already resolved by :py:func:`make_model_set`, keyed by lowercase name.
+    """
 
-    for modelspec in models:
-        if isinstance(modelspec, str):  # case with a single model name
-            if file.model.lower() == modelspec.lower() and (
-                file.realization is None or file.realization.startswith("r1i")
-            ):
-                return True
-        else:  # case with a couple model name, realization num.
-            if (
-                file.model.lower() == modelspec[0].lower()
-                and file.realization == modelspec[1]
-            ):
-                return True
-    return False
+    def __init__(
+        self,
+        pattern: Union[str, parse.Parser],
+        model_lists: Optional[Dict[str, list]] = None,
+        variables: Optional[List[str]] = None,
+        scenario: Optional[str] = None,
+        models: Optional[List[Union[str, Tuple[str, str]]]] = None,
+        model_sets: Optional[Dict[str, ModelSet]] = None,
+    ):
+        self.pattern = _compile_pattern(pattern)
+        self.variables = frozenset(variables) if variables else None
+        self.scenario = scenario or None
+
+        self.model_set: Optional[ModelSet] = None
+        modelspecs = resolve_models(models, model_lists)
+        if modelspecs is not None:
+            if model_sets is not None and modelspecs is not models:
+                # A named list of models, already resolved
+                self.model_set = model_sets[models[0].lower()]
+            else:
+                self.model_set = make_model_set(modelspecs)
 
+    @classmethod
+    def for_dataset(cls, dsconf: DatasetConfiguration, **filters) -> "FileMatcher":
+        """Create a matcher using the compiled pattern and resolved model lists of a dataset."""
+        return cls(
+            dsconf.compiled_pattern,
+            dsconf.model_lists,
+            model_sets=dsconf.model_sets,
+            **filters,
+        )
 
-def iter_remote(cat: TDSCatalog, depth: int = -1):
-    """Create generator listing all datasets recursively in a TDSCatalog.
+    def __call__(self, filename: str) -> bool:
+        """Return whether the file name matches the pattern and the filters."""
+        result = self.pattern.parse(filename)
+        if result is None:
+            return False
+        fields = result.named
 
-    The search is limited to a certain depth if `depth` >= 0.
-    """
-    for ds in cat.datasets.values():
-        yield ds.name, ds.access_urls["OPENDAP"]
+        if self.variables is not None and fields["variable"] not in self.variables:
+            return False
 
-    if depth != 0:
-        for subcat in cat.catalog_refs.values():
-            yield from iter_remote(subcat.follow(), depth=depth - 1)
+        if self.scenario is not None and self.scenario not in fields["scenario"]:
+            return False
 
+        if self.model_set is None:
+            return True
 
-def iter_local(root: Path, depth: int = -1, pattern: str = "*.nc"):
-    """Create generator listing all datasets recursively in a local directory.
+        names, pairs = self.model_set
+        model = fields["model"].lower()
+        realization = fields.get("realization")
+        if model in names and (realization is None or realization.startswith("r1i")):
+            return True
+        return (model, realization) in pairs
 
-    The search is limited to a certain depth if `depth` >= 0.
-    The path can be given relative to the root finch code repo.
-    """
-    if not root.is_absolute():
-        root = (Path(__file__).parent.parent / root).resolve()
 
-    for file in root.glob(pattern):
-        yield file.name, file
+def file_is_required(
+    filename: str,
+    pattern: str,
+    model_lists: Optional[Dict[str, List[str]]] = None,
+    variables: List[str] = None,
+    scenario: str = None,
+    models: List[Union[str, Tuple[str, int]]] = None,
+):
+    """Parse metadata and filter datasets.
 
-    if depth != 0:
-        for sub in root.iterdir():
-            if sub.is_dir():
-                yield from iter_local(sub, depth=depth - 1, pattern=pattern)
+    To filter many files, create a single :py:class:`FileMatcher` instead.
+    """
+    return FileMatcher(
+        pattern, model_lists, variables=variables, scenario=scenario, models=models
+    )(filename)
 
 
 def _make_resource_input(url: str, workdir: str, local: bool):
@@ -169,6 +245,8 @@ def _make_resource_input(url: str, workdir: str, local: bool):
     if local:
         inp.file = url
     else:
+        # Urls listed in the THREDDS catalogs are OpenDAP urls, no need to check them.
+        register_opendap_url(url)
         inp.url = url
     return inp
 
@@ -195,23 +273,16 @@ def get_datasets(
     models: list of strings
         A list of the requested models (or name of a models sublist)
     """
-    if dsconf.local:
-        iterator = iter_local(Path(dsconf.path), dsconf.depth, dsconf.suffix)
+    index = get_catalog_index(dsconf)
+    if index is not None:
+        files = index.select(variables=variables, scenario=scenario, models=models)
     else:
-        iterator = iter_remote(TDSCatalog(dsconf.path), depth=dsconf.depth)
+        is_required = FileMatcher.for_dataset(
+            dsconf, variables=variables, scenario=scenario, models=models
+        )
+        files = [(name, url) for name, url in iter_dataset(dsconf) if is_required(name)]
 
-    inputs = []
-    for name, url in iterator:
-        if file_is_required(
-            name,
-            dsconf.pattern,
-            dsconf.model_lists,
-            variables=variables,
-            scenario=scenario,
-            models=models,
-        ):
-            inputs.append(_make_resource_input(url, workdir, dsconf.local))
-    return inputs
+    return [_make_resource_input(url, workdir, dsconf.local) for _, url in files]
 
 
 def _formatted_coordinate(value) -> Optional[str]:
@@ -349,11 +420,14 @@ def make_file_groups(files_list: List[Path], variables: set) -> List[Dict[str, P
 
 
 def make_ensemble(
-    files: List[Path], percentiles: List[int], average_dims: Optional[Tuple[str]] = None
+    files: List[Union[Path, xr.Dataset]],
+    percentiles: List[int],
+    average_dims: Optional[Tuple[str]] = None,
+    realizations: Optional[List[str]] = None,
 ) -> None:  # noqa: D103
-    ensemble = ensembles.create_ensemble(
-        files, realizations=[file.stem for file in files]
-    )
+    if realizations is None:
+        realizations = [file.stem for file in files]
+    ensemble = ensembles.create_ensemble(files, realizations=realizations)
     # make sure we have data starting in 1950
     ensemble = ensemble.sel(time=(ensemble.time.dt.year >= 1950))
 
@@ -395,8 +469,26 @@ def compute_intermediate_variables(
     required_variable_names: Iterable[str],
     workdir: Path,
     request_inputs,
+    intermediates: Optional[IntermediateDatasets] = None,
+    args: Optional[Dict[str, Any]] = None,
 ) -> List[Path]:
-    """Compute netcdf datasets from a list of required variable names and existing files."""
+    """Compute netcdf datasets from a list of required variable names and existing files.
+
+    With `intermediates`, the files are read from and the computed datasets are kept
+    in it, when they fit in its memory limit. The arguments of the computations (ex:
+    `perc_tasmin`) are taken from `args`, or from `request_inputs` when not given there.
+    """
+    if intermediates is None:
+        intermediates = IntermediateDatasets(limit=0)
+    args = {
+        **{
+            name: single_input_or_none(request_inputs, name)
+            for computation in variable_computations.values()
+            for name in computation["args"]
+            if name in request_inputs
+        },
+        **(args or {}),
+    }
     output_files_list = []
     file_groups = make_file_groups(files_list, variables)
     for group in file_groups:
@@ -422,20 +514,17 @@ def compute_intermediate_variables(
                 input_names = variable_computations[variable]["inputs"]
                 arg_names = variable_computations[variable]["args"]
                 if all(i in group for i in input_names) and all(
-                    a in request_inputs for a in arg_names
+                    a in args for a in arg_names
                 ):
                     inputs = [
-                        xr.open_dataset(group[name])[name] for name in input_names
+                        intermediates.open(group[name])[name] for name in input_names
                     ]
-                    args = [
-                        single_input_or_none(request_inputs, name) for name in arg_names
-                    ]
-
                     output = variable_computations[variable]["function"](
-                        *inputs, *args
+                        *inputs, *[args[name] for name in arg_names]
                     ).to_dataset(name=variable)
-                    output_file = Path(workdir) / f"{variable}_{output_basename}"
-                    dataset_to_netcdf(output, output_file)
+                    output_file = intermediates.put(
+                        output, Path(workdir) / f"{variable}_{output_basename}"
+                    )
 
                     variables_to_compute.remove(variable)
                     group[variable] = output_file
@@ -450,6 +539,103 @@ def compute_intermediate_variables(
     return output_files_list
 
 
+def ensemble_evaluation() -> str:
+    """Return how the indicator of the ensemble processes is computed, from `ensemble_evaluation`."""
+    mode = get_config_value("finch", "ensemble_evaluation") or "stacked"
+    if mode not in ("stacked", "members"):
+        raise ValueError(f"Invalid ensemble_evaluation: {mode}")
+    return mode
+
+
+def member_filename(process: Process, inputs: RequestInputs, variables: set) -> str:
+    """Return the name of a member's indicator file, from the name of its input files."""
+    for variable in variables:
+        input_name = Path(inputs[variable][0].file).name
+        # Subset files are named in lowercase, the variables may not be
+        output_name = re.sub(
+            re.escape(variable), process.identifier, input_name, flags=re.I
+        )
+    return output_name
+
+
+def _open_member(
+    process: Process,
+    nc_input: ComplexInput,
+    intermediates: Optional[IntermediateDatasets] = None,
+) -> xr.Dataset:
+    if intermediates is not None and nc_input.file in intermediates:
+        return intermediates.open(nc_input.file)
+    return try_opendap(nc_input, logging_function=lambda msg: write_log(process, msg))
+
+
+def _stack_key(ds: xr.Dataset) -> tuple:
+    """Return what must be equal for members to be stacked: their time and grid."""
+    time = None
+    if "time" in ds.coords:
+        time = (
+            get_calendar(ds.time),
+            ds.time.size,
+            str(ds.time.values[0]),
+            str(ds.time.values[-1]),
+        )
+    grid = tuple(
+        (name, ds[name].dims, ds[name].shape, ds[name].values.tobytes())
+        for name in ("lat", "lon")
+        if name in ds.coords
+    )
+    return time, grid
+
+
+def compute_stacked_indices(
+    process: Process,
+    indicator: Indicator,
+    input_groups: List[RequestInputs],
+    intermediates: Optional[IntermediateDatasets] = None,
+) -> List[xr.Dataset]:
+    """Compute an indicator once over the ensemble members, stacked along `realization`.
+
+    The members' datasets are concatenated lazily, and the indicator builds a single
+    dask graph for all of them. Members are stacked together when their time coordinates
+    have the same calendar and bounds and they are on the same grid (`lat` and `lon`),
+    so usually all at once; the indicator is computed once per stack. The members' files
+    kept in `intermediates` are not read again.
+
+    Returns
+    -------
+    list of xr.Dataset
+        The lazy indicator dataset of each member, in the order of `input_groups`.
+    """
+    names = [name for name in iter_xc_variables(indicator) if name in input_groups[0]]
+    opened = [
+        {name: _open_member(process, inputs[name][0], intermediates) for name in names}
+        for inputs in input_groups
+    ]
+
+    stacks: Dict[tuple, List[int]] = {}
+    for member, datasets in enumerate(opened):
+        key = tuple(_stack_key(ds) for ds in datasets.values())
+        stacks.setdefault(key, []).append(member)
+
+    outputs: List[Optional[xr.Dataset]] = [None] * len(input_groups)
+    for members in stacks.values():
+        stacked = {}
+        for name in names:
+            member_datasets = [opened[m][name] for m in members]
+            if name in member_datasets[0].data_vars:
+                member_datasets = [ds[[name]] for ds in member_datasets]
+            stacked[name] = xr.concat(
+                member_datasets,
+                dim="realization",
+                coords="minimal",
+                compat="override",
+                combine_attrs="override",
+            )
+        out = compute_indices(process, indicator, input_groups[members[0]], stacked)
+        for i, member in enumerate(members):
+            outputs[member] = out.isel(realization=i, drop=True)
+    return outputs
+
+
 def get_input_lists(needed: set, available: set):
     """From a list of dataset variables, get the source variable names to compute them."""
     raw = available.intersection(needed)
@@ -471,6 +657,380 @@ def get_input_lists(needed: set, available: set):
     return raw, compute, extra
 
 
+def warm_percentile_cache(
+    dataset_name: str,
+    variables: List[str],
+    percentiles: List[int],
+    workdir: Union[str, Path],
+    scenarios: Optional[List[str]] = None,
+    models: Optional[List[str]] = None,
+    lat: Optional[str] = None,
+    lon: Optional[str] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> int:
+    """Compute the day-of-year percentiles of the members of a dataset into the percentile cache.
+
+    The files are subset like the ensemble processes do, so the entries are used by the
+    requests with the same grid points, or bounding box, and dates.
+
+    Parameters
+    ----------
+    dataset_name : str
+        The name of the dataset, in the datasets configuration.
+    variables : list of str
+        The percentile variables, ex: "tasmax_per".
+    percentiles : list of int
+        The percentiles to compute.
+    workdir : str or Path
+        The directory where files can be written.
+    scenarios : list of str, optional
+        The scenarios, all of those of the dataset by default.
+    models : list of str, optional
+        The models or the name of a models sublist, all models by default.
+    lat, lon : str, optional
+        The grid points, comma separated lists of floats.
+    bbox : tuple of float, optional
+        The bounding box (lon0, lat0, lon1, lat1), instead of grid points.
+    start_date, end_date : str, optional
+        The bounds of the period.
+
+    Returns
+    -------
+    int
+        The number of members' percentiles in the cache.
+    """
+    if get_percentile_cache() is None:
+        raise ValueError("The percentile cache is disabled.")
+    dsconf = get_datasets_config()[dataset_name]
+    unknown = set(variables).difference(
+        name
+        for name, computation in variable_computations.items()
+        if computation["args"]
+    )
+    if unknown:
+        raise ValueError(f"Not percentile variables: {unknown}")
+    source_variables, _, extra_variables = get_input_lists(
+        set(variables), set(dsconf.allowed_values["variable"])
+    )
+    if extra_variables:
+        raise ValueError(
+            f"Dataset {dataset_name} does not provide the variables {extra_variables}."
+        )
+
+    if bbox is None:
+        if lat is None or lon is None:
+            raise ValueError("Either lat and lon, or bbox must be given.")
+        lon = [float(v) for v in str(lon).split(",")]
+        lat = [float(v) for v in str(lat).split(",")]
+
+    count = 0
+    for scenario in scenarios or dsconf.allowed_values["scenario"]:
+        netcdf_inputs = get_datasets(
+            dsconf,
+            workdir=str(workdir),
+            variables=list(source_variables),
+            scenario=scenario,
+            models=models or ["all"],
+        )
+        intermediates = IntermediateDatasets()
+        subsets = subset_netcdf_inputs(
+            netcdf_inputs,
+            workdir,
+            lon=lon,
+            lat=lat,
+            bbox=bbox,
+            start_date=start_date,
+            end_date=end_date,
+            intermediates=intermediates,
+        )
+
+        for perc in percentiles:
+            args = {
+                arg: perc
+                for variable in variables
+                for arg in variable_computations[variable]["args"]
+            }
+            files = compute_intermediate_variables(
+                subsets,
+                source_variables,
+                variables,
+                workdir,
+                {},
+                intermediates,
+                args=args,
+            )
+            count += len(files)
+            LOGGER.info(
+                f"Percentile {perc} of {len(files)} members in the cache, scen={scenario}"
+            )
+    return count
+
+
+# Parameters of the indicators making each period depend on the whole series
+_WHOLE_SERIES_PARAMETERS = {"cal_start", "cal_end"}
+
+
+def _time_labels(ds: xr.Dataset) -> np.ndarray:
+    return ds.time.dt.strftime("%Y-%m-%d").values
+
+
+def _source_name(nc_input: ComplexInput) -> str:
+    return Path(urlparse(getattr(nc_input, nc_input.prop)).path).name
+
+
+def splice_history(history: xr.Dataset, ds: xr.Dataset, cut: str) -> xr.Dataset:
+    """Join the periods of `history` before `cut` and the periods of `ds` from `cut`.
+
+    The attributes are those of `ds`.
+    """
+    spliced = xr.concat(
+        [
+            history.isel(time=_time_labels(history) < cut),
+            ds.isel(time=_time_labels(ds) >= cut),
+        ],
+        dim="time",
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+        combine_attrs="override",
+    )
+    spliced.attrs = dict(ds.attrs)
+    for name, variable in ds.variables.items():
+        spliced.variables[name].attrs = dict(variable.attrs)
+    return spliced
+
+
+def shared_history_end(
+    dsconf: DatasetConfiguration,
+    indicator: Indicator,
+    request_inputs: RequestInputs,
+    scenarios: List[str],
+    computed_variables: set,
+) -> Optional[str]:
+    """Return the end of the historical period the scenarios share, if the indicator can reuse it.
+
+    Each period (`freq`) of the indicator must only depend on the data of that period
+    and of the one before: the indicator must not be computed from percentiles of the
+    series, nor be calibrated on a reference period.
+    """
+    end = dsconf.historical_end
+    if end is None or len(scenarios) < 2:
+        return None
+    if single_input_or_none(request_inputs, "freq") is None:
+        return None
+    if any(variable_computations[v]["args"] for v in computed_variables):
+        return None
+    if _WHOLE_SERIES_PARAMETERS.intersection(indicator.parameters):
+        return None
+    # The requested period must cover both the historical run and the scenario
+    start_date = single_input_or_none(request_inputs, wpsio.start_date.identifier)
+    end_date = single_input_or_none(request_inputs, wpsio.end_date.identifier)
+    if (start_date and start_date > end) or (end_date and end_date <= end):
+        return None
+    return end
+
+
+@dataclass
+class SharedHistory:
+    """Indicator values over the historical period, computed with a reference scenario.
+
+    When the files of a dataset are the concatenation of the historical run and of a
+    scenario, the historical period of a model is the same in all scenarios. The other
+    scenarios are only computed from the start of the period before `cut` (`warmup`,
+    so that the first spliced period has its preceding data), and the reference's
+    periods before `cut` are spliced into their members.
+
+    The data of each scenario over the warm-up period is kept, so that a scenario is
+    only spliced if it is the same as the reference's over that period.
+
+    Attributes
+    ----------
+    scenario : str
+        The reference scenario.
+    warmup : str
+        The first day of the period before `cut`.
+    cut : str
+        The first day of the first period that is not entirely historical.
+    members : dict
+        The indicator dataset of each member of the reference, keyed by realization
+        name without the scenario.
+    warmup_data : dict
+        For each scenario, its subsets over the warm-up period, keyed by file name
+        without the scenario.
+    """
+
+    scenario: str
+    warmup: str
+    cut: str
+    members: Dict[str, xr.Dataset] = field(default_factory=dict)
+    warmup_data: Dict[str, Dict[str, xr.Dataset]] = field(default_factory=dict)
+
+    @classmethod
+    def from_end(
+        cls, scenario: str, end: str, freq: str, window: Optional[int] = None
+    ) -> Optional["SharedHistory"]:
+        """Return the shared history of a reference scenario, for a historical run ending on `end`.
+
+        The periods start on the dates of `freq`. The indicator's `window`, in days,
+        must fit in the period before `cut`.
+        """
+        next_day = pd.Timestamp(end) + pd.Timedelta(days=1)
+        try:
+            warmup, cut = pd.date_range(end=next_day, periods=2, freq=freq)
+        except ValueError:
+            return None
+        if window and (cut - warmup).days < window:
+            return None
+        return cls(
+            scenario=scenario,
+            warmup=warmup.strftime("%Y-%m-%d"),
+            cut=cut.strftime("%Y-%m-%d"),
+        )
+
+    def covers(
+        self, dsconf: DatasetConfiguration, netcdf_inputs: List[ComplexInput]
+    ) -> bool:
+        """Return whether each input of a scenario is the concatenation of the historical run and of the scenario."""
+        for nc_input in netcdf_inputs:
+            fields = dsconf.compiled_pattern.parse(_source_name(nc_input))
+            if fields is None or not fields["scenario"].startswith("historical"):
+                return False
+        return True
+
+    def subset_inputs(self, request_inputs: RequestInputs) -> RequestInputs:
+        """Return the request inputs with a `start_date` of at least `warmup`."""
+        start_date = deepcopy(wpsio.start_date)
+        start_date.data = max(
+            single_input_or_none(request_inputs, start_date.identifier) or "",
+            self.warmup,
+        )
+        return {**request_inputs, start_date.identifier: [start_date]}
+
+    def keep_warmup(self, scenario: str, subsets: Dict[str, xr.Dataset]) -> None:
+        """Keep the subsets of a scenario over the warm-up period, keyed by file name."""
+        self.warmup_data[scenario] = {
+            name.replace(scenario, ""): ds.isel(
+                time=(_time_labels(ds) >= self.warmup) & (_time_labels(ds) < self.cut)
+            ).load()
+            for name, ds in subsets.items()
+        }
+
+    def set_reference(self, members: List[xr.Dataset], realizations: List[str]) -> None:
+        """Keep the indicator datasets of the reference's members, once computed."""
+        self.members = {
+            name.replace(self.scenario, ""): member
+            for name, member in zip(realizations, members)
+        }
+
+    def matches(
+        self, scenario: str, members: List[xr.Dataset], realizations: List[str]
+    ) -> bool:
+        """Return whether the members of a scenario can be spliced with the reference's.
+
+        Each member must have its counterpart in the reference, both having the period
+        starting on `cut`, and the data of the scenario over the warm-up period must be
+        the same as the reference's.
+        """
+        reference_data = self.warmup_data.get(self.scenario, {})
+        data = self.warmup_data.get(scenario)
+        if not data or not set(data).issubset(reference_data):
+            return False
+        if not all(ds.equals(reference_data[name]) for name, ds in data.items()):
+            return False
+        if not set(name.replace(scenario, "") for name in realizations).issubset(
+            self.members
+        ):
+            return False
+        for member in [*self.members.values(), *members]:
+            if "time" not in member.dims or self.cut not in _time_labels(member):
+                return False
+        return True
+
+    def splice(
+        self, scenario: str, members: List[xr.Dataset], realizations: List[str]
+    ) -> List[xr.Dataset]:
+        """Splice the reference's historical periods into the members of a scenario."""
+        return [
+            splice_history(self.members[name.replace(scenario, "")], member, self.cut)
+            for name, member in zip(realizations, members)
+        ]
+
+
+class _ScenarioLog:
+    """Log of a scenario, folding its status percentage into the log of the job.
+
+    The status percentage of each scenario goes through the steps of the process as
+    if it was processed alone; the status of the job is their mean.
+    """
+
+    def __init__(
+        self,
+        job_log: JobLog,
+        scenario: str,
+        percentages: Dict[str, int],
+        lock: threading.Lock,
+    ):
+        self.job_log = job_log
+        self.scenario = scenario
+        self.percentages = percentages
+        self._lock = lock
+
+    @property
+    def status_percentage(self) -> int:  # noqa: D102
+        return self.percentages[self.scenario]
+
+    def write(self, response, message: str, status_percentage: int, force=False):
+        """Update the status percentage of the scenario, and write to the job's log."""
+        with self._lock:
+            self.percentages[self.scenario] = status_percentage
+            job_percentage = sum(self.percentages.values()) // len(self.percentages)
+        self.job_log.write(response, message, job_percentage, force=force)
+
+
+class ScenarioProcess:
+    """View of an ensemble process for one of its scenarios, processed concurrently with the others.
+
+    Each scenario has its own working directory (a subdirectory of the process's), so
+    that file names don't conflict if they don't include the scenario, and its own
+    status percentage (see :py:class:`_ScenarioLog`). Other attributes are the process's.
+    """
+
+    def __init__(self, process: Process, workdir: str, job_log: _ScenarioLog):
+        self._process = process
+        self.workdir = workdir
+        self._job_log = job_log
+
+    def __getattr__(self, name):  # noqa: D105
+        return getattr(self._process, name)
+
+    def subdirectory(self, name: str) -> "ScenarioProcess":
+        """Return the view of the scenario working in a subdirectory of its working directory."""
+        workdir = Path(self.workdir) / name
+        workdir.mkdir(exist_ok=True)
+        return ScenarioProcess(self._process, str(workdir), self._job_log)
+
+    @classmethod
+    def for_scenarios(
+        cls, process: Process, scenarios: List[str]
+    ) -> Dict[str, "ScenarioProcess"]:
+        """Return the view of the process for each scenario, creating their working directories."""
+        job_log = get_job_log(process)
+        percentages = dict.fromkeys(scenarios, job_log.status_percentage)
+        lock = threading.Lock()
+        views = {}
+        for scenario in scenarios:
+            workdir = Path(process.workdir) / scenario
+            workdir.mkdir(exist_ok=True)
+            views[scenario] = cls(
+                process,
+                str(workdir),
+                _ScenarioLog(job_log, scenario, percentages, lock),
+            )
+        return views
+
+
 def ensemble_common_handler(
     process: Process, request, response, subset_function
 ):  # noqa: D103
@@ -505,11 +1065,11 @@ def ensemble_common_handler(
             f"Invalid scenarios for dataset {dataset_name}. "
             f"Should be in {dataset.allowed_values['scenario']}."
         )
-    if (
-        not set(dataset.allowed_values["model"])
-        .union(dataset.model_lists.keys())
-        .union({"all"})
-        .issuperset(models)
+    if not all(
+        m in dataset.allowed_values["model"]
+        or m.lower() in dataset.model_lists
+        or m.lower() == "all"
+        for m in models
     ):
         raise InvalidParameterValue(
             f"Invalid models or model list for dataset {dataset_name}. "
@@ -522,7 +1082,8 @@ def ensemble_common_handler(
             "the variable that could be used to compute those."
         )
 
-    convert_to_csv = request.inputs["output_format"][0].data == "csv"
+    output_format = request.inputs["output_format"][0].data
+    convert_to_csv = output_format in ["csv", "parquet"]
     if not convert_to_csv:
         del process.status_percentage_steps["convert_to_csv"]
     percentiles_string = request.inputs["ensemble_percentiles"][0].data
@@ -547,18 +1108,23 @@ def ensemble_common_handler(
         average_dims = None
     write_log(process, f"Will average over {average_dims}")
 
-    base_work_dir = Path(process.workdir)
-    ensembles = []
+    # Subsets and intermediate variables are passed in memory between the steps when small enough
+    intermediates = IntermediateDatasets()
     output_basename = Path(
         make_output_filename(
             process, request.inputs, scenario=scenarios, dataset=dataset_name
         )
     )
-    for scenario in scenarios:
-        # Ensure no file name conflicts (i.e. if the scenario doesn't appear in the base filename)
-        work_dir = base_work_dir / scenario
-        work_dir.mkdir(exist_ok=True)
-        process.set_workdir(str(work_dir))
+
+    def open_member(member: Union[Path, xr.Dataset]) -> xr.Dataset:
+        return member if isinstance(member, xr.Dataset) else intermediates.open(member)
+
+    def scenario_members(
+        scenario: str,
+        history: Optional[SharedHistory] = None,
+        process: Optional[ScenarioProcess] = None,
+    ):
+        process = process or scenario_processes[scenario]
 
         write_log(process, f"Fetching datasets for scenario {scenario}")
         netcdf_inputs = get_datasets(
@@ -574,13 +1140,32 @@ def ensemble_common_handler(
                 f"No netCDF files were selected with filters {scenario=}, {models=} and variables={source_variables}"
             )
 
+        if history is not None and not history.covers(dataset, netcdf_inputs):
+            history = None
+        subset_inputs = request.inputs
+        if history is not None and scenario != history.scenario:
+            write_log(
+                process,
+                f"Computing scen={scenario} from {history.warmup}, "
+                f"the historical period before {history.cut} is the one of scen={history.scenario}",
+            )
+            subset_inputs = history.subset_inputs(request.inputs)
+
         write_log(process, f"Running subset scen={scenario}", process_step="subset")
         subsetted_files = subset_function(
-            process, netcdf_inputs=netcdf_inputs, request_inputs=request.inputs
+            process,
+            netcdf_inputs=netcdf_inputs,
+            request_inputs=subset_inputs,
+            intermediates=intermediates,
         )
         if not subsetted_files:
             message = "No data was produced when subsetting using the provided bounds."
             raise ProcessError(message)
+        if history is not None:
+            history.keep_warmup(
+                scenario,
+                {Path(path).name: open_member(path) for path in subsetted_files},
+            )
 
         subsetted_intermediate_files = compute_intermediate_variables(
             subsetted_files,
@@ -588,6 +1173,7 @@ def ensemble_common_handler(
             needed_variables,
             process.workdir,
             request.inputs,
+            intermediates,
         )
         write_log(
             process,
@@ -595,42 +1181,118 @@ def ensemble_common_handler(
             process_step="compute_indices",
         )
 
-        print(subsetted_intermediate_files, file=sys.stderr)
+        LOGGER.debug(
+            f"Indicator inputs of scen={scenario}: {subsetted_intermediate_files}"
+        )
         input_groups = make_indicator_inputs(
             process.xci, request_inputs_not_datasets, subsetted_intermediate_files
         )
         n_groups = len(input_groups)
 
-        indices_files = []
-
-        warnings.filterwarnings("ignore", category=FutureWarning)
-        warnings.filterwarnings("ignore", category=UserWarning)
-
-        for n, inputs in enumerate(input_groups):
+        if ensemble_evaluation() == "stacked":
             write_log(
-                process,
-                f"Computing indices for file {n + 1} of {n_groups}, scen={scenario}",
-                subtask_percentage=n * 100 // n_groups,
+                process, f"Computing indices for {n_groups} members, scen={scenario}"
             )
-            output_ds = compute_indices(process, process.xci, inputs)
-            for variable in needed_variables:
-                input_name = Path(inputs[variable][0].file).name
-                output_name = input_name.replace(variable, process.identifier)
-
-            output_path = Path(process.workdir) / output_name
-            dataset_to_netcdf(output_ds, output_path)
-            indices_files.append(output_path)
+            members = compute_stacked_indices(
+                process, process.xci, input_groups, intermediates
+            )
+            realizations = [
+                Path(member_filename(process, inputs, needed_variables)).stem
+                for inputs in input_groups
+            ]
+        else:
+            members = []
+            for n, inputs in enumerate(input_groups):
+                write_log(
+                    process,
+                    f"Computing indices for file {n + 1} of {n_groups}, scen={scenario}",
+                    subtask_percentage=n * 100 // n_groups,
+                )
+                datasets = {
+                    name: intermediates.open(inputs[name][0].file)
+                    for name in needed_variables
+                    if inputs[name][0].file in intermediates
+                }
+                output_ds = compute_indices(process, process.xci, inputs, datasets)
+                output_path = intermediates.put(
+                    output_ds,
+                    Path(process.workdir)
+                    / member_filename(process, inputs, needed_variables),
+                )
+                members.append(
+                    intermediates.open(output_path)
+                    if output_path in intermediates
+                    else output_path
+                )
+            realizations = [
+                Path(member_filename(process, inputs, needed_variables)).stem
+                for inputs in input_groups
+            ]
 
-        warnings.filterwarnings("default", category=FutureWarning)
-        warnings.filterwarnings("default", category=UserWarning)
+        return members, realizations, netcdf_inputs
 
-        ensemble = make_ensemble(indices_files, ensemble_percentiles, average_dims)
-        ensemble.attrs["source_datasets"] = "\n".join(
-            [dsinp.url for dsinp in netcdf_inputs]
+    # The scenarios are independent, they are processed concurrently. When they share
+    # their historical period, it is only computed with the first scenario.
+    scenario_processes = ScenarioProcess.for_scenarios(process, scenarios)
+    history_end = shared_history_end(
+        dataset, process.xci, request.inputs, scenarios, computed_variables
+    )
+    history = None
+    if history_end is not None:
+        history = SharedHistory.from_end(
+            scenarios[0],
+            history_end,
+            single_input_or_none(request.inputs, "freq"),
+            window=single_input_or_none(request.inputs, "window"),
         )
-        ensembles.append(ensemble)
+    warnings.filterwarnings("ignore", category=FutureWarning)
+    warnings.filterwarnings("ignore", category=UserWarning)
+    try:
+        results = dict(
+            zip(
+                scenarios,
+                map_concurrently(
+                    lambda scenario: scenario_members(scenario, history), scenarios
+                ),
+            )
+        )
+        if history is not None:
+            members, realizations, _ = results[history.scenario]
+            history.set_reference([open_member(m) for m in members], realizations)
+        for scenario in scenarios:
+            if history is None or scenario == history.scenario:
+                continue
+            if scenario not in history.warmup_data:
+                continue  # computed over the whole period
+            members, realizations, netcdf_inputs = results[scenario]
+            members = [open_member(member) for member in members]
+            if history.matches(scenario, members, realizations):
+                members = history.splice(scenario, members, realizations)
+                results[scenario] = members, realizations, netcdf_inputs
+            else:
+                write_log(
+                    scenario_processes[scenario],
+                    f"The data of scen={scenario} before {history.cut} is not the one "
+                    f"of scen={history.scenario}, computing its whole period",
+                )
+                results[scenario] = scenario_members(
+                    scenario, process=scenario_processes[scenario].subdirectory("all")
+                )
 
-    process.set_workdir(str(base_work_dir))
+        ensembles = []
+        for scenario in scenarios:
+            members, realizations, netcdf_inputs = results.pop(scenario)
+            ensemble = make_ensemble(
+                members, ensemble_percentiles, average_dims, realizations
+            )
+            intermediates.release(scenario_processes[scenario].workdir)
+            ensemble.attrs["source_datasets"] = "\n".join(
+                [dsinp.url for dsinp in netcdf_inputs]
+            )
+            ensembles.append(ensemble)
+    finally:
+        warnings.filterwarnings("default", category=FutureWarning)
+        warnings.filterwarnings("default", category=UserWarning)
 
     if "realization" in ensembles[0].dims and len(scenarios) > 1:
         # For non-reducing calls with multiple scenarios, remove the scenario information from the member name.
@@ -644,35 +1306,38 @@ def ensemble_common_handler(
     )
 
     if convert_to_csv:
-        ensemble_csv = output_basename.with_suffix(".csv")
         prec = single_input_or_none(request.inputs, "csv_precision")
-        if prec and prec < 0:
+        if output_format == "csv" and prec and prec < 0:
             ensemble = ensemble.round(prec)
             prec = 0
-        df = dataset_to_dataframe(ensemble)
         if average_dims is None:
             dims = ["lat", "lon", "time"]
         else:
             dims = ["time"]
-        df = df.reset_index().set_index(dims)
-        if "region" in df.columns:
-            df.drop(columns="region", inplace=True)
-
-        if prec is not None:
-            for v in df:
-                if v not in dims and is_numeric_dtype(df[v]):
-                    df[v] = df[v].map(
-                        lambda x: f"{x:.{prec}f}" if not pd.isna(x) else ""
-                    )
+        frames = (
+            df.reset_index().set_index(dims).drop(columns="region", errors="ignore")
+            for df in iter_dataframes(ensemble)
+        )
+        metadata = format_metadata(ensemble)
 
-        df.to_csv(ensemble_csv)
+        if output_format == "parquet":
+            ensemble_output = Path(process.workdir) / output_basename.with_suffix(
+                ".parquet"
+            )
+            dataframes_to_parquet(
+                frames, ensemble_output, metadata={"metadata": metadata}
+            )
+        else:
+            ensemble_csv = output_basename.with_suffix(".csv")
+            dataframes_to_csv(frames, ensemble_csv, csv_precision=prec, exclude=dims)
 
-        metadata = format_metadata(ensemble)
-        metadata_file = output_basename.parent / f"{output_basename}_metadata.txt"
-        metadata_file.write_text(metadata)
+            metadata_file = output_basename.parent / f"{output_basename}_metadata.txt"
+            metadata_file.write_text(metadata)
 
-        ensemble_output = Path(process.workdir) / output_basename.with_suffix(".zip")
-        zip_files(ensemble_output, [metadata_file, ensemble_csv])
+            ensemble_output = Path(process.workdir) / output_basename.with_suffix(
+                ".zip"
+            )
+            zip_files(ensemble_output, [metadata_file, ensemble_csv])
     else:
         LOGGER.info(output_basename)
         ensemble_output = output_basename.with_suffix(".nc")
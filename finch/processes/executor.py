@@ -0,0 +1,178 @@
+"""Long-lived executors of the worker, and limits on the concurrent requests to each host."""
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from pywps import configuration
+from pywps.configuration import get_config_value
+
+LOGGER = logging.getLogger("PYWPS")
+
+
+def cpu_count() -> int:
+    """Return the number of CPUs available to this process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on all platforms
+        return os.cpu_count() or 1
+
+
+def _configured_size(key: str, default: int) -> int:
+    value = get_config_value("finch", key)
+    if not value or str(value).strip().lower() == "auto":
+        return default
+    return int(value)
+
+
+def thread_pool_size() -> int:
+    """Return the size of the thread pool, from `subset_threads`.
+
+    When set to "auto", threads mostly wait on I/O (OPeNDAP, http): with `io_wait_ratio`
+    the estimated time spent waiting for each unit of time spent computing, each CPU
+    can keep `1 + io_wait_ratio` threads busy.
+    """
+    io_wait_ratio = float(get_config_value("finch", "io_wait_ratio") or 4)
+    return _configured_size(
+        "subset_threads", min(32, int(cpu_count() * (1 + io_wait_ratio)))
+    )
+
+
+def process_pool_size() -> int:
+    """Return the size of the process pool, from `subset_processes`. When set to "auto", one process per CPU."""
+    return _configured_size("subset_processes", cpu_count())
+
+
+def _init_process(config: Dict[str, Dict[str, str]]):
+    configuration.load_configuration()
+    configuration.CONFIG.read_dict(config)
+
+
+def _process_pool(size: int) -> ProcessPoolExecutor:
+    """Create a pool of processes started from a clean process, not forked from this one.
+
+    Forking a worker whose threads may hold the netCDF4/HDF5 lock, or any other lock,
+    leaves the child in an inconsistent state. With the `forkserver` method, the finch
+    modules are imported once by the server, and the pool's processes are forked from it.
+    The processes get the configuration of this worker.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["finch.processes"])
+    else:
+        context = multiprocessing.get_context("spawn")
+
+    configuration.get_config_value("finch", "subset_backend")  # loads the configuration
+    config = {
+        section: dict(configuration.CONFIG.items(section, raw=True))
+        for section in configuration.CONFIG.sections()
+    }
+    return ProcessPoolExecutor(
+        max_workers=size,
+        mp_context=context,
+        initializer=_init_process,
+        initargs=(config,),
+    )
+
+
+# Backends of the executors: a factory taking the number of workers, and how it is computed.
+BACKENDS: Dict[str, Dict[str, Callable]] = {
+    "thread": {
+        "factory": lambda size: ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="finch-worker"
+        ),
+        "size": thread_pool_size,
+    },
+    "process": {
+        "factory": _process_pool,
+        "size": process_pool_size,
+    },
+}
+
+_executors: Dict[str, Optional[Executor]] = {}
+_host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_lock = threading.Lock()
+
+
+def get_executor(backend: str = "thread") -> Optional[Executor]:
+    """Return the executor of this worker for a backend, creating it on first use.
+
+    Threads suit I/O bound tasks (reading OPeNDAP urls) and processes suit CPU bound tasks.
+    Returns None if the configured size is 1 or less: tasks should then be run sequentially.
+    """
+    with _lock:
+        if backend not in _executors:
+            spec = BACKENDS[backend]
+            size = spec["size"]()
+            _executors[backend] = spec["factory"](size) if size > 1 else None
+            LOGGER.debug(f"Created the {backend} executor with {size} workers.")
+        return _executors[backend]
+
+
+def map_concurrently(function: Callable, items: Sequence) -> List:
+    """Call `function` on each item in its own thread, and return the results in order.
+
+    `function` may itself wait on tasks of the worker's thread pool (see
+    :py:func:`finch.processes.utils.process_threaded`), so the items are processed by a
+    dedicated executor: the threads of the pool never wait on their own pool. The items
+    are processed sequentially in this thread if the pool is disabled, or with a single item.
+    """
+    if get_executor("thread") is None or len(items) < 2:
+        return [function(item) for item in items]
+
+    with ThreadPoolExecutor(
+        max_workers=len(items), thread_name_prefix="finch-scenario"
+    ) as executor:
+        futures = [executor.submit(function, item) for item in items]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+@contextmanager
+def host_limit(url: Optional[str]):
+    """Limit the number of concurrent requests to the host of `url` to `host_concurrency`.
+
+    The limit applies to the threads of this worker. Local paths are not limited.
+    """
+    host = urlparse(url).netloc if isinstance(url, str) else ""
+    if not host:
+        yield
+        return
+
+    with _lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            limit = int(get_config_value("finch", "host_concurrency") or 4)
+            semaphore = _host_semaphores[host] = threading.BoundedSemaphore(limit)
+    with semaphore:
+        yield
+
+
+def shutdown(wait: bool = True) -> None:
+    """Shut down the executors of this worker. They are created again when needed."""
+    with _lock:
+        executors = [e for e in _executors.values() if e is not None]
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def _reset():
+    """Forget the executors and host semaphores, for example after a fork."""
+    global _lock
+    _lock = threading.Lock()
+    _executors.clear()
+    _host_semaphores.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    # The threads of the pools are not copied to a forked process (pywps runs async jobs that way).
+    os.register_at_fork(after_in_child=_reset)
@@ -1,22 +1,41 @@
 # noqa: D100
 import logging
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
 from pathlib import Path
 from threading import Lock
-from typing import List
+from typing import (
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 from urllib.parse import urlparse
 
-import geopandas as gpd
-from clisops.core.average import average_shape
-from clisops.core.subset import subset_bbox, subset_gridpoint, subset_shape, subset_time
+import numpy as np
+import xarray as xr
 from pywps import ComplexInput, Process
 from pywps.app.exceptions import ProcessError
+from pywps.configuration import get_config_value
 
 from . import wpsio
+from .cache import get_download_cache
+from .executor import get_executor
 from .utils import (
+    IntermediateDatasets,
     RequestInputs,
+    chunk_dataset,
     dataset_to_netcdf,
+    get_config_size,
+    is_opendap_url,
     make_metalink_output,
     process_threaded,
+    register_opendap_url,
     single_input_or_none,
     try_opendap,
     valid_filename,
@@ -25,6 +44,42 @@ from .utils import (
 
 LOGGER = logging.getLogger("PYWPS")
 
+# HDF5 is not thread-safe, and xarray's own lock only covers reading and writing data,
+# not the metadata read and written while files are opened or created. The threads
+# subsetting files only open, read and close local files, and write their outputs, while
+# holding this lock. OPeNDAP urls are read through the network, without it.
+_netcdf_lock = Lock()
+_file_locks: Dict[str, Lock] = {}
+_file_locks_lock = Lock()
+
+
+def _file_lock(resource: ComplexInput) -> Lock:
+    """Return the lock of an input file, so that each file is only subset by one thread at a time."""
+    key = getattr(resource, resource.prop)
+    with _file_locks_lock:
+        return _file_locks.setdefault(str(key), Lock())
+
+
+def _input_lock(resource) -> ContextManager:
+    """Return the netCDF lock for local files and downloaded urls, no lock for OPeNDAP urls."""
+    return nullcontext() if is_opendap_url(resource.url) else _netcdf_lock
+
+
+@contextmanager
+def _open_input(resource, **kwargs) -> Iterator[xr.Dataset]:
+    """Open an input with :py:func:`try_opendap` and close it on exit.
+
+    Local files are opened and closed holding the netCDF lock. The file is closed here,
+    rather than by the garbage collector in any thread.
+    """
+    with _input_lock(resource):
+        dataset = try_opendap(resource, **kwargs)
+    try:
+        yield dataset
+    finally:
+        with _input_lock(resource):
+            dataset.close()
+
 
 def make_subset_file_name(resource, kind="sub"):
     """Create output file name."""
@@ -44,8 +99,201 @@ def make_subset_file_name(resource, kind="sub"):
     return valid_filename(f"{p.stem}_{kind}{p.suffix}")
 
 
+def _longitude_convention(values: np.ndarray) -> Tuple[bool, bool]:
+    return bool(np.all(values >= 0)), bool(np.all(values <= 0))
+
+
+def _index_range(indices: Sequence[int], size: int, margin: int = 1) -> slice:
+    return slice(max(min(indices) - margin, 0), min(max(indices) + margin + 1, size))
+
+
+def slab_indexers(
+    ds: xr.Dataset,
+    lon_bnds: Optional[Sequence[float]] = None,
+    lat_bnds: Optional[Sequence[float]] = None,
+    lon: Optional[Sequence[float]] = None,
+    lat: Optional[Sequence[float]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> Dict[str, slice]:
+    """Translate spatial bounds, grid points and dates into index ranges of the dataset's dimensions.
+
+    The ranges are computed from the dimension coordinates, which xarray keeps in memory as indexes.
+    Spatial ranges have a margin of one grid cell, so that subsetting the hyperslab with clisops
+    gives the same result as subsetting the full dataset. Dimensions that can't be handled
+    (2D coordinates, undecoded times, no value in bounds, etc.) are left out.
+
+    When the dataset is opened without dask, selecting the hyperslab with :py:meth:`xarray.Dataset.isel`
+    before anything else means only that slab is read. For OPeNDAP urls, netCDF sends it
+    to the server as a constraint expression, instead of transferring whole chunks of the variables.
+    """
+    indexers = {}
+
+    for name, bnds, points in [("lon", lon_bnds, lon), ("lat", lat_bnds, lat)]:
+        if name not in ds.dims or name not in ds.coords or ds[name].ndim != 1:
+            continue
+        values = ds[name].values
+        if bnds and None in bnds:
+            bnds = None
+        if not (points or bnds):
+            continue
+
+        if name == "lon":
+            # Same conversion as clisops' `check_lons`, the unusual cases are left to clisops.
+            requested = np.asarray(points or bnds, dtype=float)
+            all_positive, all_negative = _longitude_convention(values)
+            if all_positive and np.all(requested < 0):
+                requested = requested + 360
+            elif (all_positive and np.any(requested < 0)) or (
+                all_negative and np.any(requested > 180)
+            ):
+                continue
+            if points:
+                points = list(requested)
+            else:
+                bnds = list(requested)
+
+        if points:
+            indices = [int(np.abs(values - p).argmin()) for p in points]
+        elif bnds[0] <= bnds[1]:
+            indices = np.nonzero((values >= bnds[0]) & (values <= bnds[1]))[0]
+            if indices.size == 0:
+                continue
+        else:
+            continue
+
+        indexer = _index_range(indices, values.size)
+        if name == "lon" and _longitude_convention(
+            values[indexer]
+        ) != _longitude_convention(values):
+            # clisops would convert the requested longitudes differently on the slab
+            continue
+        indexers[name] = indexer
+
+    if (start_date or end_date) and "time" in ds.indexes:
+        try:
+            time_slice = ds.indexes["time"].slice_indexer(start_date, end_date)
+        except (KeyError, TypeError, ValueError):
+            time_slice = None
+        if time_slice is not None and len(range(*time_slice.indices(ds.time.size))):
+            indexers["time"] = time_slice
+
+    return indexers
+
+
+@dataclass
+class _InputReference:
+    """Picklable stand-in for a netCDF input, with what :py:func:`try_opendap` needs to open it."""
+
+    url: str
+    file: Optional[str] = None
+    workdir: Optional[str] = None
+    post_data: Optional[str] = None
+    opendap: bool = False
+
+    @classmethod
+    def from_input(cls, resource: ComplexInput) -> "_InputReference":
+        url = resource.url
+        post_data = resource.post_data if resource.prop == "url" else None
+        ref = cls(url=url, workdir=resource.workdir, post_data=post_data)
+        if is_opendap_url(url):
+            ref.opendap = True
+        elif not url.startswith("http") or post_data or get_download_cache() is None:
+            # Local files, and urls that can't go through the download cache, are resolved here.
+            ref.file = resource.file
+        return ref
+
+
+def _subset_in_worker(function: Callable, ref: _InputReference, *args, **kwargs):
+    if ref.opendap:
+        register_opendap_url(ref.url)
+    return function(ref, *args, **kwargs)
+
+
+def _subset_output(
+    resource, subsetted: xr.Dataset, output_filename: Path, max_bytes: int
+) -> Union[Path, xr.Dataset]:
+    """Return the subset loaded in memory if it's at most `max_bytes`, otherwise write it to `output_filename`.
+
+    The subset is decoded as it would be when reading the file, its times may not be.
+    Local files are read, and the output is written, holding the netCDF lock. The subsets
+    of OPeNDAP urls that fit in the `write_memory_budget` are downloaded before taking it.
+    """
+    if max_bytes and subsetted.nbytes <= max_bytes:
+        with _input_lock(resource):
+            return xr.decode_cf(subsetted.load())
+    if is_opendap_url(resource.url) and subsetted.nbytes <= get_config_size(
+        "write_memory_budget", "256mb"
+    ):
+        subsetted = subsetted.load()
+    with _netcdf_lock:
+        dataset_to_netcdf(subsetted, output_filename)
+    return output_filename
+
+
+def _subset_files(
+    process: Process,
+    netcdf_inputs: List[ComplexInput],
+    function: Callable,
+    intermediates: Optional[IntermediateDatasets] = None,
+    **kwargs,
+) -> List[Path]:
+    """Subset each input with `function`, writing the results in the workdir of the process.
+
+    The inputs are dispatched by the worker's threads (see :py:func:`process_threaded`).
+    With the "thread" `subset_backend`, the threads subset the files themselves, each file
+    being subset by one thread at a time (see :py:func:`_file_lock`). With the "process"
+    backend, each file is opened, subset and written by a process of the worker's process
+    pool, and the threads only wait for the results and report the progress.
+
+    With `intermediates`, the subsets that fit in its memory limit are loaded and kept
+    there instead of being written, under the name of the file they would be written to.
+    """
+    pool = None
+    if get_config_value("finch", "subset_backend") == "process":
+        pool = get_executor("process")
+
+    n_files = len(netcdf_inputs)
+    count = 0
+    output_files = []
+    lock = Lock()
+
+    def _subset(resource: ComplexInput):
+        nonlocal count
+
+        output_filename = Path(process.workdir) / make_subset_file_name(resource)
+        max_bytes = intermediates.available() if intermediates is not None else 0
+        if pool is None:
+            with _file_lock(resource):
+                output = function(resource, output_filename, max_bytes, **kwargs)
+        else:
+            ref = _InputReference.from_input(resource)
+            output = pool.submit(
+                _subset_in_worker, function, ref, output_filename, max_bytes, **kwargs
+            ).result()
+        if isinstance(output, xr.Dataset):
+            output = intermediates.put(output, output_filename)
+
+        with lock:
+            count += 1
+            write_log(
+                process,
+                f"Subset file {count} of {n_files} ({getattr(resource, resource.prop)})",
+                subtask_percentage=count * 100 // n_files,
+            )
+            if output is not None:
+                output_files.append(output)
+
+    process_threaded(_subset, netcdf_inputs)
+
+    return output_files
+
+
 def finch_subset_gridpoint(
-    process: Process, netcdf_inputs: List[ComplexInput], request_inputs: RequestInputs
+    process: Process,
+    netcdf_inputs: List[ComplexInput],
+    request_inputs: RequestInputs,
+    intermediates: Optional[IntermediateDatasets] = None,
 ) -> List[Path]:
     """Parse wps `request_inputs` based on their name and subset `netcdf_inputs`.
 
@@ -71,35 +319,47 @@ def finch_subset_gridpoint(
     end_date = single_input_or_none(request_inputs, wpsio.end_date.identifier)
     variables = [r.data for r in request_inputs.get("variable", [])]
 
-    n_files = len(netcdf_inputs)
-    count = 0
-
-    output_files = []
-
-    lock = Lock()
-
-    def _subset(resource: ComplexInput):
-        nonlocal count
+    return _subset_files(
+        process,
+        netcdf_inputs,
+        _subset_gridpoint_file,
+        intermediates,
+        lon=longitudes,
+        lat=latitudes,
+        start_date=start_date,
+        end_date=end_date,
+        variables=variables,
+    )
 
-        # if not subsetting by time, it's not necessary to decode times
-        time_subset = start_date is not None or end_date is not None
-        # No chunking needed for a single gridpoint.
-        dataset = try_opendap(resource, chunks=False, decode_times=time_subset)
 
-        with lock:
-            count += 1
-            write_log(
-                process,
-                f"Subsetting file {count} of {n_files} ({getattr(resource, resource.prop)})",
-                subtask_percentage=(count - 1) * 100 // n_files,
+def _subset_gridpoint_file(
+    resource,
+    output_filename: Path,
+    max_bytes: int,
+    lon,
+    lat,
+    start_date,
+    end_date,
+    variables,
+) -> Union[Path, xr.Dataset, None]:
+    from clisops.core.subset import subset_gridpoint
+
+    # if not subsetting by time, it's not necessary to decode times
+    time_subset = start_date is not None or end_date is not None
+    # No chunking needed for a single gridpoint.
+    with _open_input(resource, chunks=False, decode_times=time_subset) as dataset:
+        dataset = dataset.isel(
+            slab_indexers(
+                dataset, lon=lon, lat=lat, start_date=start_date, end_date=end_date
             )
+        )
 
         dataset = dataset[variables] if variables else dataset
 
         subsetted = subset_gridpoint(
             dataset,
-            lon=longitudes,
-            lat=latitudes,
+            lon=lon,
+            lat=lat,
             start_date=start_date,
             end_date=end_date,
         )
@@ -111,22 +371,16 @@ def finch_subset_gridpoint(
 
         if not all(subsetted.dims.values()):
             LOGGER.warning(f"Subset is empty for dataset: {resource.url}")
-            return
+            return None
 
-        p = make_subset_file_name(resource)
-        output_filename = Path(process.workdir) / p
-
-        dataset_to_netcdf(subsetted, output_filename)
-
-        output_files.append(output_filename)
-
-    process_threaded(_subset, netcdf_inputs)
-
-    return output_files
+        return _subset_output(resource, subsetted, output_filename, max_bytes)
 
 
 def finch_subset_bbox(
-    process: Process, netcdf_inputs: List[ComplexInput], request_inputs: RequestInputs
+    process: Process,
+    netcdf_inputs: List[ComplexInput],
+    request_inputs: RequestInputs,
+    intermediates: Optional[IntermediateDatasets] = None,
 ) -> List[Path]:
     """Parse wps `request_inputs` based on their name and subset `netcdf_inputs`.
 
@@ -150,35 +404,53 @@ def finch_subset_bbox(
     if any(nones) and not all(nones):
         raise ProcessError("lat1 and lon1 must be both omitted or provided")
 
-    n_files = len(netcdf_inputs)
-    count = 0
-
-    output_files = []
-
-    lock = Lock()
+    return _subset_files(
+        process,
+        netcdf_inputs,
+        _subset_bbox_file,
+        intermediates,
+        lon_bnds=[lon0, lon1],
+        lat_bnds=[lat0, lat1],
+        start_date=start_date,
+        end_date=end_date,
+        variables=variables,
+    )
 
-    def _subset(resource):
-        nonlocal count
 
-        # if not subsetting by time, it's not necessary to decode times
-        time_subset = start_date is not None or end_date is not None
-        dataset = try_opendap(resource, decode_times=time_subset)
-
-        with lock:
-            count += 1
-            write_log(
-                process,
-                f"Subsetting file {count} of {n_files} ({getattr(resource, resource.prop)})",
-                subtask_percentage=(count - 1) * 100 // n_files,
+def _subset_bbox_file(
+    resource,
+    output_filename: Path,
+    max_bytes: int,
+    lon_bnds,
+    lat_bnds,
+    start_date,
+    end_date,
+    variables,
+) -> Union[Path, xr.Dataset, None]:
+    from clisops.core.subset import subset_bbox
+
+    # if not subsetting by time, it's not necessary to decode times
+    time_subset = start_date is not None or end_date is not None
+    # Open without dask, so that only the hyperslab is read, then chunk it.
+    with _open_input(resource, chunks=False, decode_times=time_subset) as dataset:
+        dataset = dataset.isel(
+            slab_indexers(
+                dataset,
+                lon_bnds=lon_bnds,
+                lat_bnds=lat_bnds,
+                start_date=start_date,
+                end_date=end_date,
             )
+        )
+        dataset = dataset.chunk(chunk_dataset(dataset, max_size=1000000))
 
         dataset = dataset[variables] if variables else dataset
 
         try:
             subsetted = subset_bbox(
                 dataset,
-                lon_bnds=[lon0, lon1],
-                lat_bnds=[lat0, lat1],
+                lon_bnds=lon_bnds,
+                lat_bnds=lat_bnds,
                 start_date=start_date,
                 end_date=end_date,
             )
@@ -187,17 +459,77 @@ def finch_subset_bbox(
 
         if subsetted is False or not all(subsetted.dims.values()):
             LOGGER.warning(f"Subset is empty for dataset: {resource.url}")
-            return
+            return None
 
-        p = make_subset_file_name(resource)
-        output_filename = Path(process.workdir) / p
+        return _subset_output(resource, subsetted, output_filename, max_bytes)
 
-        dataset_to_netcdf(subsetted, output_filename)
 
-        output_files.append(output_filename)
+def subset_netcdf_inputs(
+    netcdf_inputs: List[ComplexInput],
+    workdir: Union[str, Path],
+    *,
+    lon: Optional[List[float]] = None,
+    lat: Optional[List[float]] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    variables: Optional[List[str]] = None,
+    intermediates: Optional[IntermediateDatasets] = None,
+) -> List[Path]:
+    """Subset `netcdf_inputs` to grid points or a bounding box, outside of a process.
 
-    process_threaded(_subset, netcdf_inputs)
+    The files are subset one after the other, as the subset processes do, and written in
+    `workdir` (see :py:func:`make_subset_file_name`). With `intermediates`, the subsets
+    that fit in its memory limit are kept there instead. Empty subsets are skipped.
+
+    Parameters
+    ----------
+    netcdf_inputs : list of ComplexInput
+        The files to subset.
+    workdir : str or Path
+        The directory where the subsets are written.
+    lon, lat : list of float, optional
+        The grid points.
+    bbox : tuple of float, optional
+        The bounding box (lon0, lat0, lon1, lat1), instead of grid points.
+    start_date, end_date : str, optional
+        The bounds of the period.
+    variables : list of str, optional
+        The variables to keep, all of them by default.
+    intermediates : IntermediateDatasets, optional
+        Where the subsets are kept in memory.
 
+    Returns
+    -------
+    list of Path
+        The paths of the subsets, which are keys of `intermediates` if they are kept there.
+    """
+    if bbox is not None:
+        function = _subset_bbox_file
+        bounds = {"lon_bnds": [bbox[0], bbox[2]], "lat_bnds": [bbox[1], bbox[3]]}
+    elif lat is not None and lon is not None:
+        function = _subset_gridpoint_file
+        bounds = {"lon": list(lon), "lat": list(lat)}
+    else:
+        raise ValueError("Either lat and lon, or bbox must be given.")
+
+    output_files = []
+    for resource in netcdf_inputs:
+        output_filename = Path(workdir) / make_subset_file_name(resource)
+        max_bytes = intermediates.available() if intermediates is not None else 0
+        output = function(
+            resource,
+            output_filename,
+            max_bytes,
+            start_date=start_date,
+            end_date=end_date,
+            variables=variables or [],
+            **bounds,
+        )
+        if isinstance(output, xr.Dataset):
+            output = intermediates.put(output, output_filename)
+        if output is not None:
+            output_files.append(output)
     return output_files
 
 
@@ -238,6 +570,10 @@ def finch_average_shape(
      - start_date: Initial date for temporal subsetting.
      - end_date: Final date for temporal subsetting.
     """
+    import geopandas as gpd
+    from clisops.core.average import average_shape
+    from clisops.core.subset import subset_time
+
     shp = Path(request_inputs[wpsio.shape.identifier][0].file)
     if shp.suffix == ".zip":
         shp = extract_shp(shp)
@@ -294,6 +630,7 @@ def finch_subset_shape(
     process: Process,
     netcdf_inputs: List[ComplexInput],
     request_inputs: RequestInputs,
+    intermediates: Optional[IntermediateDatasets] = None,
 ) -> List[Path]:
     """Parse wps `request_inputs` based on their name and subset `netcdf_inputs`.
 
@@ -310,51 +647,46 @@ def finch_subset_shape(
     end_date = single_input_or_none(request_inputs, wpsio.end_date.identifier)
     variables = [r.data for r in request_inputs.get("variable", [])]
 
-    n_files = len(netcdf_inputs)
-    count = 0
-
-    output_files = []
-
-    lock = Lock()
-
-    def _subset(resource):
-        nonlocal count
-
-        # if not subsetting by time, it's not necessary to decode times
-        time_subset = start_date is not None or end_date is not None
-        dataset = try_opendap(resource, decode_times=time_subset)
+    return _subset_files(
+        process,
+        netcdf_inputs,
+        _subset_shape_file,
+        intermediates,
+        shape=shp,
+        start_date=start_date,
+        end_date=end_date,
+        variables=variables,
+    )
 
-        with lock:
-            count += 1
-            write_log(
-                process,
-                f"Subsetting file {count} of {n_files} ({getattr(resource, resource.prop)})",
-                subtask_percentage=(count - 1) * 100 // n_files,
-            )
 
+def _subset_shape_file(
+    resource,
+    output_filename: Path,
+    max_bytes: int,
+    shape,
+    start_date,
+    end_date,
+    variables,
+) -> Union[Path, xr.Dataset, None]:
+    from clisops.core.subset import subset_shape
+
+    # if not subsetting by time, it's not necessary to decode times
+    time_subset = start_date is not None or end_date is not None
+    with _open_input(resource, decode_times=time_subset) as dataset:
         dataset = dataset[variables] if variables else dataset
 
         subsetted = subset_shape(
             dataset,
-            shape=shp,
+            shape=shape,
             start_date=start_date,
             end_date=end_date,
         )
 
         if not all(subsetted.dims.values()):
             LOGGER.warning(f"Subset is empty for dataset: {resource.url}")
-            return
+            return None
 
-        p = make_subset_file_name(resource)
-        output_filename = Path(process.workdir) / p
-
-        dataset_to_netcdf(subsetted, output_filename)
-
-        output_files.append(output_filename)
-
-    process_threaded(_subset, netcdf_inputs)
-
-    return output_files
+        return _subset_output(resource, subsetted, output_filename, max_bytes)
 
 
 def common_subset_handler(
@@ -2,29 +2,41 @@
 import json
 import logging
 import os
+import posixpath
+import threading
+import time
 import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import as_completed
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from functools import cached_property
 from itertools import chain
-from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from typing import (
+    Any,
     Callable,
     Deque,
     Dict,
+    FrozenSet,
     Generator,
+    Hashable,
     Iterable,
     List,
     Optional,
+    Sequence,
     Tuple,
     Union,
 )
+from urllib.parse import urlparse
 
 import cftime
+import dask
 import numpy as np
 import pandas as pd
+import parse
 import requests
-import sentry_sdk
 import xarray as xr
 import xclim
 import yaml
@@ -41,13 +53,17 @@ from pywps import (
     Process,
     configuration,
 )
-from pywps.configuration import get_config_value
+from pywps.configuration import get_config_value, get_size_mb
 from pywps.inout.outputs import MetaFile, MetaLink4
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, InvalidSchema, MissingSchema
 from slugify import slugify
+from urllib3.util.retry import Retry
 from xclim.core.indicator import build_indicator_module_from_yaml
 from xclim.core.utils import InputKind
 
+from .executor import cpu_count, get_executor, host_limit
+
 LOGGER = logging.getLogger("PYWPS")
 
 PywpsInput = Union[LiteralInput, ComplexInput, BoundingBoxInput]
@@ -63,6 +79,97 @@ INDICATOR_OPTIONS = [
 ]
 
 
+class LRUCache:
+    """Thread-safe mapping keeping the `maxsize` most recently used items.
+
+    If `ttl` is given, items expire that many seconds after they were set.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None) -> Any:  # noqa: D102
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):  # noqa: D105
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):  # noqa: D105
+        return len(self._data)
+
+    def clear(self):  # noqa: D102
+        with self._lock:
+            self._data.clear()
+
+
+class _SharedHTTPAdapter(HTTPAdapter):
+    """HTTP adapter whose connection pool outlives the sessions it is mounted on."""
+
+    def close(self):  # noqa: D102
+        # Sessions created by other libraries (siphon) are closed when garbage collected,
+        # but the pooled connections must remain available for the next requests.
+        pass
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Return the process-wide HTTP session.
+
+    Connections are pooled per host and failed requests are retried with an exponential backoff.
+    The pool size and the number of retries are set by `http_pool_size` and `http_retries`.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            pool_size = int(get_config_value("finch", "http_pool_size") or 10)
+            retries = Retry(
+                total=int(get_config_value("finch", "http_retries") or 3),
+                backoff_factor=0.5,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=("GET", "HEAD"),
+                raise_on_status=False,
+            )
+            adapter = _SharedHTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+    return _http_session
+
+
+def _reset_http_session():
+    """Forget the HTTP session after a fork: its pooled connections belong to the parent."""
+    global _http_session, _http_session_lock
+    _http_session = None
+    _http_session_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_http_session)
+
+
 def get_virtual_modules():
     """Load virtual modules."""
     modules = {}
@@ -104,8 +211,13 @@ class DatasetConfiguration:
         the latter defines which variable are available and thus which indicator can be used.
     model_lists : dict
         A mapping from list name to a list of model names to provide special sub-lists.
+        The names are case-insensitive, they are lowercased when the configuration is read.
         The values can also be a tuple of (model name, realization numer),
         in which case, pattern must include a "realization" field.
+    historical_end : str, optional
+        The last day of the historical run, when each file is the concatenation of the
+        historical run and of a scenario (their "scenario" field starts with "historical").
+        The ensemble processes then compute the historical period once for all scenarios.
     """
 
     path: str
@@ -115,9 +227,58 @@ class DatasetConfiguration:
     depth: int = 0
     suffix: str = "*nc"
     model_lists: dict = field(default_factory=dict)
+    historical_end: Optional[str] = None
+
+    def __post_init__(self):  # noqa: D105
+        self.model_lists = {
+            name.lower(): models for name, models in (self.model_lists or {}).items()
+        }
+
+    @cached_property
+    def compiled_pattern(self) -> parse.Parser:
+        """The filename pattern, compiled once."""
+        return parse.compile(self.pattern)
+
+    @cached_property
+    def model_sets(self) -> Dict[str, "ModelSet"]:
+        """The model lists keyed by lowercase name, resolved once by :py:func:`make_model_set`."""
+        return {
+            name: make_model_set(models) for name, models in self.model_lists.items()
+        }
+
+
+# Lowercase names of the models whose first realization is requested,
+# and (lowercase model name, realization) of the specific realizations requested.
+ModelSet = Tuple[FrozenSet[str], FrozenSet[Tuple[str, str]]]
+
+
+def make_model_set(modelspecs: Iterable[Union[str, Sequence[str]]]) -> ModelSet:
+    """Split model specifications into model names and (model, realization) pairs, for fast lookups."""
+    names = set()
+    pairs = set()
+    for modelspec in modelspecs:
+        if isinstance(modelspec, str):  # case with a single model name
+            names.add(modelspec.lower())
+        else:  # case with a couple model name, realization num.
+            pairs.add((modelspec[0].lower(), modelspec[1]))
+    return frozenset(names), frozenset(pairs)
 
 
-def get_datasets_config():  # noqa: D103
+# The parsed datasets configuration, and the (path, mtime, size) of the file it was read from
+_datasets_config: Tuple[Optional[Hashable], Dict[str, DatasetConfiguration]] = (
+    None,
+    {},
+)
+_datasets_config_lock = threading.Lock()
+
+
+def get_datasets_config() -> Dict[str, DatasetConfiguration]:
+    """Return the configuration of the ensemble datasets, read from the `datasets_config` file.
+
+    The file is parsed again only when its modification time or size change. The
+    `DatasetConfiguration` objects are shared by all requests and must not be modified.
+    """
+    global _datasets_config
     p = get_config_value("finch", "datasets_config")
     if not p:  # No config given.
         return {}
@@ -125,9 +286,18 @@ def get_datasets_config():  # noqa: D103
     if not Path(p).is_absolute():
         p = Path(__file__).parent.parent / p
 
-    with open(p) as f:
-        conf = yaml.safe_load(f)
-    return {ds: DatasetConfiguration(**dsconf) for ds, dsconf in conf.items()}
+    stat = os.stat(p)
+    key = (str(p), stat.st_mtime_ns, stat.st_size)
+    with _datasets_config_lock:
+        cached_key, datasets = _datasets_config
+        if cached_key != key:
+            with open(p) as f:
+                conf = yaml.safe_load(f)
+            datasets = {
+                ds: DatasetConfiguration(**dsconf) for ds, dsconf in conf.items()
+            }
+            _datasets_config = (key, datasets)
+    return dict(datasets)
 
 
 def get_available_variables():  # noqa: D103
@@ -146,6 +316,81 @@ def log_file_path(process: Process) -> Path:
     return Path(process.workdir) / "log.txt"
 
 
+class JobLog:
+    """The log file and the status updates of a running job.
+
+    Messages are appended to the log file through a single open handle. Updating the status
+    document also writes to the pywps database, so the updates are sent at most every
+    `interval` seconds, with the latest message. Pending lines and status are written by
+    :py:meth:`flush`.
+    """
+
+    def __init__(self, path: Path, interval: float, status_percentage: int = 0):
+        self.path = path
+        self.interval = interval
+        self.status_percentage = status_percentage
+        self._file = None
+        self._pending: Optional[Tuple[str, int]] = None
+        self._last_update = float("-inf")
+        self._lock = threading.Lock()
+
+    def write(self, response, message: str, status_percentage: int, force=False):
+        """Append a message to the log file and update the status, if the last update is old enough."""
+        with self._lock:
+            if self._file is None:
+                self._file = self.path.open("a", encoding="utf8")
+            self._file.write(message + "\n")
+            self.status_percentage = status_percentage
+            self._pending = (message, status_percentage)
+            if force or time.monotonic() - self._last_update >= self.interval:
+                self._send(response)
+
+    def flush(self, response) -> None:
+        """Write the log file and send the pending status update."""
+        with self._lock:
+            if self._pending is not None:
+                self._send(response)
+
+    def close(self, response) -> None:
+        """Flush and close the log file."""
+        with self._lock:
+            if self._pending is not None:
+                self._send(response)
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _send(self, response) -> None:
+        self._file.flush()
+        message, status_percentage = self._pending
+        self._pending = None
+        self._last_update = time.monotonic()
+        try:
+            response.update_status(message, status_percentage=status_percentage)
+        except AttributeError:
+            pass
+
+
+def get_job_log(process: Process) -> JobLog:
+    """Return the log of the job running `process`, creating it on first use."""
+    job_log = getattr(process, "_job_log", None)
+    if job_log is None:
+        interval = float(get_config_value("finch", "status_update_interval") or 1)
+        job_log = JobLog(
+            log_file_path(process), interval, process.response.status_percentage
+        )
+        process._job_log = job_log
+    return job_log
+
+
+def close_job_log(process: Process) -> None:
+    """Write the pending messages and status of the job running `process`, and close its log file."""
+    job_log = getattr(process, "_job_log", None)
+    if job_log is not None:
+        job_log.close(process.response)
+        process._job_log = None
+
+
 def write_log(
     process: Process,
     message: str,
@@ -162,10 +407,16 @@ def write_log(
 
     subtask_percentage: not the percentage of the whole process, but the percent done
     in the current processing step. (see `process.status_percentage_steps`)
+
+    The log file and the response document are updated through the job's :py:class:`JobLog`:
+    the updates of the response document are throttled, except at the start of a step.
     """
     LOGGER.log(level, message)
+    if level < logging.INFO:
+        return
 
-    status_percentage = process.response.status_percentage
+    job_log = get_job_log(process)
+    status_percentage = job_log.status_percentage
 
     # if a process_step is given, set this as the status percentage
     if process_step:
@@ -189,32 +440,39 @@ def write_log(
         sub_percentage = subtask_percentage / 100 * step_delta
         status_percentage = current_step_percentage + int(sub_percentage)
 
-    if level >= logging.INFO:
-        log_file_path(process).open("a", encoding="utf8").write(message + "\n")
-        try:
-            process.response.update_status(message, status_percentage=status_percentage)
-        except AttributeError:
-            pass
+    job_log.write(
+        process.response, message, status_percentage, force=bool(process_step)
+    )
 
 
 def get_attributes_from_config():
     """Get all explicitly passed metadata attributes from the config in section finch:metadata."""
-    # Remove all "defaults", only keep explicitly-passed options
-    # This works because we didn't define any defaults for this section.
-    # But will do strange things if any of the defaults have the same name as a passed field
-    # This is especially risky, since ALL environment variables are listed in the defaults...
-    names = set(configuration.CONFIG["finch:metadata"].keys()) - set(
-        configuration.CONFIG._defaults.keys()
-    )
-
+    config = configuration.CONFIG
+    # Remove the "defaults", which are all the environment variables, unless the
+    # section sets an option of the same name to another value
+    defaults = config.defaults()
+    names = [
+        name
+        for name in config.options("finch:metadata")
+        if name not in defaults
+        or config.get("finch:metadata", name, raw=True) != defaults[name]
+    ]
     return {
         name: configuration.get_config_value("finch:metadata", name) for name in names
     }
 
 
 def compute_indices(
-    process: Process, func: Callable, inputs: RequestInputs
-) -> xr.Dataset:  # noqa: D103
+    process: Process,
+    func: Callable,
+    inputs: RequestInputs,
+    datasets: Optional[Dict[str, xr.Dataset]] = None,
+) -> xr.Dataset:
+    """Compute an indicator from the inputs of a request.
+
+    The netCDF inputs are opened with :py:func:`try_opendap`, unless an opened dataset
+    is given for the input's name in `datasets`.
+    """
     kwds = {}
     global_attributes = {}
     for name, input_queue in inputs.items():
@@ -234,9 +492,12 @@ def compute_indices(
                 kwds[name] = json.loads(input.data)
 
             elif input.supported_formats[0] in [FORMATS.NETCDF, FORMATS.DODS]:
-                ds = try_opendap(
-                    input, logging_function=lambda msg: write_log(process, msg)
-                )
+                if datasets is not None and name in datasets:
+                    ds = datasets[name]
+                else:
+                    ds = try_opendap(
+                        input, logging_function=lambda msg: write_log(process, msg)
+                    )
                 global_attributes = global_attributes or ds.attrs
                 vars = list(ds.data_vars.values())
 
@@ -402,24 +663,49 @@ def try_opendap(
     If `chunks=None` or `chunks_dims` is given, finch rechunks the dataset according to
     the logic of `chunk_dataset`.
     Pass `chunks=False` to disable dask entirely on this dataset.
+
+    Other http urls are fetched through the shared download cache, if it is enabled.
+    The coordinates of the files are read from the metadata cache when possible,
+    instead of being fetched again.
     """
+    from .cache import (  # pylint: disable=cyclic-import
+        get_download_cache,
+        get_metadata_cache,
+    )
+
     url = input.url
     logging_function(f"Try opening DAP link {url}")
 
+    cache = get_metadata_cache()
+    downloads = get_download_cache() if url.startswith("http") else None
     if is_opendap_url(url):
-        path = url
+        path = source = url
         logging_function(f"Opened dataset as an OPeNDAP url: {url}")
+    elif downloads is not None and not input.post_data:
+        logging_function(f"Fetching dataset through the download cache: {url}")
+        # The job gets its own link to the shared file
+        source, path = downloads.fetch_linked(url, input.workdir)
     else:
         if url.startswith("http"):
             # Accessing the file property writes it to disk if it's a url
             logging_function(f"Downloading dataset for url: {url}")
+            # The downloaded copy is new each time, there's no point in caching it.
+            cache = None
         else:
             logging_function(f"Opening as local file: {input.file}")
-        path = input.file
+        path = source = input.file
+
+    metadata = cache.get(str(source)) if cache is not None else None
+    drop_variables = list(metadata.coords) if metadata is not None else None
 
     try:
         # Try to open the dataset
-        ds = xr.open_dataset(path, chunks=chunks or None, decode_times=decode_times)
+        ds = xr.open_dataset(
+            path,
+            chunks=chunks or None,
+            decode_times=decode_times,
+            drop_variables=drop_variables,
+        )
     except NotImplementedError:
         if chunks == "auto":
             # Some dtypes are not compatible with auto chunking (object, so unbounded strings)
@@ -427,10 +713,21 @@ def try_opendap(
                 "xarray auto-chunking failed, opening with no chunks and inferring chunks ourselves."
             )
             chunks = None
-            ds = xr.open_dataset(path, chunks=None, decode_times=decode_times)
+            ds = xr.open_dataset(
+                path,
+                chunks=None,
+                decode_times=decode_times,
+                drop_variables=drop_variables,
+            )
         else:
             raise
 
+    if metadata is not None:
+        logging_function(f"Coordinates read from the metadata cache for {path}")
+        ds = metadata.restore(ds, decode_times=decode_times)
+    elif cache is not None:
+        cache.put(str(source), ds)
+
     # To handle large number of grid cells (50+) in subsetted data
     if "region" in ds.dims and "time" in ds.dims:
         chunks = dict(time=-1, region=5)
@@ -440,18 +737,37 @@ def try_opendap(
     return ds
 
 
+def _host_limited(function: Callable, item):
+    with host_limit(getattr(item, "url", None)):
+        return function(item)
+
+
 def process_threaded(function: Callable, inputs: Iterable):
-    """Based on the current configuration, process a list threaded or not."""
-    threads = int(configuration.get_config_value("finch", "subset_threads"))
-    if threads > 1:
-        pool = ThreadPool(processes=threads)
-        outputs = list(pool.imap_unordered(function, inputs))
-        pool.close()
-        pool.join()
-    else:
-        outputs = [function(r) for r in inputs]
+    """Based on the current configuration, process a list threaded or not.
 
-    return outputs
+    The items are processed by the worker's long-lived thread pool, in no particular order.
+    Items with an http url (remote netCDF inputs) are subject to the per-host concurrency limit.
+    """
+    executor = get_executor("thread")
+    if executor is None:
+        return [_host_limited(function, r) for r in inputs]
+
+    futures = [executor.submit(_host_limited, function, r) for r in inputs]
+    try:
+        return [future.result() for future in as_completed(futures)]
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def get_config_size(option: str, default: str) -> int:
+    """Return a size of the `finch` configuration section in bytes (ex: "10gb", a number alone is in megabytes)."""
+    value = get_config_value("finch", option) or default
+    try:
+        size = float(value)
+    except ValueError:
+        size = get_size_mb(value)
+    return int(size * 1024**2)
 
 
 def chunk_dataset(ds, max_size=1000000, chunk_dims=None):
@@ -505,6 +821,27 @@ def make_metalink_output(
     return metalink
 
 
+# Results of `is_opendap_url`, by url and by url prefix (the "folder" of the url)
+_opendap_urls = LRUCache(maxsize=4096, ttl=3600)
+
+
+def _url_prefix(url: str) -> Optional[str]:
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https"):
+        return None
+    return f"{parsed.scheme}://{parsed.netloc}{posixpath.dirname(parsed.path)}/"
+
+
+def register_opendap_url(url: str) -> None:
+    """Record a url known to be an OpenDAP url, for example one listed in a THREDDS catalog.
+
+    Neither this url nor the other urls under the same prefix will be probed by `is_opendap_url`.
+    """
+    _opendap_urls[url] = True
+    if prefix := _url_prefix(url):
+        _opendap_urls[prefix] = True
+
+
 def is_opendap_url(url):
     """Check if a provided url is an OpenDAP url.
 
@@ -516,25 +853,40 @@ def is_opendap_url(url):
 
     Even then, some OpenDAP servers seem to not include the specified header...
     So we need to let the netCDF4 library actually open the file.
+
+    Results are cached for an hour. Once a url is found to be an OpenDAP url,
+    the other urls with the same prefix are assumed to be OpenDAP urls too.
     """
+    cached = _opendap_urls.get(url)
+    if cached is None and isinstance(url, str) and (prefix := _url_prefix(url)):
+        cached = _opendap_urls.get(prefix)
+    if cached is not None:
+        return cached
+
     try:
-        content_description = requests.head(url, timeout=5).headers.get(
-            "Content-Description"
+        content_description = (
+            get_http_session().head(url, timeout=5).headers.get("Content-Description")
         )
-    except (ConnectionError, MissingSchema, InvalidSchema):
+    except (InvalidSchema, MissingSchema):
+        _opendap_urls[url] = False
         return False
-
-    if content_description:
-        return content_description.lower().startswith("dods")
-    else:
+    except ConnectionError:
+        # Don't cache, the server might only be temporarily unavailable.
         return False
 
-        # try:
-        #     # For a non-DAP URL, this just hangs python.
-        #     dataset = netCDF4.Dataset(url)
-        # except OSError:
-        #     return False
-        # return dataset.disk_format in ("DAP2", "DAP4")
+    if content_description and content_description.lower().startswith("dods"):
+        register_opendap_url(url)
+        return True
+
+    _opendap_urls[url] = False
+    return False
+
+    # try:
+    #     # For a non-DAP URL, this just hangs python.
+    #     dataset = netCDF4.Dataset(url)
+    # except OSError:
+    #     return False
+    # return dataset.disk_format in ("DAP2", "DAP4")
 
 
 def single_input_or_none(inputs, identifier) -> Optional[str]:
@@ -550,13 +902,18 @@ def netcdf_file_list_to_csv(
     output_folder,
     filename_prefix,
     csv_precision: Optional[int] = None,
+    output_format: str = "csv",
 ) -> Tuple[List[str], str]:
     """Write csv files for a list of netcdf files.
 
     Produces one csv file per calendar type, along with a metadata folder in the output_folder.
+    With `output_format="parquet"`, parquet files are written instead of csv files, and
+    the metadata of their variables is also embedded in them.
     """
     output_folder = Path(output_folder)
     output_folder.mkdir(parents=True, exist_ok=True)
+    if output_format != "csv":
+        csv_precision = None
 
     def get_attrs_fallback(ds, *args):
         for key in args:
@@ -567,12 +924,12 @@ def netcdf_file_list_to_csv(
         raise KeyError(f"Couldn't find any attribute in [{', '.join(args)}]")
 
     metadata = {}
-    concat_by_calendar = {}
+    datasets_by_calendar = {}
     for file in netcdf_files:
         ds = xr.open_dataset(str(file), decode_times=False)
-        coords = ds.coords
         calendar = ds.time.calendar
         ds["time"] = xr.decode_cf(ds).time
+        set_time_to_noon(ds)
 
         for variable in ds.data_vars:
             # for a specific dataset the keys are different:
@@ -590,49 +947,46 @@ def netcdf_file_list_to_csv(
                 output_variable += f"_({units})"
 
             ds = ds.rename({variable: output_variable})
-            if csv_precision and csv_precision < 0:
-                ds = ds.round(csv_precision)
-                csv_precision = 0
-            df = dataset_to_dataframe(ds)
+            metadata[output_variable] = format_metadata(ds)
 
-            if calendar not in concat_by_calendar:
-                # TODO: Why was this there? When we have a time axis, this makes the concat fail.
-                # if "lat" in df.index.names and "lon" in df.index.names:
-                #     df = df.reset_index(["lat", "lon"])
-                concat_by_calendar[calendar] = [df]
-            else:
-                concat_by_calendar[calendar].append(df[output_variable])
+        if csv_precision and csv_precision < 0:
+            ds = ds.round(csv_precision)
+        datasets_by_calendar.setdefault(calendar, []).append(ds)
 
-            metadata[output_variable] = format_metadata(ds)
+    if csv_precision and csv_precision < 0:
+        csv_precision = 0
 
     output_csv_list = []
-    for calendar_type, data in concat_by_calendar.items():
-        output_csv = output_folder / f"{filename_prefix}_{calendar_type}.csv"
-        concat = pd.concat(data, axis=1)
+    for calendar_type, datasets in datasets_by_calendar.items():
+        output_csv = (
+            output_folder / f"{filename_prefix}_{calendar_type}.{output_format}"
+        )
+        # The coordinates of the first file are kept, as its columns come first
+        ds = xr.merge(datasets, join="outer", compat="override")
 
-        if "region" in concat.reset_index().columns:
-            concat = (
-                concat.reset_index()
+        if "region" in ds.variables:
+            df = dataset_to_dataframe(ds)
+            frames = [
+                df.reset_index()
                 .sort_values(["region", "time"])
                 .set_index(["lat", "lon", "time"])
                 .drop(columns="region")
-            )
+            ]
         else:
-            concat = (
-                concat.reset_index()
-                .sort_values(["lat", "lon", "time"])
-                .set_index(["lat", "lon", "time"])
-            )
+            frames = iter_dataframes(ds)
 
         dropna_threshold = 1  # at least one value
-        concat.dropna(thresh=dropna_threshold, inplace=True)
-        if csv_precision is not None:
-            for v in concat:
-                if v not in coords and is_numeric_dtype(concat[v]):
-                    concat[v] = concat[v].map(
-                        lambda x: f"{x:.{csv_precision}f}" if not pd.isna(x) else ""
-                    )
-        concat.to_csv(output_csv)
+        frames = (df.dropna(thresh=dropna_threshold) for df in frames)
+        if output_format == "parquet":
+            dataframes_to_parquet(
+                frames,
+                output_csv,
+                metadata={v: metadata[v] for v in ds.data_vars if v in metadata},
+            )
+        else:
+            dataframes_to_csv(
+                frames, output_csv, csv_precision=csv_precision, exclude=ds.coords
+            )
         output_csv_list.append(output_csv)
 
     metadata_folder = output_folder / "metadata"
@@ -644,8 +998,8 @@ def netcdf_file_list_to_csv(
     return output_csv_list, str(metadata_folder)
 
 
-def dataset_to_dataframe(ds: xr.Dataset) -> pd.DataFrame:
-    """Convert a Dataset while keeping the hour of the day uniform at hour=12."""
+def set_time_to_noon(ds: xr.Dataset) -> None:
+    """Set the hour of the `time` coordinate to 12, in place."""
     if not np.all(ds.time.dt.hour == 12):
         attrs = ds.time.attrs
 
@@ -656,16 +1010,22 @@ def dataset_to_dataframe(ds: xr.Dataset) -> pd.DataFrame:
 
         ds["time"] = [y.replace(hour=12) for y in time_values]
         ds.time.attrs = attrs
+
+
+def _dataframe_index(ds: xr.Dataset) -> List[str]:
+    names = ["lat", "lon", "time"]
+    if "realization" in ds.dims:
+        names += ["scenario", "region"]
+    return [n for n in names if n in ds.dims or n in ds.variables]
+
+
+def dataset_to_dataframe(ds: xr.Dataset) -> pd.DataFrame:
+    """Convert a Dataset while keeping the hour of the day uniform at hour=12."""
+    set_time_to_noon(ds)
     df = ds.to_dataframe().reset_index()
 
-    if "realization" not in ds.dims:
-        new_cols = [ll for ll in ["lat", "lon", "time"] if ll in df.columns]
-    else:
-        new_cols = [
-            ll
-            for ll in ["lat", "lon", "time", "scenario", "region"]
-            if ll in df.columns
-        ]
+    new_cols = _dataframe_index(ds)
+    if "realization" in ds.dims:
         values = [c for c in df.columns if c not in new_cols and c != "realization"]
         df = df.pivot(
             index=new_cols,
@@ -681,6 +1041,155 @@ def dataset_to_dataframe(ds: xr.Dataset) -> pd.DataFrame:
     return df
 
 
+def iter_dataframes(
+    ds: xr.Dataset, rows_per_block: int = 100000
+) -> Generator[pd.DataFrame, None, None]:
+    """Yield the table of :py:func:`dataset_to_dataframe` in blocks of about `rows_per_block` rows.
+
+    The blocks are slices along the dimensions of the table's index, so that they follow
+    each other. When a column of the index is not a dimension nor a scalar (ex: 2D latitudes),
+    the whole table is yielded at once.
+    """
+    index = _dataframe_index(ds)
+    if any(n not in ds.dims and ds[n].ndim > 0 for n in index):
+        yield dataset_to_dataframe(ds)
+        return
+
+    dims = [n for n in index if n in ds.dims]
+    ds = ds.sortby([d for d in dims if d in ds.coords])
+    sizes = [ds.sizes[d] for d in dims]
+
+    # Find the dimensions that fit whole in a block, starting from the last one
+    rows = int(np.prod([ds.sizes[d] for d in ds.dims if d not in dims]))
+    n_outer = len(dims)
+    while n_outer > 0 and rows * sizes[n_outer - 1] <= rows_per_block:
+        n_outer -= 1
+        rows *= sizes[n_outer]
+    if n_outer == 0 or 0 in sizes:
+        yield dataset_to_dataframe(ds)
+        return
+
+    dim, size = dims[n_outer - 1], sizes[n_outer - 1]
+    step = max(rows_per_block // rows, 1)
+    for position in np.ndindex(*sizes[: n_outer - 1]):
+        indexers = {d: slice(i, i + 1) for d, i in zip(dims, position)}
+        for start in range(0, size, step):
+            indexers[dim] = slice(start, start + step)
+            yield dataset_to_dataframe(ds.isel(indexers))
+
+
+def format_decimals(values: np.ndarray, precision: int) -> np.ndarray:
+    """Format numbers as ``f"{x:.{precision}f}"`` does, and NaNs as empty strings.
+
+    The digits are computed with array operations instead of formatting each number.
+    Numbers too large for that, or too close to a rounding tie, are formatted by python.
+    """
+    values = np.asarray(values, dtype="float64")
+    result = np.full(values.shape, "", dtype=object)
+    if values.size == 0:
+        return result
+
+    nan = np.isnan(values)
+    with np.errstate(invalid="ignore"):
+        scaled = np.where(nan, 0, values).ravel() * 10.0**precision
+        rounded = np.rint(scaled)
+        slow = (
+            ~np.isfinite(scaled)
+            | (np.abs(scaled) >= 2**53)
+            | (np.abs(np.abs(scaled - rounded) - 0.5) <= 2 * np.spacing(np.abs(scaled)))
+        )
+    digits = np.abs(np.where(slow, 0, rounded)).astype(np.int64)
+    whole, fraction = np.divmod(digits, 10**precision)
+    negative = np.signbit(values.ravel()) & ~nan.ravel() & ~slow
+    n_whole = np.searchsorted(10 ** np.arange(1, 17), whole, side="right") + 1
+
+    # One byte per character, right-padded with null bytes
+    start = negative.astype(np.int64)
+    width = int((start + n_whole).max()) + (precision + 1 if precision else 0)
+    chars = np.zeros((values.size, width), dtype=np.uint8)
+    rows = np.arange(values.size)
+    chars[negative, 0] = ord("-")
+    for k in range(int(n_whole.max())):
+        has_digit = k < n_whole
+        chars[rows[has_digit], (start + n_whole - 1 - k)[has_digit]] = ord("0") + (
+            whole[has_digit] // 10**k % 10
+        )
+    if precision:
+        point = start + n_whole
+        chars[rows, point] = ord(".")
+        for k in range(precision):
+            chars[rows, point + 1 + k] = (
+                ord("0") + fraction // 10 ** (precision - 1 - k) % 10
+            )
+
+    result.ravel()[:] = chars.view(f"S{width}").ravel().astype(str)
+    slow = slow.reshape(values.shape) & ~nan
+    result[slow] = [f"{x:.{precision}f}" for x in values[slow]]
+    result[nan] = ""
+    return result
+
+
+def dataframes_to_csv(
+    frames: Iterable[pd.DataFrame],
+    output_csv: Union[Path, str],
+    csv_precision: Optional[int] = None,
+    exclude: Iterable[str] = (),
+) -> None:
+    """Write dataframes one after the other in a csv file, with the header of the first one.
+
+    With `csv_precision`, the numeric columns that are not in `exclude` are written with that
+    number of decimals.
+    """
+    exclude = set(exclude)
+    with open(output_csv, "w", newline="") as f:
+        for n, df in enumerate(frames):
+            if csv_precision is not None:
+                formatted = {
+                    v: format_decimals(df[v].to_numpy(), csv_precision)
+                    for v in df
+                    if v not in exclude and is_numeric_dtype(df[v])
+                }
+                df = df.assign(**formatted)
+            df.to_csv(f, header=n == 0)
+
+
+def dataframes_to_parquet(
+    frames: Iterable[pd.DataFrame],
+    output_path: Union[Path, str],
+    metadata: Optional[Dict[str, str]] = None,
+) -> None:
+    """Write dataframes as the row groups of a compressed parquet file.
+
+    The `metadata` strings (ex: from :py:func:`format_metadata`) are added to the file's
+    key-value metadata. Dates of non-standard calendars are written as strings.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for df in frames:
+            df = df.reset_index()
+            for column in df:
+                if df[column].dtype == object and any(
+                    isinstance(value, cftime.datetime) for value in df[column]
+                ):
+                    df[column] = df[column].astype(str)
+
+            if writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                schema = table.schema.with_metadata(
+                    {**table.schema.metadata, **(metadata or {})}
+                )
+                writer = pq.ParquetWriter(str(output_path), schema, compression="zstd")
+            else:
+                table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
 def format_metadata(ds) -> str:
     """For an xarray dataset, return its formatted metadata."""
 
@@ -711,47 +1220,79 @@ def format_metadata(ds) -> str:
     return out
 
 
+# Members with these suffixes are always deflated, those of other types only if a sample compresses well
+_TEXT_SUFFIXES = {".csv", ".txt", ".json", ".geojson", ".xml", ".meta4", ".log"}
+_COMPRESSED_SUFFIXES = {
+    ".zip",
+    ".gz",
+    ".bz2",
+    ".xz",
+    ".zst",
+    ".parquet",
+    ".png",
+    ".jpg",
+}
+
+
+def _is_compressible(path: Path, sample_size: int = 2**16) -> bool:
+    suffix = path.suffix.lower()
+    if suffix in _TEXT_SUFFIXES:
+        return True
+    if suffix in _COMPRESSED_SUFFIXES:
+        return False
+    # Sample the middle of the file, the header of a netCDF is always compressible
+    with open(path, "rb") as f:
+        f.seek(max(path.stat().st_size - sample_size, 0) // 2)
+        sample = f.read(sample_size)
+    return len(zlib.compress(sample, 1)) < 0.9 * len(sample)
+
+
 def zip_files(
     output_filename, files: Iterable, log_function: Callable[[str, int], None] = None
 ):
     """Create a zipfile from a list of files or folders.
 
     log_function is a function that receives a message and a percentage.
+
+    Members that are already compressed (netCDF files with zlib compression, parquet files)
+    are stored as is, the others are deflated.
     """
     log_function = log_function or (lambda *a: None)
-    with zipfile.ZipFile(
-        output_filename, mode="w", compression=zipfile.ZIP_DEFLATED
-    ) as z:
-        all_files = []
-        for file in files:
-            file = Path(file)
-            if file.is_dir():
-                all_files += list(file.rglob("*.*"))
-            else:
-                all_files.append(file)
+    all_files = []
+    for file in files:
+        file = Path(file)
+        if file.is_dir():
+            all_files += list(file.rglob("*.*"))
+        else:
+            all_files.append(file)
 
+    try:
+        common_folder = Path(os.path.commonpath([f.parent for f in all_files]))
+    except ValueError:  # no files, or both absolute and relative paths
         common_folder = None
-        all_parents = [list(reversed(file.parents)) for file in all_files]
-        for parents in zip(*all_parents):
-            if len(set(parents)) == 1:
-                common_folder = parents[0]
-            else:
-                break
 
-        n_files = len(all_files)
+    n_files = len(all_files)
+    with zipfile.ZipFile(
+        output_filename, mode="w", compression=zipfile.ZIP_DEFLATED
+    ) as z:
         for n, filename in enumerate(all_files):
             percentage = int(n / n_files * 100)
-            message = f"Zipping file {n + 1} of {n_files}"
-            log_function(message, percentage)
-
+            log_function(f"Zipping file {n + 1} of {n_files}", percentage)
             arcname = filename.relative_to(common_folder) if common_folder else None
-            z.write(filename, arcname=arcname)
+            compress_type = (
+                zipfile.ZIP_DEFLATED
+                if _is_compressible(filename)
+                else zipfile.ZIP_STORED
+            )
+            z.write(filename, arcname=arcname, compress_type=compress_type)
 
 
 def make_tasmin_tasmax_pairs(
     filenames: List[Path],
 ) -> Generator[Tuple[Path, Path], None, None]:
     """Return pairs of corresponding tasmin-tasmax files based on their filename."""
+    import sentry_sdk
+
     tasmin_files = [f for f in filenames if "tasmin" in f.name.lower()]
     tasmax_files = [f for f in filenames if "tasmax" in f.name.lower()]
     for tasmin in tasmin_files[:]:
@@ -806,7 +1347,13 @@ def fix_broken_time_index(ds: xr.Dataset):
 def dataset_to_netcdf(
     ds: xr.Dataset, output_path: Union[Path, str], compression_level=0
 ) -> None:
-    """Write an :py:class:`xarray.Dataset` dataset to disk, optionally using compression."""
+    """Write an :py:class:`xarray.Dataset` dataset to disk, optionally using compression.
+
+    The data is computed and written chunk by chunk, keeping the memory used around the
+    `write_memory_budget` setting. When it is 0, the dataset is loaded before being written.
+    Outputs larger than the budget are computed by up to a thread per CPU, as many as
+    the budget allows given the size of the dataset's chunks; the others in this thread.
+    """
     encoding = {}
 
     if "time" in ds.dims:
@@ -818,11 +1365,104 @@ def dataset_to_netcdf(
         for v in ds.data_vars:
             encoding[v] = {"zlib": True, "complevel": compression_level}
 
-    # Perform computations
-    ds.load()
+    budget = get_config_size("write_memory_budget", "256mb")
+    if budget <= 0:
+        # Perform computations
+        ds.load()
+
+        # This is necessary when running with gunicorn to avoid lock-ups
+        ds.to_netcdf(str(output_path), format="NETCDF4", encoding=encoding)
+        return
+
+    # The chunks of a dask dataset are computed whole, whatever the chunks written
+    input_chunk = max(
+        (
+            np.prod([max(sizes) for sizes in v.chunks]) * v.dtype.itemsize
+            for v in ds.data_vars.values()
+            if v.chunks
+        ),
+        default=0,
+    )
+    workers = min(
+        cpu_count(), -(-ds.nbytes // budget), budget // max(4 * input_chunk, 1)
+    )
+    workers = max(workers, 1)
+    if ds.dims:
+        # A few chunks are in memory at once for each worker: the one computed, its
+        # inputs and the one written
+        itemsize = max((v.dtype.itemsize for v in ds.data_vars.values()), default=8)
+        chunks = chunk_dataset(
+            ds, max_size=max(budget // (4 * itemsize * workers), 1024)
+        )
+        try:
+            # Don't merge the chunks of a dask dataset, it would compute several at once
+            for dim, sizes in ds.chunks.items():
+                chunks[dim] = min(chunks[dim], max(sizes))
+        except ValueError:  # variables with inconsistent chunks
+            pass
+        ds = ds.chunk(chunks)
+
+    if workers == 1:
+        scheduler = {"scheduler": "synchronous"}
+    else:
+        scheduler = {"scheduler": "threads", "num_workers": workers}
+    with dask.config.set(**scheduler):
+        ds.to_netcdf(str(output_path), format="NETCDF4", encoding=encoding)
+
+
+class IntermediateDatasets:
+    """Datasets passed between the steps of a job, kept in memory up to a total size.
+
+    Each dataset is identified by the path of the file it would be written to, so that
+    the steps can keep working with file names. Datasets are written to that file
+    only when keeping them would exceed `limit` bytes, by default the
+    `intermediate_memory_limit` setting. With a limit of 0, all of them are written.
+    Only the variables loaded in memory count towards the limit, not the dask arrays.
+    """
 
-    # This is necessary when running with gunicorn to avoid lock-ups
-    ds.to_netcdf(str(output_path), format="NETCDF4", encoding=encoding)
+    def __init__(self, limit: Optional[int] = None):
+        if limit is None:
+            limit = get_config_size("intermediate_memory_limit", "512mb")
+        self.limit = limit
+        self.size = 0
+        self._datasets: Dict[Path, Tuple[xr.Dataset, int]] = {}
+        self._lock = threading.Lock()
+
+    def available(self) -> int:
+        """Return the number of bytes that can still be kept in memory."""
+        with self._lock:
+            return max(self.limit - self.size, 0)
+
+    def put(self, ds: xr.Dataset, path: Union[Path, str]) -> Path:
+        """Keep a dataset in memory, or write it to `path` if it's too large. Return `path`."""
+        path = Path(path)
+        nbytes = sum(var.nbytes for var in ds.variables.values() if var.chunks is None)
+        with self._lock:
+            keep = self.size + nbytes <= self.limit
+            if keep:
+                self.size += nbytes
+                self._datasets[path] = ds, nbytes
+        if not keep:
+            dataset_to_netcdf(ds, path)
+        return path
+
+    def open(self, path: Union[Path, str], **kwargs) -> xr.Dataset:
+        """Return the dataset kept for `path`, or open the file with `kwargs`."""
+        kept = self._datasets.get(Path(path))
+        if kept is None:
+            return xr.open_dataset(path, **kwargs)
+        return kept[0]
+
+    def release(self, directory: Union[Path, str]) -> None:
+        """Forget the datasets kept for the files of `directory` and its subdirectories."""
+        directory = Path(directory)
+        with self._lock:
+            for path in list(self._datasets):
+                if directory in path.parents:
+                    self.size -= self._datasets.pop(path)[1]
+
+    def __contains__(self, path) -> bool:  # noqa: D105
+        return Path(path) in self._datasets
 
 
 def update_history(
@@ -18,7 +18,7 @@ from finch.processes import get_processes
 if not get_config_value("finch", "datasets_config"):
     load_configuration(Path(__file__).parent.parent / "default.cfg")
 
-processes = sorted(get_processes(), key=lambda p: p.__class__.__name__)
+processes = sorted(get_processes(lazy=False), key=lambda p: p.__class__.__name__)
 
 ens_proc = {
     p.__class__.__name__: p.__class__
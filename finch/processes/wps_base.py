@@ -1,18 +1,21 @@
 # noqa: D100
+import copy
 import io
 import logging
+import threading
+from functools import lru_cache
 from inspect import _empty as empty_default  # noqa
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import xclim
 from dask.diagnostics import ProgressBar
 from pywps import FORMATS, ComplexInput, LiteralInput, Process
 from pywps.app.Common import Metadata
 from pywps.app.exceptions import ProcessError
-from sentry_sdk import configure_scope
+from unidecode import unidecode
 from xclim.core.utils import InputKind
 
-from .utils import PywpsInput
+from .utils import PywpsInput, close_job_log
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -63,12 +66,16 @@ class FinchProcess(Process):
         except Exception as err:
             LOGGER.exception("FinchProcess handler wrapper failed with:")
             raise ProcessError(f"Finch failed with {err!s}")
+        finally:
+            close_job_log(self)
 
     def sentry_configure_scope(self, request):
         """Add additional data to sentry error messages.
 
         When sentry is not initialized, this won't add any overhead.
         """
+        from sentry_sdk import configure_scope
+
         with configure_scope() as scope:
             scope.set_extra("identifier", self.identifier)
             scope.set_extra("request_uuid", str(self.uuid))
@@ -104,7 +111,7 @@ class FinchProgressBar(ProgressBar):
 
 
 def make_xclim_indicator_process(
-    xci, class_name_suffix: str, base_class
+    xci, class_name_suffix: str, base_class, translations: Optional[Dict] = None
 ) -> FinchProcess:
     """Create a WPS Process subclass from an xclim `Indicator` class instance.
 
@@ -118,6 +125,8 @@ def make_xclim_indicator_process(
       Suffix appended to the indicator identifier to create the Process subclass name.
     base_class : cls
       Class that will be subclassed to create indicator Process.
+    translations : dict, optional
+      Translations of the process, by locale. Defaults to those of the indicator in xclim's locales.
     """
     # Sanitize name
     name = xci.identifier.replace("{", "_").replace("}", "_").replace("__", "_")
@@ -129,14 +138,98 @@ def make_xclim_indicator_process(
     )
 
     process = process_class()
-    process.translations = {  # type: ignore
+    process.translations = translations or indicator_translations(  # type: ignore
+        xci.identifier
+    )
+
+    return process  # type: ignore
+
+
+@lru_cache(maxsize=None)
+def indicator_translations(identifier: str) -> Dict[str, Dict[str, str]]:
+    """Return the translated attributes of an xclim indicator, for all the xclim locales.
+
+    The translations are shared by the processes of an indicator (xclim indicator and ensembles).
+    """
+    return {
         locale: xclim.core.locales.get_local_attrs(
-            xci.identifier.upper(), locale, append_locale_name=False
+            identifier.upper(), locale, append_locale_name=False
         )
         for locale in xclim.core.locales.list_locales()
     }
 
-    return process  # type: ignore
+
+class LazyProcess:
+    """Descriptor of an xclim indicator process, building the process on first use.
+
+    GetCapabilities only needs the identifier, title and abstract of the processes, which
+    are taken from the indicator. The full process, with its inputs and outputs, is built
+    when any other attribute is accessed, typically on the first DescribeProcess or Execute
+    request. Takes the same arguments as `make_xclim_indicator_process`.
+
+    With a `description`, the process' json precomputed by `build_process_descriptions`,
+    DescribeProcess requests are answered without building the process either.
+    """
+
+    def __init__(
+        self,
+        xci,
+        class_name_suffix: str,
+        base_class,
+        description: Optional[Dict] = None,
+    ):
+        self.xci = xci
+        self.identifier = base_class.identifier_prefix + xci.identifier
+        self.title = unidecode(xci.title)
+        self.abstract = unidecode(xci.abstract)
+        self.version = "0.1"
+        self.keywords: List[str] = []
+        self.metadata: List[Metadata] = []
+        self.description = description
+        self._args = (xci, class_name_suffix, base_class)
+        self._process = None
+        self._lock = threading.Lock()
+
+    @property
+    def translations(self) -> Dict[str, Dict[str, str]]:  # noqa: D102
+        if self.description is not None:
+            return self.description["translations"]
+        return indicator_translations(self.xci.identifier)
+
+    @property
+    def json(self) -> Dict:
+        """Return the json of the process, as used by DescribeProcess."""
+        if self._process is None and self.description is not None:
+            return {**self.description, "uuid": "None", "workdir": None}
+        return self.process.json
+
+    @property
+    def built(self) -> bool:
+        """Whether the process was built."""
+        return self._process is not None
+
+    @property
+    def process(self) -> FinchProcess:
+        """Return the process, building it on first access."""
+        if self._process is None:
+            with self._lock:
+                if self._process is None:
+                    self._process = make_xclim_indicator_process(
+                        *self._args, translations=self.translations
+                    )
+        return self._process
+
+    def __getattr__(self, name):  # noqa: D105
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.process, name)
+
+    def __deepcopy__(self, memo):  # noqa: D105
+        # pywps copies the process of each Execute request
+        return copy.deepcopy(self.process, memo)
+
+    def __repr__(self):  # noqa: D105
+        return f"<LazyProcess {self.identifier}>"
 
 
 def convert_xclim_inputs_to_pywps(
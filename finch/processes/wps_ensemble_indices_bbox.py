@@ -20,6 +20,7 @@ class XclimEnsembleBboxBase(FinchProcess):
     """
 
     xci = None
+    identifier_prefix = "ensemble_bbox_"
 
     def __init__(self):
         """Create a WPS process from an xclim indicator class instance."""
@@ -57,7 +58,7 @@ class XclimEnsembleBboxBase(FinchProcess):
 
         outputs = [wpsio.output_netcdf_zip, wpsio.output_log]
 
-        identifier = f"ensemble_bbox_{self.xci.identifier}"
+        identifier = self.identifier_prefix + self.xci.identifier
         super().__init__(
             self._handler,
             identifier=identifier,
@@ -20,6 +20,7 @@ class XclimEnsembleGridPointBase(FinchProcess):
     """
 
     xci = None
+    identifier_prefix = "ensemble_grid_point_"
 
     def __init__(self):
         """Create a WPS process from an xclim indicator class instance."""
@@ -55,7 +56,7 @@ class XclimEnsembleGridPointBase(FinchProcess):
 
         outputs = [wpsio.output_netcdf_zip, wpsio.output_log]
 
-        identifier = f"ensemble_grid_point_{self.xci.identifier}"
+        identifier = self.identifier_prefix + self.xci.identifier
         super().__init__(
             self._handler,
             identifier=identifier,
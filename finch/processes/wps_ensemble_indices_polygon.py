@@ -19,6 +19,7 @@ class XclimEnsemblePolygonBase(FinchProcess):
     """
 
     xci = None
+    identifier_prefix = "ensemble_polygon_"
 
     def __init__(self):
         """Create a WPS process from an xclim indicator class instance."""
@@ -53,7 +54,7 @@ class XclimEnsemblePolygonBase(FinchProcess):
 
         outputs = [wpsio.output_netcdf_zip, wpsio.output_log]
 
-        identifier = f"ensemble_polygon_{self.xci.identifier}"
+        identifier = self.identifier_prefix + self.xci.identifier
         super().__init__(
             self._handler,
             identifier=identifier,
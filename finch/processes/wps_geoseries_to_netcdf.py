@@ -3,8 +3,6 @@ import logging
 from pathlib import Path
 from urllib.parse import urlparse
 
-import cf_xarray.geometry as cfgeo
-import geopandas as gpd
 import numpy as np
 import xarray as xr
 from pywps import FORMATS, ComplexInput, ComplexOutput, LiteralInput
@@ -111,6 +109,9 @@ class GeoseriesToNetcdfProcess(FinchProcess):
         }
 
     def _handler(self, request, response):
+        import cf_xarray.geometry as cfgeo
+        import geopandas as gpd
+
         write_log(self, "Processing started", process_step="start")
 
         # --- Process inputs ---
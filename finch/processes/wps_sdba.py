@@ -10,10 +10,8 @@ For the moment, both train-adjust operations are bundled into a single process.
 import logging
 from pathlib import Path
 
-import xclim
 from pywps import FORMATS, ComplexInput, ComplexOutput, LiteralInput
 from xclim.core.calendar import convert_calendar
-from xclim.sdba.utils import ADDITIVE, MULTIPLICATIVE
 
 from . import wpsio
 from .utils import (
@@ -29,6 +27,10 @@ from .wps_base import FinchProcess, FinchProgressBar
 
 LOGGER = logging.getLogger("PYWPS")
 
+# Same as xclim.sdba.utils, which is slow to import (numba compilation)
+ADDITIVE = "+"
+MULTIPLICATIVE = "*"
+
 group_args = dict(
     group=LiteralInput(
         "group",
@@ -151,6 +153,8 @@ class EmpiricalQuantileMappingProcess(FinchProcess):
         )
 
     def _handler(self, request, response):
+        from xclim import sdba
+
         def _log(message, percentage):
             write_log(self, message, subtask_percentage=percentage)
 
@@ -180,10 +184,10 @@ class EmpiricalQuantileMappingProcess(FinchProcess):
 
         _log("Successfully read inputs from request.", 1)
 
-        group = xclim.sdba.Grouper(**group)
+        group = sdba.Grouper(**group)
         _log("Grouper object created.", 2)
 
-        bc = xclim.sdba.EmpiricalQuantileMapping.train(
+        bc = sdba.EmpiricalQuantileMapping.train(
             res["ref"], res["hist"], **train, group=group
         )
 
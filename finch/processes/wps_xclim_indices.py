@@ -4,19 +4,19 @@ from collections import deque
 from pathlib import Path
 from typing import List, Optional
 
-import pandas as pd
 import xarray as xr
-from pandas.api.types import is_numeric_dtype
 from pywps.app.exceptions import ProcessError
 from unidecode import unidecode
 
 from . import wpsio
 from .utils import (
     compute_indices,
-    dataset_to_dataframe,
+    dataframes_to_csv,
+    dataframes_to_parquet,
     dataset_to_netcdf,
     drs_filename,
     format_metadata,
+    iter_dataframes,
     log_file_path,
     make_metalink_output,
     single_input_or_none,
@@ -36,6 +36,7 @@ class XclimIndicatorBase(FinchProcess):
     """
 
     xci = None
+    identifier_prefix = ""
 
     def __init__(self):
         """Create a WPS process from an xclim indicator class instance."""
@@ -60,7 +61,7 @@ class XclimIndicatorBase(FinchProcess):
 
         super().__init__(
             self._handler,
-            identifier=self.xci.identifier,
+            identifier=self.identifier_prefix + self.xci.identifier,
             version="0.1",
             title=unidecode(self.xci.title),
             abstract=unidecode(self.xci.abstract),
@@ -73,7 +74,8 @@ class XclimIndicatorBase(FinchProcess):
         self.status_percentage_steps = {"start": 5, "convert_to_csv": 90, "done": 99}
 
     def _handler(self, request, response):
-        convert_to_csv = single_input_or_none(request.inputs, "output_format") == "csv"
+        output_format = single_input_or_none(request.inputs, "output_format")
+        convert_to_csv = output_format in ["csv", "parquet"]
         if not convert_to_csv:
             del self.status_percentage_steps["convert_to_csv"]
 
@@ -134,7 +136,28 @@ class XclimIndicatorBase(FinchProcess):
                 dataset_to_netcdf(out, output_filename)
                 out.close()
 
-        if convert_to_csv:
+        if output_format == "parquet":
+            write_log(
+                self, "Converting netCDFs to parquet", process_step="convert_to_csv"
+            )
+            output_netcdfs = output_files
+            output_files = []
+            for outfile in output_netcdfs:
+                outparquet = outfile.with_suffix(".parquet")
+                ds = xr.open_dataset(outfile, decode_timedelta=False)
+                dataframes_to_parquet(
+                    iter_dataframes(ds),
+                    outparquet,
+                    metadata={"metadata": format_metadata(ds)},
+                )
+                output_files.append(outparquet)
+
+            if len(output_files) == 1:
+                output_final = output_files[0]
+            else:
+                output_final = Path(self.workdir) / f"{self.identifier}_output.zip"
+                zip_files(output_final, output_files)
+        elif convert_to_csv:
             write_log(self, "Converting netCDFs to CSV", process_step="convert_to_csv")
             output_netcdfs = output_files
             output_files = []
@@ -145,14 +168,9 @@ class XclimIndicatorBase(FinchProcess):
                 if prec and prec < 0:
                     ds = ds.round(prec)
                     prec = 0
-                df = dataset_to_dataframe(ds)
-                if prec is not None:
-                    for v in df:
-                        if v not in ds.coords and is_numeric_dtype(df[v]):
-                            df[v] = df[v].map(
-                                lambda x: f"{x:.{prec}f}" if not pd.isna(x) else ""
-                            )
-                df.to_csv(outcsv)
+                dataframes_to_csv(
+                    iter_dataframes(ds), outcsv, csv_precision=prec, exclude=ds.coords
+                )
                 output_files.append(outcsv)
 
                 metadata = format_metadata(ds)
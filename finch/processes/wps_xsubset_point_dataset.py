@@ -74,7 +74,8 @@ class SubsetGridPointDatasetProcess(FinchProcess):
         }
 
     def _handler(self, request: WPSRequest, response: ExecuteResponse):
-        convert_to_csv = request.inputs["output_format"][0].data == "csv"
+        output_format = request.inputs["output_format"][0].data
+        convert_to_csv = output_format in ["csv", "parquet"]
         if not convert_to_csv:
             del self.status_percentage_steps["convert_to_csv"]
 
@@ -123,13 +124,18 @@ class SubsetGridPointDatasetProcess(FinchProcess):
             raise ProcessError(message)
 
         if convert_to_csv:
-            write_log(self, "Converting outputs to csv", process_step="convert_to_csv")
+            write_log(
+                self,
+                f"Converting outputs to {output_format}",
+                process_step="convert_to_csv",
+            )
 
             csv_files, metadata_folder = netcdf_file_list_to_csv(
                 output_files,
                 output_folder=Path(self.workdir),
                 filename_prefix=output_filename,
                 csv_precision=single_input_or_none(request.inputs, "csv_precision"),
+                output_format=output_format,
             )
             output_files = csv_files + [metadata_folder]
 
@@ -5,7 +5,7 @@ from copy import deepcopy
 from itertools import chain
 from typing import Union
 
-from pywps import FORMATS, ComplexInput, ComplexOutput, LiteralInput
+from pywps import FORMATS, ComplexInput, ComplexOutput, Format, LiteralInput
 from pywps.configuration import get_config_value
 from pywps.inout.literaltypes import AnyValue
 from xclim.core.options import (
@@ -285,12 +285,17 @@ data_validation = LiteralInput(
 )
 
 
+PARQUET = Format("application/vnd.apache.parquet", extension=".parquet")
+
 output_format_netcdf_csv = LiteralInput(
     "output_format",
     "Output format choice",
-    abstract="Choose in which format you want to receive the result. CSV actually means a zip file of two csv files.",
+    abstract=(
+        "Choose in which format you want to receive the result. CSV actually means a zip file of two csv files. "
+        "Parquet files are compressed tables, with the metadata embedded in the file."
+    ),
     data_type="string",
-    allowed_values=["netcdf", "csv"],
+    allowed_values=["netcdf", "csv", "parquet"],
     default="netcdf",
     min_occurs=0,
 )
@@ -300,7 +305,7 @@ output_netcdf_zip = ComplexOutput(
     "Result",
     abstract=("The format depends on the 'output_format' input parameter."),
     as_reference=True,
-    supported_formats=[FORMATS.NETCDF, FORMATS.ZIP],
+    supported_formats=[FORMATS.NETCDF, FORMATS.ZIP, PARQUET],
 )
 
 output_netcdf_csv = copy_io(
@@ -1,15 +1,187 @@
 # noqa: D100
+import importlib
+import logging
 import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, Tuple
 
-import sentry_sdk
+from pywps import configuration
+from pywps.app.basic import get_response_type
 from pywps.app.Service import Service
+from pywps.response.capabilities import CapabilitiesResponse
+from pywps.response.describe import DescribeResponse
+from werkzeug.test import Client
 
 from .processes import get_processes
+from .processes.catalog import get_catalog_index
+from .processes.utils import get_datasets_config
+
+LOGGER = logging.getLogger("PYWPS")
+
+# Modules imported by the handlers, loaded by `warm_up`
+HANDLER_MODULES = [
+    "clisops.core.average",
+    "clisops.core.subset",
+    "geopandas",
+    "cf_xarray.geometry",
+    "siphon.catalog",
+    "xclim.sdba",
+]
 
 if os.environ.get("SENTRY_DSN"):
+    import sentry_sdk
+
     sentry_sdk.init(os.environ["SENTRY_DSN"])
 
 
+class ProcessOffering:
+    """Summary of a process listed by GetCapabilities.
+
+    pywps serializes the full processes, with their inputs and outputs, for GetCapabilities.
+    Only the attributes shown in the capabilities document are read here, so that the lazy
+    processes are not built.
+    """
+
+    def __init__(self, process):
+        self.process = process
+
+    @property
+    def json(self):  # noqa: D102
+        process = self.process
+        return {
+            "version": process.version,
+            "identifier": process.identifier,
+            "title": process.title,
+            "abstract": process.abstract,
+            "keywords": process.keywords,
+            "metadata": [m.json for m in process.metadata],
+            "translations": process.translations,
+        }
+
+
+class CachedResponse:
+    """Mixin for responses whose document only depends on the processes and the configuration.
+
+    The document is rendered once for each version, language and mimetype, and then served
+    from the service's cache.
+    """
+
+    def __init__(self, *args, service, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.service = service
+
+    @property
+    def cacheable(self) -> bool:  # noqa: D102
+        return True
+
+    def _construct_doc(self):
+        if not self.cacheable:
+            return super()._construct_doc()
+        json_response, mimetype = get_response_type(
+            self.wps_request.http_request.accept_mimetypes,
+            self.wps_request.default_mimetype,
+        )
+        key = (
+            type(self).__name__,
+            self.version,
+            self.wps_request.language,
+            json_response,
+            mimetype,
+        )
+        return self.service.cached_doc(key, super()._construct_doc)
+
+
+class CachedCapabilitiesResponse(CachedResponse, CapabilitiesResponse):
+    """GetCapabilities response served from the service's cache."""
+
+
+class CachedDescribeResponse(CachedResponse, DescribeResponse):
+    """DescribeProcess response served from the service's cache, for identifier=all only."""
+
+    @property
+    def cacheable(self) -> bool:  # noqa: D102
+        return [i.lower() for i in self.identifiers or []] == ["all"]
+
+
+class FinchService(Service):
+    """WPS service caching its GetCapabilities and DescribeProcess documents.
+
+    The processes are listed in GetCapabilities without being built. The cached documents
+    are dropped when the processes or the configuration change.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._docs: Dict[Hashable, Tuple[str, str]] = {}
+        self._docs_state = None
+        self._docs_lock = threading.Lock()
+
+    def _state(self) -> Hashable:
+        """Return what the cached documents depend on: the processes and the configuration."""
+        config = configuration.CONFIG
+        return (
+            tuple((identifier, id(p)) for identifier, p in self.processes.items()),
+            id(config),
+            tuple(
+                (section, tuple(config.items(section, raw=True)))
+                for section in (config.sections() if config is not None else ())
+            ),
+        )
+
+    def cached_doc(
+        self, key: Hashable, render: Callable[[], Tuple[str, str]]
+    ) -> Tuple[str, str]:
+        """Return the document and mimetype for `key`, calling `render` if it is not cached."""
+        state = self._state()
+        with self._docs_lock:
+            if state != self._docs_state:
+                self._docs.clear()
+                self._docs_state = state
+            doc = self._docs.get(key)
+        if doc is None:
+            doc = render()
+            with self._docs_lock:
+                if state == self._docs_state:
+                    self._docs[key] = doc
+        return doc
+
+    def prerender(self):
+        """Render the cached documents for each configured language, as listed in `prerender_responses`."""
+        requests = {
+            "capabilities": "request=GetCapabilities",
+            "describe": "request=DescribeProcess&version=1.0.0&identifier=all",
+        }
+        names = configuration.get_config_value("finch", "prerender_responses")
+        languages = configuration.get_config_value("server", "language").split(",")
+        client = Client(self)
+        for name in filter(None, (n.strip() for n in names.split(","))):
+            for language in languages:
+                client.get(f"?service=WPS&{requests[name]}&language={language}")
+
+    def get_capabilities(self, wps_request, uuid):  # noqa: D102
+        processes = {
+            identifier: ProcessOffering(process)
+            for identifier, process in self.processes.items()
+        }
+        return CachedCapabilitiesResponse(
+            wps_request,
+            uuid,
+            version=wps_request.version,
+            processes=processes,
+            service=self,
+        )
+
+    def describe(self, wps_request, uuid, identifiers):  # noqa: D102
+        return CachedDescribeResponse(
+            wps_request,
+            uuid,
+            processes=self.processes,
+            identifiers=identifiers,
+            service=self,
+        )
+
+
 def create_app(cfgfiles=None):  # noqa: D103
     config_files = [os.path.join(os.path.dirname(__file__), "default.cfg")]
     if isinstance(cfgfiles, str):
@@ -18,13 +190,40 @@ def create_app(cfgfiles=None):  # noqa: D103
         config_files += cfgfiles
     if "PYWPS_CFG" in os.environ:
         config_files.append(os.environ["PYWPS_CFG"])
-    service = Service(cfgfiles=config_files)
+    service = FinchService(cfgfiles=config_files)
 
     # delay the call of get_processes() so that the configuration is loaded
     # when instantiating the service
     service.processes = {p.identifier: p for p in get_processes()}
+    service.prerender()
 
     return service
 
 
+def warm_up(service: FinchService):
+    """Do the work shared by all the requests once, typically before forking workers.
+
+    Imports the modules used by the handlers, builds the catalog indexes that are missing
+    or stale and renders the cached documents. Forked workers then share this memory
+    copy-on-write instead of each doing the work again.
+    """
+    start = time.perf_counter()
+    for name in HANDLER_MODULES:
+        importlib.import_module(name)
+
+    for name, dsconf in get_datasets_config().items():
+        index = get_catalog_index(dsconf)
+        if index is None:
+            continue
+        updated = index.updated
+        if updated is None or time.time() - updated > index.ttl:
+            try:
+                index.refresh()
+            except Exception:  # noqa
+                LOGGER.exception(f"Indexing the files of dataset {name} failed.")
+
+    service.prerender()
+    LOGGER.info(f"Warmed up in {time.perf_counter() - start:.1f} s.")
+
+
 application = create_app()
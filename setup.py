@@ -52,7 +52,7 @@ setup(
     keywords="wps pywps birdhouse finch",
     packages=find_namespace_packages(".", include=["finch*"]),
     include_package_data=True,
-    package_data={"finch": ["*.yml"]},
+    package_data={"finch": ["*.yml", "process_descriptions.json"]},
     install_requires=reqs,
     test_suite="tests",
     extras_require={
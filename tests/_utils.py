@@ -1,11 +1,14 @@
 # noqa: D100
 from pathlib import Path
 
+import xarray as xr
 from owslib.wps import WPSExecution
 from pywps import get_ElementMakerForVersion
 from pywps.app.exceptions import ProcessError
 from pywps.tests import assert_response_success
 
+from finch.processes import ensemble_utils
+
 VERSION = "1.0.0"
 WPS, OWS = get_ElementMakerForVersion(VERSION)
 
@@ -61,3 +64,18 @@ def get_outputs(execution, output_names):  # noqa: D103
             except AttributeError:
                 outputs.append(output)
     return outputs
+
+
+def set_ensemble_evaluation(monkeypatch, mode: str):
+    """Make the ensemble processes evaluate their indicator in `mode` ("stacked" or "members")."""
+    monkeypatch.setattr(ensemble_utils, "ensemble_evaluation", lambda: mode)
+
+
+def load_output(path) -> xr.Dataset:
+    """Load an output dataset, without the history attributes, which are timestamped."""
+    with xr.open_dataset(path) as ds:
+        ds = ds.load()
+    for var in ds.variables.values():
+        var.attrs.pop("history", None)
+    ds.attrs.pop("history", None)
+    return ds
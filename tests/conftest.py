@@ -1,5 +1,9 @@
 import collections
+import functools
+import os
 import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from shutil import rmtree
 from typing import Dict, Optional, Tuple, Union
@@ -16,19 +20,31 @@ from xclim.testing.helpers import (
     test_timeseries as timeseries,  # pr_hr_series, pr_series, q_series, tas_series
 )
 
+import finch
 import finch.processes
 import finch.wsgi
 from _common import CFG_FILE, client_for
 
 TEMP_DIR = Path(__file__).parent / "tmp"
+DATA_DIR = Path(__file__).parent / "data"
+THREDDS_DIR = DATA_DIR / "thredds"
+# The caches configured in test.cfg, shared by the processes started by the tests
+CACHE_DIR = os.environ["FINCH_TEST_CACHE_DIR"] = tempfile.mkdtemp(
+    prefix="finch_test_cache_"
+)
 
 
 @pytest.fixture(scope="session", autouse=True)
 def setup_temp_data(request):
     TEMP_DIR.mkdir(exist_ok=True)
+    # Tests that don't create the app still use its configuration, and the test caches
+    configuration.load_configuration(
+        [str(Path(finch.__file__).parent / "default.cfg"), CFG_FILE]
+    )
 
     def _cleanup_temp():
         rmtree(TEMP_DIR, ignore_errors=True)
+        rmtree(CACHE_DIR, ignore_errors=True)
 
     request.addfinalizer(_cleanup_temp)
 
@@ -247,3 +263,65 @@ def hourly_dataset():  # noqa: F811
     a = np.arange(10 * 24.0)
     a[0] = np.nan
     return _write_dataset("pr_hr", timeseries(values=a, variable="pr", freq="H"))
+
+
+class _StaticThreddsHandler(SimpleHTTPRequestHandler):
+    """Serve static THREDDS catalogs, failing the first request to each path if `flaky`.
+
+    Responses for paths under the OPeNDAP service include the DAP Content-Description header.
+    The files of the test data directory are served under the HTTP file service.
+    The status codes sent for each path are recorded in `statuses`.
+    """
+
+    flaky = False
+    requests = collections.Counter()
+    statuses = collections.defaultdict(list)
+
+    def translate_path(self, path):
+        if path.startswith("/thredds/fileServer/"):
+            return str(DATA_DIR / path.removeprefix("/thredds/fileServer/"))
+        return super().translate_path(path)
+
+    def send_head(self):
+        self.requests[self.path] += 1
+        if self.flaky and self.requests[self.path] == 1:
+            self.send_error(503)
+            return None
+        return super().send_head()
+
+    def send_response(self, code, message=None):
+        self.statuses[self.path].append(code)
+        super().send_response(code, message)
+
+    def end_headers(self):
+        if self.path.startswith("/thredds/dodsC/"):
+            self.send_header("Content-Description", "dods-error")
+        super().end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def thredds_server():
+    """Start a local HTTP server standing in for a THREDDS server, built from static catalog files.
+
+    Yields the handler class, whose `url` attribute is the root catalog url.
+    """
+    handler = type(
+        "Handler",
+        (_StaticThreddsHandler,),
+        {
+            "requests": collections.Counter(),
+            "statuses": collections.defaultdict(list),
+        },
+    )
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(handler, directory=str(THREDDS_DIR))
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    handler.url = f"http://127.0.0.1:{server.server_port}/catalog.xml"
+    yield handler
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,168 @@
+"""Benchmarks of the processing backends and of the startup, marked as slow tests.
+
+Run them with ``pytest -m slow -s tests/test_benchmarks.py`` to see the timings.
+The import time of `finch.processes` is checked by a regular test.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import xarray as xr
+from pywps import FORMATS, ComplexInput
+
+from _common import CFG_FILE
+from finch.processes import executor, subset
+from finch.processes.subset import finch_subset_bbox
+
+data_dir = Path(__file__).parent / "data"
+
+# Run in a new interpreter, so that the modules are not already imported
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import finch.processes
+imported = time.perf_counter()
+from finch.wsgi import create_app
+app = create_app(cfgfiles=sys.argv[1])
+booted = time.perf_counter()
+from werkzeug.test import Client
+response = Client(app).get("?service=WPS&request=GetCapabilities&version=1.0.0")
+answered = time.perf_counter()
+lazy = [p for p in app.processes.values() if hasattr(p, "built")]
+print(json.dumps({
+    "import": imported - start,
+    "boot": booted - imported,
+    "capabilities": answered - booted,
+    "status": response.status_code,
+    "lazy": len(lazy),
+    "built": [p.identifier for p in lazy if p.built],
+}))
+"""
+
+# Heavy modules only needed by some handlers, not to be imported with finch.processes
+LAZY_MODULES = ["clisops", "geopandas", "siphon", "xclim.sdba", "sentry_sdk"]
+# Upper bound of the import time of finch.processes, in seconds
+IMPORT_TIME_LIMIT = float(os.environ.get("FINCH_IMPORT_TIME_LIMIT", 15))
+
+
+def _import_times(module: str):
+    """Return the cumulative import time of each module imported by `module`, in seconds."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    for line in out.stderr.splitlines():
+        if line.startswith("import time:"):
+            _, cumulative, name = line[len("import time:") :].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_import_time():
+    times = _import_times("finch.processes")
+    print(f"\nimport finch.processes: {times['finch.processes']:.2f} s")
+
+    assert [m for m in LAZY_MODULES if m in times] == []
+    assert times["finch.processes"] < IMPORT_TIME_LIMIT
+
+
+def _fake_process(workdir):
+    return SimpleNamespace(
+        workdir=str(workdir),
+        status_percentage_steps={},
+        response=SimpleNamespace(
+            status_percentage=0, update_status=lambda *args, **kwargs: None
+        ),
+    )
+
+
+@pytest.fixture
+def backend_config(monkeypatch):
+    config = {"subset_threads": "4", "subset_processes": "4"}
+
+    def _get_config_value(section, key):
+        return config.get(key, "")
+
+    monkeypatch.setattr(subset, "get_config_value", _get_config_value)
+    monkeypatch.setattr(executor, "get_config_value", _get_config_value)
+    executor.shutdown()
+    yield config
+    executor.shutdown()
+
+
+@pytest.mark.slow
+def test_benchmark_subset_backends(tmp_path, backend_config):
+    files = sorted((data_dir / "humidex_subset").rglob("*.nc"))
+    request_inputs = {
+        "lon0": [SimpleNamespace(data=-73.5)],
+        "lon1": [SimpleNamespace(data=-73.0)],
+        "lat0": [SimpleNamespace(data=45.3)],
+        "lat1": [SimpleNamespace(data=45.8)],
+    }
+
+    results = {}
+    for backend in ["thread", "process"]:
+        backend_config["subset_backend"] = backend
+        workdir = tmp_path / backend
+        workdir.mkdir()
+
+        netcdf_inputs = []
+        for path in files:
+            netcdf_input = ComplexInput(
+                "resource", "NetCDF", supported_formats=[FORMATS.NETCDF]
+            )
+            netcdf_input.file = str(path)
+            netcdf_inputs.append(netcdf_input)
+
+        if backend == "process":
+            # Start the processes of the pool before timing
+            list(executor.get_executor("process").map(time.sleep, [0.1] * 4))
+
+        start = time.perf_counter()
+        outputs = finch_subset_bbox(
+            _fake_process(workdir), netcdf_inputs, request_inputs
+        )
+        elapsed = time.perf_counter() - start
+        print(
+            f"\n{backend}: {len(files)} files in {elapsed:.2f} s "
+            f"({len(files) / elapsed:.1f} files/s)"
+        )
+        results[backend] = {Path(p).name: p for p in outputs}
+
+    assert len(results["thread"]) == len(files)
+    assert results["thread"].keys() == results["process"].keys()
+    for name, path in results["thread"].items():
+        with xr.open_dataset(path) as expected, xr.open_dataset(
+            results["process"][name]
+        ) as ds:
+            xr.testing.assert_identical(ds, expected)
+
+
+@pytest.mark.slow
+def test_benchmark_startup():
+    out = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, CFG_FILE],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    timings = json.loads(out.stdout.splitlines()[-1])
+    print(
+        f"\nimport finch.processes: {timings['import']:.2f} s, "
+        f"create_app: {timings['boot']:.2f} s, "
+        f"GetCapabilities: {timings['capabilities']:.2f} s"
+    )
+    assert timings["status"] == 200
+    # Neither booting nor GetCapabilities build the indicator processes
+    assert timings["lazy"] > 0
+    assert timings["built"] == []
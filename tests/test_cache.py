@@ -0,0 +1,228 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+import xarray as xr
+from pywps import FORMATS, ComplexInput
+from pywps.exceptions import FileSizeExceeded
+
+from finch.processes import cache
+from finch.processes.cache import DownloadCache, MetadataCache, PercentileCache
+from finch.processes.utils import try_opendap
+
+data_dir = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def metadata_cache(tmp_path, monkeypatch):
+    metadata_cache = MetadataCache(tmp_path / "cache", ttl=3600)
+    monkeypatch.setattr(cache, "get_metadata_cache", lambda: metadata_cache)
+    return metadata_cache
+
+
+@pytest.fixture
+def download_cache(tmp_path, monkeypatch):
+    download_cache = DownloadCache(tmp_path / "downloads", max_size=10**9)
+    monkeypatch.setattr(cache, "get_download_cache", lambda: download_cache)
+    return download_cache
+
+
+def _netcdf_input(path):
+    netcdf_input = ComplexInput(
+        "resource", "NetCDF", supported_formats=[FORMATS.NETCDF]
+    )
+    netcdf_input.file = str(path)
+    return netcdf_input
+
+
+def _file_url(server, filename):
+    return server.url.replace("catalog.xml", f"thredds/fileServer/{filename}")
+
+
+@pytest.mark.parametrize("decode_times", [True, False])
+@pytest.mark.parametrize(
+    "filename",
+    [
+        "cordex_subset.nc",
+        "bccaqv2_single_cell/tasmin_day_BCCAQv2+ANUSPLIN300_ACCESS1-0_historical+rcp45_r1i1p1_19500101-21001231_sub.nc",
+    ],
+)
+def test_try_opendap_metadata_cache(metadata_cache, filename, decode_times):
+    netcdf_input = _netcdf_input(data_dir / filename)
+    expected = xr.open_dataset(data_dir / filename, decode_times=decode_times)
+
+    first = try_opendap(netcdf_input, decode_times=decode_times)
+    assert metadata_cache.get(netcdf_input.file) is not None
+
+    second = try_opendap(netcdf_input, decode_times=decode_times)
+    xr.testing.assert_identical(first.load(), expected)
+    xr.testing.assert_identical(second.load(), expected)
+    assert list(second.variables) == list(expected.variables)
+
+
+def test_metadata_cache_modified_file(tmp_path, metadata_cache):
+    path = tmp_path / "cordex.nc"
+    shutil.copy(data_dir / "cordex_subset.nc", path)
+    ds = xr.open_dataset(path)
+
+    # Cache different coordinates, to see when they are used
+    metadata_cache.put(str(path), ds.assign_coords(rlat=ds.rlat + 1))
+    assert metadata_cache.get(str(path)).time_encoding == {
+        "units": "days since 1949-12-01",
+        "calendar": "proleptic_gregorian",
+    }
+    opened = try_opendap(_netcdf_input(path))
+    assert (opened.rlat == ds.rlat + 1).all()
+
+    stat = path.stat()
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    assert metadata_cache.get(str(path)) is None
+
+    opened = try_opendap(_netcdf_input(path))
+    assert (opened.rlat == ds.rlat).all()
+    assert metadata_cache.get(str(path)) is not None
+
+
+def test_metadata_cache_remote_ttl(tmp_path, monkeypatch):
+    url = "https://example.com/thredds/dodsC/tasmin.nc"
+    ds = xr.open_dataset(data_dir / "cordex_subset.nc")
+    checks = []
+
+    def _modification_time(source):
+        checks.append(source)
+        return 1000.0 if len(checks) < 3 else 2000.0
+
+    monkeypatch.setattr(cache, "_modification_time", _modification_time)
+    metadata_cache = MetadataCache(tmp_path, ttl=3600)
+
+    metadata_cache.put(url, ds)
+    assert metadata_cache.get(url) is not None
+    assert len(checks) == 1
+
+    # Once the ttl is expired, the modification time is checked again
+    metadata_cache.ttl = 0
+    assert metadata_cache.get(url) is not None
+    assert metadata_cache.get(url) is None
+    assert len(checks) == 3
+
+
+def test_download_cache_fetch(thredds_server, download_cache):
+    url = _file_url(thredds_server, "cordex_subset.nc")
+
+    first = download_cache.fetch(url)
+    second = download_cache.fetch(url)
+
+    assert first == second
+    assert first.read_bytes() == (data_dir / "cordex_subset.nc").read_bytes()
+    # The second request is validated with If-Modified-Since
+    assert thredds_server.statuses["/thredds/fileServer/cordex_subset.nc"] == [
+        200,
+        304,
+    ]
+
+
+def test_download_cache_concurrent(thredds_server, download_cache):
+    url = _file_url(thredds_server, "cordex_subset.nc")
+
+    with ThreadPoolExecutor(4) as pool:
+        paths = set(pool.map(download_cache.fetch, [url] * 8))
+
+    assert len(paths) == 1
+    assert (
+        thredds_server.statuses["/thredds/fileServer/cordex_subset.nc"].count(200) == 1
+    )
+
+
+def test_download_cache_evict(thredds_server, tmp_path):
+    size = (data_dir / "cordex_subset.nc").stat().st_size
+    download_cache = DownloadCache(tmp_path, max_size=int(size * 1.5))
+
+    first = download_cache.fetch(_file_url(thredds_server, "cordex_subset.nc"))
+    second = download_cache.fetch(_file_url(thredds_server, "geomet.geojson"))
+    assert not first.exists()
+    assert second.exists()
+
+    with pytest.raises(FileSizeExceeded):
+        download_cache.fetch(
+            _file_url(thredds_server, "cordex_subset.nc"), max_bytes=size // 2
+        )
+    assert [p.name for p in (tmp_path / "objects").iterdir()] == [second.name]
+
+
+def test_try_opendap_download_cache(thredds_server, metadata_cache, download_cache):
+    netcdf_input = ComplexInput(
+        "resource", "NetCDF", supported_formats=[FORMATS.NETCDF]
+    )
+    netcdf_input.url = _file_url(thredds_server, "cordex_subset.nc")
+    expected = xr.open_dataset(data_dir / "cordex_subset.nc")
+
+    puts = []
+    put = metadata_cache.put
+    metadata_cache.put = lambda source, ds: puts.append(source) or put(source, ds)
+
+    for _ in range(2):
+        ds = try_opendap(netcdf_input)
+        xr.testing.assert_identical(ds.load(), expected)
+
+    cached = next((download_cache.root / "objects").iterdir())
+    # Revalidating the download doesn't invalidate its metadata
+    assert puts == [str(cached)]
+    assert metadata_cache.get(str(cached)) is not None
+
+
+def test_download_cache_fetch_linked(thredds_server, download_cache, tmp_path):
+    url = _file_url(thredds_server, "cordex_subset.nc")
+    expected = (data_dir / "cordex_subset.nc").read_bytes()
+
+    for name in ["first", "second"]:
+        directory = tmp_path / name
+        directory.mkdir()
+        cached, linked = download_cache.fetch_linked(url, directory)
+        assert linked == directory / cached.name
+        assert linked.stat().st_ino == cached.stat().st_ino
+
+    # The links stay available when the cached file is evicted
+    mtime = cached.stat().st_mtime
+    download_cache.max_size = 0
+    download_cache.evict()
+    assert not cached.exists()
+    assert linked.read_bytes() == expected
+    assert linked.stat().st_mtime == mtime
+
+    # An evicted file is downloaded again
+    cached, _ = download_cache.fetch_linked(url, tmp_path / "first")
+    assert cached.read_bytes() == expected
+
+
+def test_percentile_cache(tmp_path):
+    tasmin = xr.open_dataset(
+        data_dir / "bccaqv2_subset_sample" / "tasmin_inmcm4_rcp26_subset.nc"
+    ).tasmin
+    percentile_cache = PercentileCache(tmp_path, max_size=10**9)
+
+    key = percentile_cache.key(tasmin, 10, 5)
+    assert key == percentile_cache.key(tasmin.copy(deep=True), 10, 5)
+    assert key != percentile_cache.key(tasmin, 90, 5)
+    assert key != percentile_cache.key(tasmin, 10, 7)
+    assert key != percentile_cache.key(tasmin.isel(lat=slice(1, None)), 10, 5)
+    assert key != percentile_cache.key(tasmin.isel(time=slice(1, None)), 10, 5)
+    # The values are hashed, whatever the file they come from
+    other = tasmin.copy(deep=True)
+    other.encoding["source"] = "tasmin_inmcm4_rcp45_subset.nc"
+    assert key == percentile_cache.key(other, 10, 5)
+    other.encoding["source"] = tasmin.encoding["source"]
+    other.values[:] = 0
+    assert key != percentile_cache.key(other, 10, 5)
+    assert percentile_cache.get(key) is None
+
+    per = tasmin.isel(time=slice(0, 10)).rename(time="dayofyear")
+    percentile_cache.put(key, per)
+    xr.testing.assert_identical(percentile_cache.get(key), per)
+
+    # The least recently used entry is removed first
+    percentile_cache.max_size = int(per.nbytes * 1.5)
+    percentile_cache.put("other", per)
+    assert percentile_cache.get(key) is None
+    assert percentile_cache.get("other") is not None
@@ -0,0 +1,156 @@
+import time
+from pathlib import Path
+
+import pytest
+import yaml
+from siphon.catalog import TDSCatalog
+
+from finch.processes import catalog
+from finch.processes.catalog import (
+    CatalogIndex,
+    iter_dataset,
+    iter_remote,
+    iter_remote_concurrent,
+)
+from finch.processes.ensemble_utils import FileMatcher, file_is_required
+from finch.processes.utils import DatasetConfiguration
+
+test_data_config = Path(__file__).parent / "test_data.yml"
+
+
+@pytest.fixture
+def single_cell_conf():
+    conf = yaml.safe_load(test_data_config.read_text())
+    return DatasetConfiguration(**conf["test_single_cell"])
+
+
+def test_model_list_names_case_insensitive():
+    conf = yaml.safe_load(test_data_config.read_text())["test_single_cell"]
+    conf["model_lists"] = {"PCIC12": conf["model_lists"]["pcic12"]}
+    dsconf = DatasetConfiguration(**conf)
+
+    assert list(dsconf.model_lists) == ["pcic12"]
+    assert list(dsconf.model_sets) == ["pcic12"]
+    name = "tasmin_day_BCCAQv2+ANUSPLIN300_CCSM4_historical+rcp45_r2i1p1_19500101-21001231.nc"
+    for models in (["pcic12"], ["PCIC12"], ["Pcic12"]):
+        assert FileMatcher.for_dataset(dsconf, models=models)(name)
+
+
+@pytest.mark.parametrize(
+    "variables,scenario,models",
+    [
+        (None, None, None),
+        (["tasmin"], "rcp45", ["all"]),
+        (["tasmin", "tasmax"], "rcp26", ["24models"]),
+        (["pr"], "rcp85", ["pcic12"]),
+        (None, "rcp45", ["CCSM4", "canesm2"]),
+        (["tasmax"], None, ["MIROC5"]),
+    ],
+)
+def test_catalog_index_select(tmp_path, single_cell_conf, variables, scenario, models):
+    index = CatalogIndex(single_cell_conf, tmp_path / "index.sqlite", ttl=3600)
+
+    expected = [
+        (name, str(url))
+        for name, url in iter_dataset(single_cell_conf)
+        if file_is_required(
+            name,
+            single_cell_conf.pattern,
+            single_cell_conf.model_lists,
+            variables=variables,
+            scenario=scenario,
+            models=models,
+        )
+    ]
+    selected = index.select(variables=variables, scenario=scenario, models=models)
+
+    assert len(selected) > 0
+    assert selected == expected
+
+
+@pytest.mark.parametrize(
+    "variables,scenario,models",
+    [
+        (None, None, None),
+        (["tasmin", "tasmax"], "rcp26", ["24models"]),
+        (["pr"], "rcp85", ["PCIC12"]),
+        (None, "rcp45", ["CCSM4", "canesm2"]),
+    ],
+)
+def test_file_matcher(
+    tmp_path, monkeypatch, single_cell_conf, variables, scenario, models
+):
+    allowed = single_cell_conf.allowed_values
+    names = [
+        f"{variable}_day_BCCAQv2+ANUSPLIN300_{model}_historical+{scen}_r{r}i1p1_19500101-21001231.nc"
+        for variable in allowed["variable"]
+        for model in allowed["model"]
+        for scen in allowed["scenario"]
+        for r in range(1, 100)
+    ] + ["not_a_dataset.nc"]
+    monkeypatch.setattr(
+        catalog, "iter_dataset", lambda dsconf: ((name, name) for name in names)
+    )
+    index = CatalogIndex(single_cell_conf, tmp_path / "index.sqlite", ttl=3600)
+    expected = [name for name, _ in index.select(variables, scenario, models)]
+
+    is_required = FileMatcher.for_dataset(
+        single_cell_conf, variables=variables, scenario=scenario, models=models
+    )
+    selected = [name for name in names if is_required(name)]
+
+    assert len(selected) > 0
+    assert selected == expected
+    # Same result as filtering each file on its own
+    sample = names[::50]
+    assert [name for name in sample if is_required(name)] == [
+        name
+        for name in sample
+        if file_is_required(
+            name,
+            single_cell_conf.pattern,
+            single_cell_conf.model_lists,
+            variables=variables,
+            scenario=scenario,
+            models=models,
+        )
+    ]
+
+
+def test_catalog_index_ttl(tmp_path, single_cell_conf):
+    path = tmp_path / "index.sqlite"
+    index = CatalogIndex(single_cell_conf, path, ttl=3600)
+    assert index.updated is None
+
+    index.ensure_fresh()
+    first = index.updated
+    assert first is not None
+
+    # The index is shared through the file
+    assert CatalogIndex(single_cell_conf, path, ttl=3600).updated == first
+
+    # A stale index is refreshed in the background
+    index.ttl = 0
+    index.ensure_fresh()
+    index._thread.join()
+    assert index.updated > first
+    assert time.time() >= index.updated
+
+
+@pytest.mark.parametrize("depth", [-1, 0, 1])
+def test_iter_remote_concurrent(thredds_server, depth):
+    expected = list(iter_remote(TDSCatalog(thredds_server.url), depth=depth))
+    crawled = list(iter_remote_concurrent(thredds_server.url, depth=depth, workers=3))
+
+    assert crawled == expected
+    assert len(crawled) == {-1: 6, 0: 1, 1: 5}[depth]
+    assert all("/thredds/dodsC/" in url for _, url in crawled)
+
+
+def test_iter_remote_concurrent_retries(thredds_server):
+    thredds_server.flaky = True
+
+    crawled = list(iter_remote_concurrent(thredds_server.url, depth=-1))
+
+    assert len(crawled) == 6
+    assert all(count == 2 for count in thredds_server.requests.values())
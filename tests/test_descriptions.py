@@ -0,0 +1,67 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+from pywps.configuration import get_config_value
+
+from _common import CFG_FILE, client_for
+from finch.cli import cli
+from finch.processes import descriptions
+from finch.processes.descriptions import load_process_descriptions
+from finch.wsgi import create_app
+
+
+@pytest.fixture(scope="module")
+def descriptions_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp("descriptions") / "process_descriptions.json"
+    result = CliRunner().invoke(
+        cli, ["build-descriptions", "-c", CFG_FILE, "-o", str(path)]
+    )
+    assert result.exit_code == 0, result.output
+    return path
+
+
+@pytest.fixture
+def descriptions_config(descriptions_file, monkeypatch):
+    def mock_config_get(section, key):
+        if key == "process_descriptions":
+            return str(descriptions_file)
+        return get_config_value(section, key)
+
+    monkeypatch.setattr(descriptions, "get_config_value", mock_config_get)
+    return descriptions_file
+
+
+def _describe(client, identifier):
+    resp = client.get(
+        service="wps", request="describeprocess", version="1.0.0", identifier=identifier
+    )
+    return resp.data
+
+
+def test_describe_from_descriptions(descriptions_config):
+    service = create_app(cfgfiles=CFG_FILE)
+    client = client_for(service)
+    identifier = "ensemble_bbox_tx_days_above"
+    process = service.processes[identifier]
+    assert process.description is not None
+
+    described = _describe(client, identifier)
+    assert not process.built
+    assert process.translations["fr"]["title"]
+
+    # Describe the same process, built
+    process.process
+    process.description = None
+    assert described == _describe(client, identifier)
+
+
+def test_load_outdated_descriptions(descriptions_config, tmp_path, monkeypatch):
+    assert "tg_mean" in load_process_descriptions()
+
+    content = json.loads(descriptions_config.read_text())
+    content["xclim"] = "0.1"
+    path = tmp_path / "outdated.json"
+    path.write_text(json.dumps(content))
+    monkeypatch.setattr(descriptions, "descriptions_path", lambda: path)
+    assert load_process_descriptions() == {}
@@ -0,0 +1,155 @@
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import xarray as xr
+from pywps import FORMATS, ComplexInput
+
+from finch.processes import executor, subset
+from finch.processes.utils import process_threaded, register_opendap_url
+
+data_dir = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def config(monkeypatch):
+    values = {}
+    monkeypatch.setattr(
+        executor, "get_config_value", lambda section, key: values.get(key, "")
+    )
+    executor._reset()
+    yield values
+    executor._reset()
+
+
+def test_get_executor(config, monkeypatch):
+    monkeypatch.setattr(executor, "cpu_count", lambda: 2)
+    config["io_wait_ratio"] = "3"
+
+    pool = executor.get_executor("thread")
+    assert pool is executor.get_executor("thread")
+    assert pool._max_workers == 8
+    assert executor.process_pool_size() == 2
+
+    config["subset_processes"] = "1"
+    assert executor.get_executor("process") is None
+
+
+def test_process_threaded_host_limit(config):
+    config["subset_threads"] = "8"
+    config["host_concurrency"] = "2"
+    running = {"a": 0, "b": 0}
+    peak = {"a": 0, "b": 0}
+    lock = threading.Lock()
+
+    def _work(item):
+        host = item.url.split("/")[2]
+        with lock:
+            running[host] += 1
+            peak[host] = max(peak[host], running[host])
+        time.sleep(0.05)
+        with lock:
+            running[host] -= 1
+        return item.n
+
+    inputs = [
+        SimpleNamespace(url=f"https://{'ab'[n % 2]}/file_{n}.nc", n=n)
+        for n in range(12)
+    ]
+    assert sorted(process_threaded(_work, inputs)) == list(range(12))
+    assert peak == {"a": 2, "b": 2}
+
+
+def test_process_threaded_error(config):
+    config["subset_threads"] = "4"
+
+    def _work(n):
+        if n == 3:
+            raise ValueError("bad input")
+        return n
+
+    with pytest.raises(ValueError, match="bad input"):
+        process_threaded(_work, range(6))
+
+    config["subset_threads"] = "1"
+    executor._reset()
+    assert process_threaded(_work, [0, 1, 2]) == [0, 1, 2]
+
+
+def test_map_concurrently(config):
+    config["subset_threads"] = "2"
+
+    def _scenario(n):
+        # Nested tasks run on the worker's pool, which has fewer threads than there are items
+        assert threading.current_thread().name.startswith("finch-scenario")
+        return sum(process_threaded(lambda i: i * n, range(4)))
+
+    start = time.perf_counter()
+    assert executor.map_concurrently(
+        lambda n: time.sleep(0.2) or _scenario(n), [1, 2, 3]
+    ) == [6, 12, 18]
+    assert time.perf_counter() - start < 0.5
+
+    # The pool is disabled
+    config["subset_threads"] = "1"
+    executor._reset()
+    threads = set()
+    executor.map_concurrently(lambda n: threads.add(threading.get_ident()), [1, 2, 3])
+    assert threads == {threading.get_ident()}
+
+
+def test_subset_process_backend(config, monkeypatch, tmp_path):
+    config.update(subset_threads="4", subset_processes="2")
+    monkeypatch.setattr(subset, "get_config_value", executor.get_config_value)
+    request_inputs = {
+        "lon0": [SimpleNamespace(data=-73.5)],
+        "lon1": [SimpleNamespace(data=-73.0)],
+        "lat0": [SimpleNamespace(data=45.3)],
+        "lat1": [SimpleNamespace(data=45.8)],
+    }
+    netcdf_inputs = []
+    for path in sorted((data_dir / "humidex_subset").rglob("*.nc"))[:4]:
+        netcdf_input = ComplexInput(
+            "resource", "NetCDF", supported_formats=[FORMATS.NETCDF]
+        )
+        netcdf_input.file = str(path)
+        netcdf_inputs.append(netcdf_input)
+
+    outputs = {}
+    try:
+        for backend in ["thread", "process"]:
+            config["subset_backend"] = backend
+            workdir = tmp_path / backend
+            workdir.mkdir()
+            process = SimpleNamespace(
+                workdir=str(workdir),
+                status_percentage_steps={},
+                response=SimpleNamespace(
+                    status_percentage=0, update_status=lambda *args, **kwargs: None
+                ),
+            )
+            paths = subset.finch_subset_bbox(process, netcdf_inputs, request_inputs)
+            outputs[backend] = {Path(p).name: p for p in paths}
+        assert executor._executors["process"] is not None
+    finally:
+        executor.shutdown()
+
+    assert len(outputs["process"]) == len(netcdf_inputs)
+    assert outputs["process"].keys() == outputs["thread"].keys()
+    for name, path in outputs["process"].items():
+        with xr.open_dataset(path) as ds, xr.open_dataset(
+            outputs["thread"][name]
+        ) as expected:
+            xr.testing.assert_identical(ds, expected)
+
+
+def test_subset_input_lock(tmp_path):
+    local = SimpleNamespace(url=(tmp_path / "tas.nc").as_uri())
+    assert subset._input_lock(local) is subset._netcdf_lock
+
+    url = "https://example.com/thredds/dodsC/tas.nc"
+    register_opendap_url(url)
+    # OPeNDAP urls are read through the network, concurrently
+    assert subset._input_lock(SimpleNamespace(url=url)) is not subset._netcdf_lock
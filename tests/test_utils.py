@@ -1,20 +1,35 @@
 import shutil
+import threading
 import zipfile
 from pathlib import Path
+from types import SimpleNamespace
 from unittest import mock
 
+import dask.array as da
 import numpy as np
 import pandas as pd
+import psutil
 import pytest
 import xarray as xr
 from pywps import configuration
 
-from finch.processes import ensemble_utils
+from finch.processes import ensemble_utils, utils
 from finch.processes.utils import (
+    IntermediateDatasets,
+    close_job_log,
+    dataframes_to_parquet,
+    dataset_to_dataframe,
+    dataset_to_netcdf,
     drs_filename,
+    format_decimals,
+    get_attributes_from_config,
+    get_datasets_config,
     is_opendap_url,
+    iter_dataframes,
     netcdf_file_list_to_csv,
+    register_opendap_url,
     valid_filename,
+    write_log,
     zip_files,
 )
 
@@ -67,6 +82,42 @@ def test_netcdf_file_list_to_csv_to_zip():
                 assert False, "Unknown calendar type"
 
 
+def test_netcdf_file_list_to_parquet(tmp_path):
+    import pyarrow.parquet as pq
+
+    netcdf_files = sorted((test_data / "bccaqv2_single_cell").glob("tasmin*.nc"))[:5]
+
+    csv_files, _ = netcdf_file_list_to_csv(netcdf_files, tmp_path / "csv", "prefix")
+    parquet_files, _ = netcdf_file_list_to_csv(
+        netcdf_files, tmp_path / "parquet", "prefix", output_format="parquet"
+    )
+
+    assert [Path(f).stem for f in parquet_files] == [Path(f).stem for f in csv_files]
+    for csv_file, parquet_file in zip(csv_files, parquet_files):
+        expected = pd.read_csv(csv_file)
+        table = pq.read_table(parquet_file)
+        df = table.to_pandas()
+        assert list(df.columns) == list(expected.columns)
+        np.testing.assert_allclose(df.iloc[:, 3:], expected.iloc[:, 3:])
+        assert set(table.schema.metadata) >= {c.encode() for c in df.columns[3:]}
+
+
+def test_dataframes_to_parquet_cftime(tmp_path):
+    import cftime
+    import pyarrow.parquet as pq
+
+    dates = [None] + [cftime.DatetimeNoLeap(2000, 1, day) for day in (1, 2)]
+    df = pd.DataFrame({"time": dates, "tas": [1.0, 2.0, 3.0]})
+    dataframes_to_parquet([df.iloc[:2], df.iloc[2:]], tmp_path / "out.parquet")
+
+    table = pq.read_table(tmp_path / "out.parquet")
+    assert table.column("time").to_pylist() == [
+        "None",
+        "2000-01-01 00:00:00",
+        "2000-01-02 00:00:00",
+    ]
+
+
 def test_netcdf_file_list_to_csv_bad_hours():
     here = Path(__file__).parent
     folder = here / "data" / "bccaqv2_single_cell"
@@ -122,6 +173,44 @@ def test_is_opendap_url():
     assert not is_opendap_url(url)
 
 
+def test_is_opendap_url_cached(thredds_server, monkeypatch):
+    monkeypatch.setattr(utils, "_opendap_urls", utils.LRUCache())
+    root = thredds_server.url.replace("/catalog.xml", "")
+
+    dap_url = f"{root}/thredds/dodsC/birdhouse/tasmin_2017.nc"
+    assert is_opendap_url(dap_url)
+    assert is_opendap_url(dap_url)
+    # Other files under the same prefix are not probed
+    assert is_opendap_url(dap_url.replace("2017", "2018"))
+    assert thredds_server.requests["/thredds/dodsC/birdhouse/tasmin_2017.nc"] == 1
+    assert len(thredds_server.requests) == 1
+
+    file_url = dap_url.replace("dodsC", "fileServer")
+    assert not is_opendap_url(file_url)
+    assert not is_opendap_url(file_url)
+    assert thredds_server.requests["/thredds/fileServer/birdhouse/tasmin_2017.nc"] == 1
+
+    registered = f"{root}/thredds/dodsC/other/tasmax_2017.nc"
+    register_opendap_url(registered)
+    assert is_opendap_url(registered)
+    assert len(thredds_server.requests) == 2
+
+
+def test_lru_cache():
+    cache = utils.LRUCache(maxsize=2)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache.get("a") == 1
+    cache["c"] = 3
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert len(cache) == 2
+
+    cache = utils.LRUCache(ttl=-1)
+    cache["a"] = 1
+    assert cache.get("a", "expired") == "expired"
+
+
 def test_make_file_groups():
     folder = Path(__file__).parent / "data" / "bccaqv2_single_cell"
     files_list = list(folder.glob("*.nc"))
@@ -167,3 +256,225 @@ def test_drs_filename_cordex():
 def test_invalid_filename():
     with pytest.raises(ValueError):
         valid_filename("./..")
+
+
+def _peak_rss_growth(function):
+    """Call `function` and return the peak growth of the resident memory while it runs, in bytes."""
+    process = psutil.Process()
+    start = peak = process.memory_info().rss
+    done = threading.Event()
+
+    def _sample():
+        nonlocal peak
+        while not done.wait(0.005):
+            peak = max(peak, process.memory_info().rss)
+
+    sampler = threading.Thread(target=_sample)
+    sampler.start()
+    try:
+        function()
+    finally:
+        done.set()
+        sampler.join()
+    return peak - start
+
+
+def test_dataset_to_netcdf_memory_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        utils,
+        "get_config_value",
+        lambda section, key: "16" if key == "write_memory_budget" else "",
+    )
+    monkeypatch.setattr(utils, "cpu_count", lambda: 4)
+    threads = set()
+
+    def ones(block):
+        threads.add(threading.get_ident())
+        return np.ones_like(block)
+
+    shape = (2000, 100, 100)  # 160 MB of float64
+    data = da.arange(shape[0], dtype="float64", chunks=25)[:, np.newaxis, np.newaxis]
+    data = data * da.zeros(shape, chunks=(25, 100, 100)).map_blocks(ones)
+    ds = xr.Dataset(
+        {"tas": (("time", "lat", "lon"), data)},
+        coords={"time": pd.date_range("2000-01-01", periods=shape[0])},
+    )
+    output = tmp_path / "out.nc"
+
+    growth = _peak_rss_growth(lambda: dataset_to_netcdf(ds, output))
+
+    assert growth < 64 * 1024**2
+    # Computed by the threads sharing the budget
+    assert len(threads) > 1
+    with xr.open_dataset(output) as written:
+        assert written.tas.shape == shape
+        assert (written.tas[-1] == shape[0] - 1).all()
+
+
+@pytest.mark.parametrize("precision", [0, 1, 3])
+def test_format_decimals(precision):
+    values = np.random.default_rng(0).normal(0, 100, 1000)
+    values = np.concatenate(
+        [values, values.round(precision + 1), [np.nan, -0.0, -0.001, 1.115, 2.5, 1e20]]
+    )
+
+    formatted = format_decimals(values, precision)
+
+    expected = [f"{x:.{precision}f}" if not np.isnan(x) else "" for x in values]
+    assert formatted.tolist() == expected
+
+
+@pytest.mark.parametrize("realization", [True, False])
+def test_iter_dataframes(realization):
+    shape = {"scenario": 2, "lat": 3, "lon": 4, "time": 5}
+    if realization:
+        shape = {"realization": 2, **shape}
+    data = np.random.default_rng(0).random(tuple(shape.values()))
+    ds = xr.Dataset(
+        {"tas": (tuple(shape), data), "pr": (tuple(shape), data * 2)},
+        coords={
+            "scenario": ["ssp245", "ssp585"],
+            "lat": [46.0, 45.0, 47.0],  # unsorted
+            "lon": [-73.0, -72.0, -71.0, -70.0],
+            "time": pd.date_range("2000-01-01", periods=5),
+        },
+    )
+    if realization:
+        ds = ds.assign_coords(realization=["model1", "model2"])
+
+    blocks = list(iter_dataframes(ds, rows_per_block=7))
+
+    assert len(blocks) > 1
+    pd.testing.assert_frame_equal(pd.concat(blocks), dataset_to_dataframe(ds.copy()))
+
+
+def test_zip_files(tmp_path):
+    (tmp_path / "metadata").mkdir()
+    (tmp_path / "metadata" / "tas.csv").write_text("# tas\n" * 1000)
+    (tmp_path / "out.csv").write_text("time,tas\n" + "2000-01-01,1.0\n" * 1000)
+    ds = xr.Dataset({"tas": ("time", np.zeros(10000))})
+    ds.to_netcdf(tmp_path / "zeros.nc")
+    ds = xr.Dataset({"tas": ("time", np.random.default_rng(0).random(10000))})
+    ds.to_netcdf(tmp_path / "random.nc", encoding={"tas": {"zlib": True}})
+    files = ["out.csv", "zeros.nc", "random.nc", "metadata"]
+
+    zip_files(tmp_path / "out.zip", [tmp_path / f for f in files])
+
+    with zipfile.ZipFile(tmp_path / "out.zip") as z:
+        assert z.testzip() is None
+        assert z.namelist() == ["out.csv", "zeros.nc", "random.nc", "metadata/tas.csv"]
+        for info in z.infolist():
+            assert z.read(info) == (tmp_path / info.filename).read_bytes()
+        assert {i.filename for i in z.infolist() if i.compress_type == 0} == {
+            "random.nc"
+        }
+
+
+def test_write_log_throttled(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        utils,
+        "get_config_value",
+        lambda section, key: "3600" if key == "status_update_interval" else "",
+    )
+    updates = []
+    process = SimpleNamespace(
+        workdir=str(tmp_path),
+        status_percentage_steps={"start": 5, "compute": 10, "done": 99},
+        response=SimpleNamespace(
+            status_percentage=0,
+            update_status=lambda message, status_percentage: updates.append(
+                (message, status_percentage)
+            ),
+        ),
+    )
+
+    write_log(process, "Started", process_step="start")
+    for n in range(100):
+        write_log(process, f"Message {n}", subtask_percentage=n)
+    write_log(process, "Computing", process_step="compute")
+    write_log(process, "Halfway", subtask_percentage=50)
+    assert updates == [("Started", 5), ("Computing", 10)]
+
+    close_job_log(process)
+    assert updates[-1] == ("Halfway", 54)
+    lines = (tmp_path / "log.txt").read_text().splitlines()
+    assert len(lines) == 103
+    assert lines[-1] == "Halfway"
+
+
+def test_get_datasets_config_cached(tmp_path, monkeypatch):
+    dataset = """
+  local: true
+  path: {path}
+  pattern: "{{variable}}_{{model}}_{{scenario}}.nc"
+  allowed_values: {{scenario: [rcp45], variable: [tas], model: [CanESM2]}}
+"""
+    path = tmp_path / "datasets.yml"
+    path.write_text("first:" + dataset.format(path=tmp_path))
+    monkeypatch.setattr(
+        utils,
+        "get_config_value",
+        lambda section, key: str(path) if key == "datasets_config" else "",
+    )
+
+    first = get_datasets_config()
+    assert get_datasets_config()["first"] is first["first"]
+    pattern = first["first"].compiled_pattern
+    assert pattern is first["first"].compiled_pattern
+    assert pattern.parse("tas_CanESM2_rcp45.nc").named["model"] == "CanESM2"
+
+    # Parsed again when the file changes
+    path.write_text(path.read_text() + "second:" + dataset.format(path=tmp_path))
+    second = get_datasets_config()
+    assert list(second) == ["first", "second"]
+    assert second["first"] == first["first"]
+    assert second["first"] is not first["first"]
+
+
+def test_get_attributes_from_config():
+    config = configuration.CONFIG
+    attributes = get_attributes_from_config()
+    assert attributes["institute_id"] == "CCCS"
+    assert get_attributes_from_config() == attributes
+
+    config.set("finch:metadata", "domain", "CA")
+    try:
+        assert get_attributes_from_config() == {**attributes, "domain": "CA"}
+    finally:
+        config.remove_option("finch:metadata", "domain")
+    assert get_attributes_from_config() == attributes
+
+    # The environment variables are defaults of all sections
+    name = next(iter(config.defaults()))
+    assert name not in attributes
+    config.set("finch:metadata", name, "finch")
+    try:
+        assert get_attributes_from_config() == {**attributes, name: "finch"}
+    finally:
+        config.remove_option("finch:metadata", name)
+
+
+def test_intermediate_datasets(tmp_path):
+    ds = xr.Dataset({"tas": ("x", np.arange(100.0))})  # 800 bytes
+    intermediates = IntermediateDatasets(limit=1000)
+
+    kept = intermediates.put(ds, tmp_path / "kept.nc")
+    assert kept in intermediates
+    assert not kept.exists()
+    assert intermediates.open(kept) is ds
+    assert intermediates.available() == 200
+
+    written = intermediates.put(ds, tmp_path / "written.nc")
+    assert written not in intermediates
+    xr.testing.assert_identical(intermediates.open(written).load(), ds)
+
+    lazy = intermediates.put(ds.chunk(), tmp_path / "lazy" / "lazy.nc")
+    assert lazy in intermediates
+    assert intermediates.available() == 200
+
+    intermediates.release(tmp_path / "lazy")
+    assert lazy not in intermediates
+    assert kept in intermediates
+    intermediates.release(tmp_path)
+    assert kept not in intermediates
+    assert intermediates.available() == 1000
@@ -1,9 +1,13 @@
+import copy
+
 import pywps.configuration
+from pywps.response.capabilities import CapabilitiesResponse
 
 import finch.processes.utils
 from _common import CFG_FILE, client_for
 from finch.processes import get_indicators, get_processes, not_implemented
 from finch.processes.utils import get_virtual_modules
+from finch.processes.wps_base import LazyProcess
 from finch.wsgi import create_app
 
 
@@ -56,3 +60,72 @@ def test_wps_caps_no_datasets(client, monkeypatch):
     assert len(
         indicators
     ) + others + subset_processes_count + sdba_processes_count == len(names)
+
+
+def test_wps_caps_lazy_processes():
+    """Check that GetCapabilities does not build the processes, and DescribeProcess builds only one."""
+    service = create_app(cfgfiles=CFG_FILE)
+    client = client_for(service)
+    lazy = [p for p in service.processes.values() if isinstance(p, LazyProcess)]
+    assert len(lazy) > 100
+
+    resp = client.get(service="wps", request="getcapabilities", version="1.0.0")
+    titles = resp.xpath("/wps:Capabilities/wps:ProcessOfferings/wps:Process/ows:Title")
+    assert [t.text or "" for t in titles] == [
+        p.title for p in service.processes.values()
+    ]
+    assert not any(p.built for p in lazy)
+
+    identifier = "ensemble_grid_point_tg_mean"
+    resp = client.get(
+        service="wps",
+        request="describeprocess",
+        version="1.0.0",
+        identifier=identifier,
+    )
+    inputs = resp.xpath_text(
+        "/wps:ProcessDescriptions/ProcessDescription/DataInputs/Input/ows:Identifier"
+    ).split()
+    assert "perc_tas" not in inputs and "lat" in inputs
+    assert [p.identifier for p in lazy if p.built] == [identifier]
+    assert copy.deepcopy(service.processes[identifier]).inputs[0].identifier == "lat"
+
+
+def test_wps_caps_cached(monkeypatch):
+    service = create_app(cfgfiles=CFG_FILE)
+    client = client_for(service)
+    renders = []
+    construct_doc = CapabilitiesResponse._construct_doc
+    monkeypatch.setattr(
+        CapabilitiesResponse,
+        "_construct_doc",
+        lambda self: renders.append(self) or construct_doc(self),
+    )
+
+    def _get_titles():
+        resp = client.get(service="wps", request="getcapabilities", version="1.0.0")
+        return resp.xpath_text("/wps:Capabilities/ows:ServiceIdentification/ows:Title")
+
+    # Rendered when the service was created
+    title = _get_titles()
+    assert _get_titles() == title
+    assert renders == []
+
+    config = pywps.configuration.CONFIG
+    config.set("metadata:main", "identification_title", "Cached finch")
+    try:
+        assert _get_titles() == "Cached finch"
+        assert _get_titles() == "Cached finch"
+        assert len(renders) == 1
+    finally:
+        config.set("metadata:main", "identification_title", title)
+
+    del service.processes["tg_mean"]
+    resp = client.get(service="wps", request="getcapabilities", version="1.0.0")
+    assert (
+        "tg_mean"
+        not in resp.xpath_text(
+            "/wps:Capabilities/wps:ProcessOfferings/wps:Process/ows:Identifier"
+        ).split()
+    )
+    assert len(renders) == 2
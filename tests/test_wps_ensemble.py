@@ -1,15 +1,27 @@
+import threading
 import zipfile
 from collections import namedtuple
+from dataclasses import replace
 from pathlib import Path
+from types import SimpleNamespace
 
 import geojson
 import numpy as np
 import pytest
+import xarray as xr
+import xclim
 from pywps.app.exceptions import ProcessError
 from xarray import open_dataset
 
-from _utils import execute_process, wps_literal_input
-from finch.processes import ensemble_utils
+from _utils import (
+    execute_process,
+    load_output,
+    set_ensemble_evaluation,
+    wps_literal_input,
+)
+from finch.processes import ensemble_utils, executor, utils
+from finch.processes.cache import PercentileCache
+from finch.processes.utils import IntermediateDatasets, close_job_log, write_log
 
 mock_filenames = [
     "tasmax_bcc-csm1-1_rcp45_subset.nc",
@@ -142,6 +154,34 @@ def test_ensemble_tx_mean_grid_point_no_perc_csv(client):
     assert n_data_rows == 4  # lat=1, lon=1, time=4 (last month
 
 
+def test_ensemble_tx_mean_grid_point_no_perc_parquet(client):
+    import pyarrow.parquet as pq
+
+    # --- given ---
+    identifier = "ensemble_grid_point_tx_mean"
+    inputs = [
+        wps_literal_input("lat", "46"),
+        wps_literal_input("lon", "-72.8"),
+        wps_literal_input("scenario", "rcp45"),
+        wps_literal_input("dataset", "test_subset"),
+        wps_literal_input("freq", "MS"),
+        wps_literal_input("ensemble_percentiles", ""),
+        wps_literal_input("output_format", "parquet"),
+        wps_literal_input("output_name", "testens"),
+    ]
+
+    # --- when ---
+    outputs = execute_process(client, identifier, inputs)
+
+    # --- then ---
+    assert len(outputs) == 1
+    table = pq.read_table(outputs[0])
+    assert table.column_names[:4] == ["lat", "lon", "time", "scenario"]
+    assert all(name.startswith("tx_mean:") for name in table.column_names[-2:])
+    assert table.num_rows == 4
+    assert b"tx_mean" in table.schema.metadata[b"metadata"]
+
+
 def test_ensemble_heatwave_frequency_grid_point_no_perc(client):
     # --- given ---
     identifier = "ensemble_grid_point_heat_wave_frequency"
@@ -550,6 +590,359 @@ def test_ensemble_compute_intermediate_growing_degree_days_grid_point(client):
         assert variable_dims == {"region": 1, "time": 1, "scenario": 1}
 
 
+@pytest.mark.parametrize(
+    "identifier,inputs",
+    [
+        (
+            "ensemble_bbox_heat_wave_frequency",
+            [
+                wps_literal_input("lat0", "46.0"),
+                wps_literal_input("lat1", "46.2"),
+                wps_literal_input("lon0", "-73.0"),
+                wps_literal_input("lon1", "-72.8"),
+                wps_literal_input("scenario", "rcp26"),
+                wps_literal_input("scenario", "rcp45"),
+                wps_literal_input("thresh_tasmin", "22.0 degC"),
+                wps_literal_input("thresh_tasmax", "30 degC"),
+                wps_literal_input("window", "3"),
+                wps_literal_input("freq", "MS"),
+                wps_literal_input("ensemble_percentiles", "None"),
+            ],
+        ),
+        (
+            "ensemble_grid_point_cold_spell_duration_index",
+            [
+                wps_literal_input("lat", "46"),
+                wps_literal_input("lon", "-72.8"),
+                wps_literal_input("scenario", "rcp26"),
+                wps_literal_input("window", "6"),
+                wps_literal_input("freq", "YS"),
+                wps_literal_input("perc_tasmin", "10"),
+                wps_literal_input("ensemble_percentiles", "20, 50, 80"),
+            ],
+        ),
+    ],
+)
+def test_ensemble_evaluation_modes(client, monkeypatch, identifier, inputs):
+    inputs = inputs + [
+        wps_literal_input("dataset", "test_subset"),
+        wps_literal_input("output_format", "netcdf"),
+    ]
+    results = {}
+    for mode in ["members", "stacked"]:
+        set_ensemble_evaluation(monkeypatch, mode)
+        outputs = execute_process(client, identifier, inputs)
+        results[mode] = load_output(outputs[0])
+
+    xr.testing.assert_allclose(results["stacked"], results["members"])
+    assert results["stacked"].attrs == results["members"].attrs
+    for name, var in results["stacked"].variables.items():
+        assert var.attrs == results["members"][name].attrs
+
+
+def test_compute_stacked_indices_grids(monkeypatch, tmp_path):
+    intermediates = IntermediateDatasets(limit=2**20)
+    time = xr.cftime_range("2000-01-01", periods=3, freq="D", calendar="noleap")
+    input_groups = []
+    for n, lat in enumerate([[45.5, 46.0], [45.5, 46.0], [47.0, 47.5]]):
+        ds = xr.Dataset(
+            {"tasmax": (("time", "lat"), np.full((3, 2), float(n)))},
+            coords={"time": time, "lat": lat},
+        )
+        path = intermediates.put(ds, tmp_path / f"tasmax_{n}.nc")
+        input_groups.append({"tasmax": [SimpleNamespace(file=path)]})
+    stacks = []
+
+    def compute_indices(process, indicator, inputs, stacked):
+        stacks.append(stacked["tasmax"].realization.size)
+        return stacked["tasmax"]
+
+    monkeypatch.setattr(ensemble_utils, "compute_indices", compute_indices)
+    outputs = ensemble_utils.compute_stacked_indices(
+        None, xclim.atmos.tx_mean, input_groups, intermediates
+    )
+
+    # The members on another grid are not outer-joined with the others
+    assert stacks == [2, 1]
+    for n, output in enumerate(outputs):
+        assert output.lat.size == 2
+        assert (output.tasmax == n).all()
+
+
+def test_ensemble_intermediates_in_memory(client, monkeypatch):
+    identifier = "ensemble_grid_point_cold_spell_duration_index"
+    inputs = [
+        wps_literal_input("lat", "46"),
+        wps_literal_input("lon", "-72.8"),
+        wps_literal_input("scenario", "rcp26"),
+        wps_literal_input("dataset", "test_subset"),
+        wps_literal_input("window", "6"),
+        wps_literal_input("freq", "YS"),
+        wps_literal_input("perc_tasmin", "10"),
+        wps_literal_input("ensemble_percentiles", "20, 50, 80"),
+        wps_literal_input("output_format", "netcdf"),
+    ]
+    results = {}
+    for limit in [0, 2**20]:
+        stores = []
+
+        kept = []
+
+        def make_store(limit=limit):
+            store = IntermediateDatasets(limit=limit)
+            put = store.put
+
+            def spy_put(ds, path):
+                path = put(ds, path)
+                if path in store:
+                    kept.append(path)
+                return path
+
+            store.put = spy_put
+            stores.append(store)
+            return store
+
+        monkeypatch.setattr(ensemble_utils, "IntermediateDatasets", make_store)
+        outputs = execute_process(client, identifier, inputs)
+        results[limit] = load_output(outputs[0])
+
+        (store,) = stores
+        # Subsets and tasmin_per of the 2 members
+        assert len(kept) == (4 if limit else 0)
+        assert not any(path.exists() for path in kept)
+        # Released after the ensemble of the scenario was made
+        assert not any(path in store for path in kept)
+        assert store.available() == limit
+
+    xr.testing.assert_identical(results[2**20], results[0])
+
+
+def test_scenario_process_progress(tmp_path):
+    updates = []
+    process = SimpleNamespace(
+        workdir=str(tmp_path),
+        identifier="ensemble_grid_point_tx_mean",
+        status_percentage_steps={"start": 5, "subset": 7, "compute_indices": 50},
+        response=SimpleNamespace(
+            status_percentage=0,
+            update_status=lambda message, status_percentage: updates.append(
+                (message, status_percentage)
+            ),
+        ),
+    )
+    write_log(process, "Started", process_step="start")
+
+    views = ensemble_utils.ScenarioProcess.for_scenarios(process, ["ssp245", "ssp585"])
+    assert views["ssp245"].workdir == str(tmp_path / "ssp245")
+    assert (tmp_path / "ssp585").is_dir()
+    assert views["ssp585"].identifier == process.identifier
+
+    write_log(views["ssp245"], "Subset ssp245", process_step="subset")
+    write_log(views["ssp245"], "Indices ssp245", process_step="compute_indices")
+    write_log(views["ssp585"], "Subset ssp585", process_step="subset")
+    write_log(views["ssp585"], "Halfway ssp585", subtask_percentage=50)
+    close_job_log(process)
+
+    # Each scenario goes through the steps on its own, the job's status is their mean
+    assert updates == [
+        ("Started", 5),
+        ("Subset ssp245", 6),
+        ("Indices ssp245", 27),
+        ("Subset ssp585", 28),
+        ("Halfway ssp585", 39),
+    ]
+    lines = (tmp_path / "log.txt").read_text().splitlines()
+    assert lines[-1] == "Halfway ssp585"
+
+
+def test_ensemble_scenarios_concurrently(client, monkeypatch):
+    identifier = "ensemble_grid_point_tx_mean"
+    inputs = [
+        wps_literal_input("lat", "46"),
+        wps_literal_input("lon", "-72.8"),
+        wps_literal_input("scenario", "rcp26"),
+        wps_literal_input("scenario", "rcp45"),
+        wps_literal_input("dataset", "test_subset"),
+        wps_literal_input("freq", "YS"),
+        wps_literal_input("ensemble_percentiles", "20, 50, 80"),
+        wps_literal_input("output_format", "netcdf"),
+    ]
+    threads = set()
+    make_indicator_inputs = ensemble_utils.make_indicator_inputs
+
+    def spy(*args, **kwargs):
+        threads.add(threading.current_thread().name.split("_")[0])
+        return make_indicator_inputs(*args, **kwargs)
+
+    monkeypatch.setattr(ensemble_utils, "make_indicator_inputs", spy)
+    get_config_value = executor.get_config_value
+
+    results = {}
+    for subset_threads in ["1", "4"]:
+        monkeypatch.setattr(
+            executor,
+            "get_config_value",
+            lambda section, key: (
+                subset_threads
+                if key == "subset_threads"
+                else get_config_value(section, key)
+            ),
+        )
+        executor.shutdown()
+        try:
+            outputs = execute_process(client, identifier, inputs)
+        finally:
+            executor.shutdown()
+        results[subset_threads] = load_output(outputs[0])
+
+    # Sequentially in the request's thread, then in a thread of each scenario
+    assert threads == {threading.current_thread().name, "finch-scenario"}
+    # The attributes are those of the first member, which depends on the subsets' order
+    xr.testing.assert_equal(results["4"], results["1"])
+
+
+def test_ensemble_percentile_cache_warm_up(client, monkeypatch, tmp_path):
+    identifier = "ensemble_grid_point_cold_spell_duration_index"
+    inputs = [
+        wps_literal_input("lat", "46"),
+        wps_literal_input("lon", "-72.8"),
+        wps_literal_input("scenario", "rcp26"),
+        wps_literal_input("dataset", "test_subset"),
+        wps_literal_input("window", "6"),
+        wps_literal_input("freq", "YS"),
+        wps_literal_input("perc_tasmin", "10"),
+        wps_literal_input("ensemble_percentiles", "20, 50, 80"),
+        wps_literal_input("output_format", "netcdf"),
+    ]
+    results = {}
+
+    monkeypatch.setattr(ensemble_utils, "get_percentile_cache", lambda: None)
+    outputs = execute_process(client, identifier, inputs)
+    results["computed"] = load_output(outputs[0])
+
+    percentile_cache = PercentileCache(tmp_path / "percentiles", max_size=10**9)
+    monkeypatch.setattr(
+        ensemble_utils, "get_percentile_cache", lambda: percentile_cache
+    )
+    count = ensemble_utils.warm_percentile_cache(
+        "test_subset",
+        ["tasmin_per"],
+        [10],
+        tmp_path,
+        scenarios=["rcp26"],
+        lat="46",
+        lon="-72.8",
+    )
+    assert count == 2
+    assert len(list(percentile_cache.root.iterdir())) == 2
+
+    def percentile_doy(*args, **kwargs):
+        raise AssertionError("The percentiles should be cached")
+
+    monkeypatch.setattr(ensemble_utils, "percentile_doy", percentile_doy)
+    outputs = execute_process(client, identifier, inputs)
+    results["cached"] = load_output(outputs[0])
+
+    xr.testing.assert_identical(results["cached"], results["computed"])
+
+
+def _write_historical_files(path: Path, corrupt_history: bool = False):
+    """Write files of "historical+rcpXX" scenarios sharing their data until 2001."""
+    path.mkdir()
+    time = xr.cftime_range("2000-01-01", "2003-12-31", freq="D", calendar="noleap")
+    rng = np.random.default_rng(0)
+    for model in ["inmcm4", "bcc-csm1-1"]:
+        data = 280 + 10 * rng.random((time.size, 2, 2))
+        for scenario, warming in [("rcp26", 0), ("rcp45", 3)]:
+            values = data + warming * (time.year >= 2002)[:, None, None]
+            if corrupt_history and scenario == "rcp45":
+                values = values + 10 * (time.year < 2002)[:, None, None]
+            ds = xr.Dataset(
+                {
+                    "tasmax": (
+                        ("time", "lat", "lon"),
+                        values.astype("float32"),
+                        {"units": "K", "standard_name": "air_temperature"},
+                    )
+                },
+                coords={
+                    "time": time,
+                    "lat": ("lat", [45.5, 46.0], {"units": "degrees_north"}),
+                    "lon": ("lon", [-73.0, -72.5], {"units": "degrees_east"}),
+                },
+            )
+            ds.to_netcdf(path / f"tasmax_{model}_historical+{scenario}_subset.nc")
+
+
+@pytest.mark.parametrize("mode", ["stacked", "members"])
+def test_ensemble_shared_history(client, monkeypatch, tmp_path, mode):
+    set_ensemble_evaluation(monkeypatch, mode)
+    identifier = "ensemble_grid_point_tx_mean"
+    inputs = [
+        wps_literal_input("lat", "46"),
+        wps_literal_input("lon", "-72.5"),
+        wps_literal_input("scenario", "rcp26"),
+        wps_literal_input("scenario", "rcp45"),
+        wps_literal_input("dataset", "test_subset"),
+        wps_literal_input("freq", "YS"),
+        wps_literal_input("ensemble_percentiles", "20, 50, 80"),
+        wps_literal_input("output_format", "netcdf"),
+    ]
+    _write_historical_files(tmp_path / "clean")
+    # The history of rcp45 differs from the one of rcp26, it can't be reused
+    _write_historical_files(tmp_path / "corrupt", corrupt_history=True)
+    test_subset = ensemble_utils.get_datasets_config()["test_subset"]
+    spliced = []
+    splice = ensemble_utils.SharedHistory.splice
+
+    def spy(self, scenario, *args):
+        spliced.append(scenario)
+        return splice(self, scenario, *args)
+
+    monkeypatch.setattr(ensemble_utils.SharedHistory, "splice", spy)
+
+    for name in ["clean", "corrupt"]:
+        results = {}
+        for historical_end in [None, "2001-12-31"]:
+            dsconf = replace(
+                test_subset, path=str(tmp_path / name), historical_end=historical_end
+            )
+            monkeypatch.setattr(
+                ensemble_utils, "get_datasets_config", lambda: {"test_subset": dsconf}
+            )
+            outputs = execute_process(client, identifier, inputs)
+            results[historical_end] = load_output(outputs[0])
+
+        assert results[None].time.size == 4
+        xr.testing.assert_identical(results["2001-12-31"], results[None])
+        assert spliced == ["rcp45"]
+
+
+def test_shared_history_end_datasets(monkeypatch):
+    get_config_value = utils.get_config_value
+    monkeypatch.setattr(
+        utils,
+        "get_config_value",
+        lambda section, key: (
+            "datasets.yml"
+            if key == "datasets_config"
+            else get_config_value(section, key)
+        ),
+    )
+    datasets = utils.get_datasets_config()
+    inputs = {"freq": [SimpleNamespace(data="YS")]}
+
+    # The historical period of the shipped datasets is shared by their scenarios
+    for name, end in [("candcs-u5", "2005-12-31"), ("candcs-u6", "2014-12-31")]:
+        scenarios = datasets[name].allowed_values["scenario"]
+        assert (
+            ensemble_utils.shared_history_end(
+                datasets[name], xclim.atmos.tx_mean, inputs, scenarios, set()
+            )
+            == end
+        )
+
+
 def test_ensemble_heatwave_frequency_polygon(client):
     # --- given ---
     identifier = "ensemble_polygon_heat_wave_frequency"
@@ -4,12 +4,14 @@ from pathlib import Path
 import numpy as np
 import pytest
 import xarray as xr
+from clisops.core.subset import subset_bbox
 from pywps import Service
 from pywps.tests import assert_response_success, client_for
 
 from _common import CFG_FILE, get_output
 from _utils import execute_process, wps_literal_input
 from finch.processes import SubsetBboxProcess
+from finch.processes.subset import slab_indexers
 
 
 def test_wps_subsetbbox(netcdf_datasets):
@@ -74,3 +76,33 @@ def test_wps_subsetbbox_dataset(client, outfmt):
                 "lat": 6,
                 "time": 100,
             }
+
+
+@pytest.mark.parametrize(
+    "lon_bnds,lat_bnds,start_date,end_date,reduced",
+    [
+        ([-73.3, -72.8], [45.7, 46.1], None, None, True),
+        ([-73.3, -72.8], [45.7, 46.1], "1950-02", "1950-03-15", True),
+        ([-80, -70], [40, 50], None, None, False),
+    ],
+)
+def test_slab_indexers_bbox(lon_bnds, lat_bnds, start_date, end_date, reduced):
+    ds = xr.open_dataset(
+        Path(__file__).parent
+        / "data"
+        / "bccaqv2_subset_sample"
+        / "tasmax_bcc-csm1-1_rcp45_subset.nc"
+    )
+    if start_date:
+        # Same dataset, with longitudes from 0 to 360
+        ds = ds.assign_coords(lon=ds.lon % 360)
+    bounds = dict(
+        lon_bnds=lon_bnds, lat_bnds=lat_bnds, start_date=start_date, end_date=end_date
+    )
+
+    indexers = slab_indexers(ds, **bounds)
+    slab = ds.isel(indexers)
+
+    assert set(indexers) == {"lon", "lat"} | ({"time"} if start_date else set())
+    assert (slab.tasmax.size < ds.tasmax.size) == reduced
+    xr.testing.assert_identical(subset_bbox(slab, **bounds), subset_bbox(ds, **bounds))
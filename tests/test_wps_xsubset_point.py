@@ -3,6 +3,7 @@ from pathlib import Path
 
 import pytest
 import xarray as xr
+from clisops.core.subset import subset_gridpoint
 from numpy.testing import assert_array_equal
 from pywps import Service
 from pywps.tests import assert_response_success, client_for
@@ -10,6 +11,7 @@ from pywps.tests import assert_response_success, client_for
 from _common import CFG_FILE, get_metalinks, get_output
 from _utils import execute_process, wps_literal_input
 from finch.processes import SubsetGridPointProcess
+from finch.processes.subset import slab_indexers
 
 
 def test_wps_xsubsetpoint(netcdf_datasets):
@@ -154,3 +156,27 @@ def test_wps_subsetpoint_dataset(client, outfmt):
                 "region": 1,
                 "time": 100,
             }
+
+
+@pytest.mark.parametrize(
+    "lon,lat,start_date,end_date",
+    [
+        ([-73.0], [46.0], None, None),
+        ([-73.4, 287.0], [45.5, 46.4], "1950-02-01", "1950-02"),
+    ],
+)
+def test_slab_indexers_gridpoint(lon, lat, start_date, end_date):
+    ds = xr.open_dataset(
+        Path(__file__).parent
+        / "data"
+        / "bccaqv2_subset_sample"
+        / "tasmax_bcc-csm1-1_rcp45_subset.nc"
+    )
+    points = dict(lon=lon, lat=lat, start_date=start_date, end_date=end_date)
+
+    slab = ds.isel(slab_indexers(ds, **points))
+
+    assert slab.tasmax.size < ds.tasmax.size
+    xr.testing.assert_identical(
+        subset_gridpoint(slab, **points), subset_gridpoint(ds, **points)
+    )
@@ -0,0 +1,39 @@
+import gc
+from types import SimpleNamespace
+
+from pywps.configuration import get_config_value
+
+from _common import CFG_FILE
+from finch import gunicorn_conf, wsgi
+from finch.processes import catalog
+from finch.processes.utils import get_datasets_config
+
+
+def test_warm_up(tmp_path, monkeypatch):
+    def mock_config_get(section, key):
+        if key == "catalog_index_dir":
+            return str(tmp_path)
+        return get_config_value(section, key)
+
+    monkeypatch.setattr(catalog, "get_config_value", mock_config_get)
+    service = wsgi.create_app(cfgfiles=CFG_FILE)
+    service._docs.clear()
+
+    wsgi.warm_up(service)
+
+    for dsconf in get_datasets_config().values():
+        assert catalog.get_catalog_index(dsconf).updated is not None
+    assert len(list(tmp_path.glob("*.sqlite"))) == len(get_datasets_config())
+    assert service._docs
+
+
+def test_gunicorn_when_ready(monkeypatch):
+    warmed_up = []
+    monkeypatch.setattr(wsgi, "warm_up", warmed_up.append)
+    try:
+        gunicorn_conf.when_ready(SimpleNamespace())
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+    assert warmed_up == [wsgi.application]
+    assert gunicorn_conf.preload_app